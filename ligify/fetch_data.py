@@ -1,12 +1,230 @@
-from predict.chemical2enzymes import fetch_reactions, fetch_genes, filter_genes
-from predict.enzymes2operons import pull_regulators
-from predict.accID2operon import acc2OperonList
+import asyncio
+import os
+
+from predict.chemical2enzymes import (
+    fetch_reactions_async,
+    fetch_genes_async,
+    fetch_genes_batch_async,
+    filter_genes,
+)
+from predict.enzymes2operons import (
+    LigandMemo,
+    fetch_ligands_async,
+    has_regulator,
+    operon_ligands,
+    pull_regulators,
+)
+from predict.accID2operon import acc2OperonList_async, acc2OperonTasks_async
 from predict.rank import calculate_rank
-import requests
-from pprint import pprint
+from predict.kegg import fetch_kegg_reactions_async, merge_reactions
+from utils import AsyncRequester
+
+# Number of proteins whose regulators are pulled concurrently. pull_regulators
+# is synchronous, so each one runs in a worker thread.
+REGULATOR_CONCURRENCY = 8
+
+# Look up the proteins of all reactions with one OR'd UniProt search instead
+# of one search per reaction. Set LIGIFY_UNIPROT_BATCH=0 to disable.
+UNIPROT_BATCH = os.getenv("LIGIFY_UNIPROT_BATCH", "1") != "0"
+
+# Also look for enzymes through KEGG (compound -> EC -> genes), alongside
+# Rhea. Set LIGIFY_KEGG=1 to enable.
+KEGG_ENZYMES = os.getenv("LIGIFY_KEGG", "0") == "1"
 
 
 def fetch_data(InChiKey, filters):
+    return asyncio.run(fetch_data_async(InChiKey, filters))
+
+
+async def fetch_data_async(InChiKey, filters):
+    async with AsyncRequester() as requester:
+        return await _fetch_data(requester, InChiKey, filters)
+
+
+def iter_data(InChiKey, filters):
+    """
+    Synchronous wrapper around `stream_data_async`, yielding the same
+    ("regulator", regulator) and ("metrics", metrics) records.
+    """
+    loop = asyncio.new_event_loop()
+    records = stream_data_async(InChiKey, filters)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(records.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(records.aclose())
+        loop.close()
+
+
+async def stream_data_async(InChiKey, filters):
+    """
+    Streaming variant of `fetch_data_async`.
+
+    Yields ("regulator", regulator) as soon as each protein's operon is
+    assembled and its regulators pulled, deduplicated, filtered and ranked,
+    then a final ("metrics", metrics). Regulators arrive in completion order, so when two proteins
+    share a regulator the copy kept may differ from the one `fetch_data`
+    keeps.
+    """
+    async with AsyncRequester() as requester:
+        reactions, metrics, operon_list_entries = await _fetch_proteins(
+            requester, InChiKey, filters
+        )
+        # One task per operon, so each protein moves on to its regulators
+        # as soon as its own operon is assembled
+        operon_tasks = await acc2OperonTasks_async(requester, operon_list_entries)
+        metrics["Total operons"] = len(operon_tasks)
+
+        # Ligands are looked up per operon as it is reached rather than in
+        # one batch up front, so the first regulators are not held back
+        ligand_memo = LigandMemo()
+        semaphore = asyncio.Semaphore(REGULATOR_CONCURRENCY)
+
+        async def pull(protein, rxn):
+            refseq_id = protein["enzyme"]["ncbi_id"]
+            protein["context"] = (
+                await operon_tasks[refseq_id] if refseq_id in operon_tasks else "EMPTY"
+            )
+            async with semaphore:
+                return await asyncio.to_thread(
+                    pull_regulators, protein, rxn, ligand_memo
+                )
+
+        tasks = list(operon_tasks.values()) + [
+            asyncio.ensure_future(pull(protein, rxn))
+            for rxn in reactions["rxn_data"]
+            for protein in rxn["proteins"]
+        ]
+        pulls = tasks[len(operon_tasks) :]
+        try:
+            total_regulators = 0
+            refseq_ids = set()
+            found = 0
+            for task in asyncio.as_completed(pulls):
+                regulators = await task
+                total_regulators += len(regulators)
+                for r in regulators:
+                    # Same filters as _fetch_data: duplicates first, then promoters
+                    if r["refseq"] in refseq_ids:
+                        continue
+                    refseq_ids.add(r["refseq"])
+                    if r["protein"]["context"]["promoter"] is None:
+                        continue
+                    r["rank"] = calculate_rank(r)
+                    found += 1
+                    yield "regulator", r
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        metrics["Total regulators"] = total_regulators
+        if found == 0:
+            raise Exception(f"No regulators found for {InChiKey}")
+        yield "metrics", metrics
+
+
+async def _fetch_data(requester, InChiKey, filters):
+    reactions, metrics = await _fetch_operons(requester, InChiKey, filters)
+
+    # FETCH REGULATORS
+
+    # This is where all of the display data is created
+    semaphore = asyncio.Semaphore(REGULATOR_CONCURRENCY)
+
+    # Look up the alternative ligands of every operon in one batch, so each
+    # ChEBI ID goes to PubChem once per request
+    ligand_memo = LigandMemo()
+    operons = [
+        protein["context"]["operon"]
+        for rxn in reactions["rxn_data"]
+        for protein in rxn["proteins"]
+        if protein.get("context", "EMPTY") != "EMPTY"
+        and has_regulator(protein["context"]["operon"])
+    ]
+
+    async def ligand_ids(operon):
+        async with semaphore:
+            ligands = await asyncio.to_thread(operon_ligands, operon)
+            return ligands["ligand_ids"]
+
+    operon_ligand_ids = await asyncio.gather(*(ligand_ids(o) for o in operons))
+    await fetch_ligands_async(
+        requester, [i for ids in operon_ligand_ids for i in ids], ligand_memo
+    )
+
+    async def pull(protein, rxn):
+        async with semaphore:
+            return await asyncio.to_thread(pull_regulators, protein, rxn, ligand_memo)
+
+    pulled = await asyncio.gather(
+        *(
+            pull(protein, rxn)
+            for rxn in reactions["rxn_data"]
+            for protein in rxn["proteins"]
+        )
+    )
+    regulators = [r for regs in pulled for r in regs]
+
+    metrics["Total regulators"] = len(regulators)
+
+    # Filter out duplicate regulators
+    refseq_ids = []
+    filtered_regulators = []
+    for i in regulators:
+        if i["refseq"] not in refseq_ids:
+            filtered_regulators.append(i)
+            refseq_ids.append(i["refseq"])
+
+    # Filter out regulators without a predicted promoter
+    filtered_regulators = [
+        i
+        for i in filtered_regulators
+        if i["protein"]["context"]["promoter"] is not None
+    ]
+
+    # Create a rank for each regulator
+    for r in filtered_regulators:
+        rank = calculate_rank(r)
+        r["rank"] = rank
+
+    if filtered_regulators is None or len(filtered_regulators) == 0:
+        raise Exception(f"No regulators found for {InChiKey}")
+    else:
+        return filtered_regulators, metrics
+
+
+async def _fetch_operons(requester, InChiKey, filters):
+    """
+    Reactions, proteins and operons for a ligand: everything up to the
+    regulator stage. Returns (reactions, metrics).
+    """
+    reactions, metrics, operon_list_entries = await _fetch_proteins(
+        requester, InChiKey, filters
+    )
+
+    acc2OperonListResult = await acc2OperonList_async(requester, operon_list_entries)
+
+    metrics["Total operons"] = len(acc2OperonListResult.keys())
+
+    # Attach result to context
+    for rxn in reactions["rxn_data"]:
+        if rxn["proteins"]:
+            for protein in rxn["proteins"]:
+                refseq_id = protein["enzyme"]["ncbi_id"]
+                protein["context"] = acc2OperonListResult[refseq_id]
+
+    return reactions, metrics
+
+
+async def _fetch_proteins(requester, InChiKey, filters):
+    """
+    Reactions and filtered proteins for a ligand. Returns (reactions,
+    metrics, operon_list_entries), the last keyed by the NCBI IDs whose
+    operons are to be assembled.
+    """
     metrics = {}
 
     # Enzyme reaction databases and their ligands:
@@ -15,36 +233,68 @@ def fetch_data(InChiKey, filters):
         # BRENDA:   173,436
         # MetaCyc:  19,400
 
-    # TFBMiner gets reactions from KEGG via the REST API:
-        # https://rest.kegg.jp/get/cpd:C00511
-            # need to input KEGG compound ID, so we'd need to convert smiles into that
-            # this will return EC numbers: 1.3.1.125       2.8.3.12        3.5.1.4         3.5.5.7  
-            # from there you can use those EC numbers in new queries to get genes:
-        # https://rest.kegg.jp/get/2.8.3.12
-            # This will return the KEGG IDs of associated genes, if any:
-            # EH206_20600, EH206_20605, Sant_2230, Sant_2231, ...
-            # from here you can use each gene in a new query to get the ncbi ID:
-        # https://rest.kegg.jp/get/xct:J151_00486
-            # this returns a bunch of info, including the ncbi ID: AJD66958
-            # at this point, the workflow merges with the parallel RHEA workflow
-
-
-    # FETCH REACTIONS
-    reactions = fetch_reactions(
-        InChiKey=InChiKey, max_reactions=filters["max_reactions"]
-    )
+    # TFBMiner gets reactions from KEGG via the REST API, see predict/kegg.py
+
+    async def fetch_rhea():
+        # FETCH REACTIONS
+        reactions = await fetch_reactions_async(
+            requester, InChiKey=InChiKey, max_reactions=filters["max_reactions"]
+        )
+        if len(reactions["rxn_data"]) == 0:
+            return reactions
+
+        # FETCH GENES
+        if UNIPROT_BATCH:
+            proteins_by_rhea = await fetch_genes_batch_async(
+                requester,
+                [i["rhea_id"] for i in reactions["rxn_data"]],
+                filters["reviewed"],
+                filters["proteins_per_reaction"],
+            )
+            associated_proteins = [
+                proteins_by_rhea[i["rhea_id"]] for i in reactions["rxn_data"]
+            ]
+        else:
+            associated_proteins = await asyncio.gather(
+                *(
+                    fetch_genes_async(
+                        requester,
+                        i["rhea_id"],
+                        filters["reviewed"],
+                        filters["proteins_per_reaction"],
+                    )
+                    for i in reactions["rxn_data"]
+                )
+            )
+        for i, proteins in zip(reactions["rxn_data"], associated_proteins):
+            i["proteins"] = proteins
+        return reactions
+
+    async def fetch_kegg():
+        try:
+            return await fetch_kegg_reactions_async(
+                requester,
+                InChiKey,
+                filters["max_reactions"],
+                filters["proteins_per_reaction"],
+            )
+        except Exception as e:
+            print(f"KEGG enzyme lookup failed: {e}")
+            return []
+
+    # The KEGG walk runs alongside the Rhea and UniProt lookups
+    if KEGG_ENZYMES:
+        reactions, kegg_reactions = await asyncio.gather(fetch_rhea(), fetch_kegg())
+    else:
+        reactions, kegg_reactions = await fetch_rhea(), []
+
     total_rxns = len(reactions["rxn_data"])
     metrics["RHEA Reactions"] = total_rxns
+    if KEGG_ENZYMES:
+        metrics["KEGG Enzymes"] = len(kegg_reactions)
     
-    if total_rxns > 0:
-        # FETCH GENES
-        counter = 0
-        for i in reactions["rxn_data"]:
-            associated_proteins = fetch_genes(
-                i["rhea_id"], filters["reviewed"], filters["proteins_per_reaction"]
-            )
-            i["proteins"] = associated_proteins
-            counter += 1
+    if total_rxns + len(kegg_reactions) > 0:
+        merge_reactions(reactions, kegg_reactions)
 
         metrics["Total genes"] = sum(
             [len(i["proteins"]) for i in reactions["rxn_data"]]
@@ -77,166 +327,8 @@ def fetch_data(InChiKey, filters):
                         # ):
                         #     operon_list_entries[refseq_id] = None
 
-            acc2OperonListResult = acc2OperonList(operon_list_entries)
-
-            metrics["Total operons"] = len(acc2OperonListResult.keys())
-
-            # Attach result to context
-            for rxn in reactions["rxn_data"]:
-                if rxn["proteins"]:
-                    for protein in rxn["proteins"]:
-                        refseq_id = protein["enzyme"]["ncbi_id"]
-                        protein["context"] = acc2OperonListResult[refseq_id]
-
-            # FETCH REGULATORS
-
-            if reactions is None:
-                return None, None
-
-            else:
-                # This is where all of the display data is created
-                counter = 0
-                regulators = []
-
-                for rxn in reactions["rxn_data"]:
-                    for protein in rxn["proteins"]:
-                        regs = pull_regulators(protein, rxn)
-                        for r in regs:
-                            regulators.append(r)
-                        counter += 1
-
-                metrics["Total regulators"] = len(regulators)
-
-                # Filter out duplicate regulators
-                refseq_ids = []
-                filtered_regulators = []
-                for i in regulators:
-                    if i["refseq"] not in refseq_ids:
-                        filtered_regulators.append(i)
-                        refseq_ids.append(i["refseq"])
-
-                # Filter out regulators without a predicted promoter
-                filtered_regulators = [
-                    i
-                    for i in filtered_regulators
-                    if i["protein"]["context"]["promoter"] is not None
-                ]
-
-                # Create a rank for each regulator
-                for r in filtered_regulators:
-                    rank = calculate_rank(r)
-                    r["rank"] = rank
-
-                if filtered_regulators is None or len(filtered_regulators) == 0:
-                    raise Exception(f"No regulators found for {InChiKey}")
-                else:
-                    return filtered_regulators, metrics
+            return reactions, metrics, operon_list_entries
 
     else:
         raise Exception(f"No reaction data found for {InChiKey}")
 
-
-if __name__ == "__main__":
-
-    def get_reactions(chem:str):
-        url = "https://rest.kegg.jp/get/cpd:"
-        response = requests.get(url+chem)
-
-        if response.ok:
-            try:
-                for line in response.text.rstrip().split("\n"):
-                    section = line[:12].strip()
-                    if section == "ENZYME":
-                        index = response.text.rstrip().split("\n").index(line)
-                        reactions = line[12:].split(" ")
-                        for line in response.text.rstrip().split("\n")[int(index)+1:]:
-                            # If the current line is not part of the REACTION 
-                            # section then the processing ends.
-                            if line[:12].strip() != (""):
-                                break
-                            reactions_ = line[12:].split(" ")
-                            reactions.extend(reactions_)
-                # Eliminates erroneous IDs resulting from whitespaces.
-                reactions = [reaction for reaction in reactions if reaction != ""]
-                return reactions
-            except UnboundLocalError:
-                return []
-
-
-    def get_genes(reaction):
-        url = "https://rest.kegg.jp/get/"
-        response = requests.get(url+reaction)        
-        if response.ok:
-            try:
-                genes = []
-                for line in response.text.rstrip().split("\n"):
-                    section = line[:12].strip()
-                    if section == "GENES":
-                        index = response.text.rstrip().split("\n").index(line)
-                        for line in response.text.rstrip().split("\n")[int(index)+1:]:
-                            # If the current line is not part of the GENES 
-                            # section then the processing ends.
-                            if line[:12].strip() != (""):
-                                break
-                            genes_ = line[12:].split(" ")[0].lower() + line[12:].split(" ")[1]
-                            #print(reactions_)
-                            genes.append(genes_)
-                # Eliminates erroneous IDs resulting from whitespaces.
-                genes = [gene for gene in genes if gene != ""]
-                return genes
-            except UnboundLocalError:
-                return []        
-
-
-    def get_ncbiID(gene):
-        url = "https://rest.kegg.jp/get/"
-        response = requests.get(url+gene)        
-        if response.ok:
-            try:
-                for line in response.text.rstrip().split("\n"):
-                    section = line[:12].strip()
-                    if section == "DBLINKS":
-                        index = response.text.rstrip().split("\n").index(line)
-                        lines = []
-                        for line in response.text.rstrip().split("\n")[int(index):]:
-                            # If the current line is not part of the DBLINKS 
-                            # section then the processing ends.
-                            if line[:7] == "DBLINKS":
-                                lines.append(line)
-                            elif line[:12].strip() != (""):
-                                break
-                            else: 
-                                lines.append(line)
-                            # process the DBLINKS-specific lines
-                        for line in lines:
-                            index = 0
-                            found = False
-                            for i in line.split(" "):
-                                if i == 'NCBI-ProteinID:':
-                                    found = True
-                                    break
-                                else:
-                                    index += 1
-                            if found:
-                                return line.split(" ")[index+1]
-            except UnboundLocalError:
-                return []  
-
-
-    reactions = get_reactions('C00511')
-    genes = [k for i in reactions for k in get_genes(i)]
-    print(len(genes))
-    ncbiIDs = []
-    for i in genes:
-        IDs = get_ncbiID(i)
-        if IDs is not None:
-            for k in IDs:
-                ncbiIDs.append(k)
-    # ncbiIDs = [k for i in genes for k in get_ncbiID(i) if k is not None]
-    print(ncbiIDs)
-    #ncbiIDs = [get_ncbiID(i) for i in genes]
-    #pprint(ncbiIDs)
-    # genes = get_genes(reactions[0])
-    # print(genes)
-    # id = get_ncbiID(genes[0])
-    # print(id)
\ No newline at end of file
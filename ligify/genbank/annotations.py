@@ -6,207 +6,66 @@ after_regulator = "TAATCACTTTCAGCCAAAAAACTTAAGACCGCCGGTCTTGTCCACTACCTTGCAGTAATGC
 seq = before_promoter + promoter_seq + before_regulator + regulator + after_regulator
 
 
-def get_plasmid_components():
-    plasmid_components = {
-        "before_promoter": before_promoter,
-        "before_regulator": before_regulator,
-        "after_regulator": after_regulator,
+PLASMID_COMPONENTS = {
+    "before_promoter": before_promoter,
+    "before_regulator": before_regulator,
+    "after_regulator": after_regulator,
+}
+
+# Feature table of the plasmid. Coordinates are 0-based, end-exclusive
+# offsets from an anchor: "origin" (the start of the plasmid), "promoter"
+# (the end of the promoter) or "regulator" (the end of the regulator), so
+# only the promoter and regulator lengths move them. "{name}" in a label
+# is the regulator name.
+BACKBONE_FEATURES = [
+    # type, label, color, (anchor, start), (anchor, end), strand
+    ("misc_feature", "GFP_mut2", "#95ff7d", ("origin", 0), ("origin", 717), -1),
+    ("misc_feature", "GFP_RBS8", "#ff7c6b", ("origin", 717), ("origin", 740), -1),
+    ("misc_feature", "ElvJ", "#cd8cff", ("origin", 740), ("origin", 818), -1),
+    ("misc_feature", "{name}_promoter", "#faff66", ("origin", 818), ("promoter", 0), -1),
+    ("misc_feature", "Bidirectional_terminator", "#9e9e9e", ("promoter", 0), ("promoter", 49), -1),
+    ("misc_feature", "P250_promoter", "#ffae2b", ("promoter", 52), ("promoter", 121), 1),
+    ("misc_feature", "RiboJ", "#cd8cff", ("promoter", 121), ("promoter", 196), 1),
+    ("misc_feature", "5'-UTR", "#ffffff", ("promoter", 196), ("promoter", 228), 1),
+    ("misc_feature", "4.6k_Leader_peptide", "#8589ff", ("promoter", 228), ("promoter", 279), 1),
+    ("misc_feature", "{name}", "#f9abff", ("promoter", 280), ("regulator", 0), 1),
+    ("CDS", "{name} protein", "#f9abff", ("promoter", 280), ("regulator", 0), 1),
+    ("misc_feature", "ECK12_spy_terminator", "#9e9e9e", ("regulator", 8), ("regulator", 98), 1),
+    ("misc_feature", "p15A_origin", "#abfffe", ("regulator", 350), ("regulator", 897), -1),
+    ("misc_feature", "Kanamycin_resistance", "#7bad89", ("regulator", 1007), ("regulator", 1823), -1),
+    ("misc_feature", "L3S2P00_terminator", "#9e9e9e", ("regulator", 2204), ("regulator", 2267), -1),
+]
+
+
+def anchor_offsets(prom_len: int, reg_len: int):
+    promoter_end = len(before_promoter) + prom_len
+    return {
+        "origin": 0,
+        "promoter": promoter_end,
+        "regulator": promoter_end + len(before_regulator) + reg_len,
     }
-    return plasmid_components
+
+
+def get_plasmid_components():
+    return dict(PLASMID_COMPONENTS)
 
 
 def get_annotations(
     promoter_seq: str, regulator_seq: str, regulator_name: str, regulator_CDS: str
 ):
-    prom_len = len(promoter_seq)
-    reg_len = len(regulator_seq)
+    anchors = anchor_offsets(len(promoter_seq), len(regulator_seq))
 
-    annotations = [
-        {
-            "type": "misc_feature",
-            "label": "GFP_mut2",
-            "color": "#95ff7d",
-            "start": 0,
-            "end": 717,
-            "strand": -1,
-        },
-        {
-            "type": "misc_feature",
-            "label": "GFP_RBS8",
-            "color": "#ff7c6b",
-            "start": 717,
-            "end": 740,
-            "strand": -1,
-        },
-        {
-            "type": "misc_feature",
-            "label": "ElvJ",
-            "color": "#cd8cff",
-            "start": 740,
-            "end": 818,
-            "strand": -1,
-        },
-        {
-            "type": "misc_feature",
-            "label": regulator_name + "_promoter",
-            "color": "#faff66",
-            "start": 818,
-            "end": 818 + prom_len,
-            "strand": -1,
-        },
-        {
-            "type": "misc_feature",
-            "label": "Bidirectional_terminator",
-            "color": "#9e9e9e",
-            "start": 818 + prom_len,
-            "end": 818 + prom_len + 49,
-            "strand": -1,
-        },
-        {
-            "type": "misc_feature",
-            "label": "P250_promoter",
-            "color": "#ffae2b",
-            "start": 818 + prom_len + 52,
-            "end": 818 + prom_len + 56 + 65,
-            "strand": 1,
-        },
-        {
-            "type": "misc_feature",
-            "label": "RiboJ",
-            "color": "#cd8cff",
-            "start": 818 + prom_len + 56 + 65,
-            "end": 818 + prom_len + 56 + 65 + 75,
-            "strand": 1,
-        },
-        {
-            "type": "misc_feature",
-            "label": "5'-UTR",
-            "color": "#ffffff",
-            "start": 818 + prom_len + 56 + 65 + 75,
-            "end": 818 + prom_len + 56 + 65 + 75 + 32,
-            "strand": 1,
-        },
-        {
-            "type": "misc_feature",
-            "label": "4.6k_Leader_peptide",
-            "color": "#8589ff",
-            "start": 818 + prom_len + 56 + 65 + 75 + 32,
-            "end": 818 + prom_len + 56 + 65 + 75 + 32 + 51,
-            "strand": 1,
-        },
-        {
-            "type": "misc_feature",
-            "label": regulator_name,
-            "color": "#f9abff",
-            "start": 818 + prom_len + 56 + 65 + 75 + 32 + 52,
-            "end": 818 + prom_len + 56 + 65 + 75 + 32 + 52 + reg_len,
-            "strand": 1,
-        },
-        {
-            "type": "CDS",
-            "label": regulator_name + " protein",
-            "color": "#f9abff",
-            "start": 818 + prom_len + 56 + 65 + 75 + 32 + 52,
-            "end": 818 + prom_len + 56 + 65 + 75 + 32 + 52 + reg_len,
-            "strand": 1,
-            "translation": regulator_CDS,
-        },
-        {
-            "type": "misc_feature",
-            "label": "ECK12_spy_terminator",
-            "color": "#9e9e9e",
-            "start": 818 + prom_len + 56 + 65 + 75 + 32 + 52 + reg_len + 8,
-            "end": 818 + prom_len + 56 + 65 + 75 + 32 + 52 + reg_len + 8 + 90,
-            "strand": 1,
-        },
-        {
-            "type": "misc_feature",
-            "label": "p15A_origin",
-            "color": "#abfffe",
-            "start": 818 + prom_len + 56 + 65 + 75 + 32 + 52 + reg_len + 8 + 90 + 252,
-            "end": 818
-            + prom_len
-            + 56
-            + 65
-            + 75
-            + 32
-            + 52
-            + reg_len
-            + 9
-            + 90
-            + 252
-            + 546,
-            "strand": -1,
-        },
-        {
-            "type": "misc_feature",
-            "label": "Kanamycin_resistance",
-            "color": "#7bad89",
-            "start": 818
-            + prom_len
-            + 56
-            + 65
-            + 75
-            + 32
-            + 52
-            + reg_len
-            + 9
-            + 90
-            + 252
-            + 546
-            + 110,
-            "end": 818
-            + prom_len
-            + 56
-            + 65
-            + 75
-            + 32
-            + 52
-            + reg_len
-            + 9
-            + 90
-            + 252
-            + 546
-            + 110
-            + 816,
-            "strand": -1,
-        },
-        {
-            "type": "misc_feature",
-            "label": "L3S2P00_terminator",
-            "color": "#9e9e9e",
-            "start": 818
-            + prom_len
-            + 56
-            + 65
-            + 75
-            + 32
-            + 52
-            + reg_len
-            + 9
-            + 90
-            + 252
-            + 546
-            + 110
-            + 816
-            + 381,
-            "end": 818
-            + prom_len
-            + 56
-            + 65
-            + 75
-            + 32
-            + 52
-            + reg_len
-            + 9
-            + 90
-            + 252
-            + 546
-            + 110
-            + 816
-            + 381
-            + 63,
-            "strand": -1,
-        },
-    ]
+    annotations = []
+    for type, label, color, start, end, strand in BACKBONE_FEATURES:
+        annotation = {
+            "type": type,
+            "label": label.replace("{name}", regulator_name),
+            "color": color,
+            "start": anchors[start[0]] + start[1],
+            "end": anchors[end[0]] + end[1],
+            "strand": strand,
+        }
+        if type == "CDS":
+            annotation["translation"] = regulator_CDS
+        annotations.append(annotation)
     return annotations
@@ -1,3 +1,8 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
 from dnachisel import (
     CodonOptimize,
     reverse_translate,
@@ -7,31 +12,131 @@ from dnachisel import (
     EnforceTranslation,
 )
 
+from utils import CACHE_DIR, BoundedCache, SQLiteStore
+
+# The optimization problem. Every parameter is part of the cache key, so
+# changing one never serves sequences optimized under the old settings.
+AVOID_PATTERN = "BsaI_site"
+GC_MIN, GC_MAX, GC_WINDOW = 0.35, 0.65, 50
+SPECIES = "e_coli"
+CONSTRAINT_SET = f"{AVOID_PATTERN};gc={GC_MIN}-{GC_MAX}/{GC_WINDOW};{SPECIES}"
+
+# Optimized sequences are kept in memory and in a SQLite file next to the
+# response cache, so popular regulators are optimized once per cache
+# lifetime rather than once per request.
+CODON_CACHE_BYTES = int(os.getenv("LIGIFY_CODON_CACHE_BYTES", 16 * 1024 * 1024))
+# Limit of codons.sqlite, separate from the response cache's
+CODON_CACHE_MAX_BYTES = int(os.getenv("LIGIFY_CODON_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+codon_cache = BoundedCache(CODON_CACHE_BYTES)
+
+
+def codon_key(protein_seq: str) -> str:
+    return hashlib.sha256(f"{CONSTRAINT_SET}\n{protein_seq}".encode()).hexdigest()
+
+
+_codon_store = None
+_codon_store_pid = None
+_codon_store_lock = threading.Lock()
+
+
+def get_codon_store():
+    """
+    The persistent tier of the codon cache, or None if it is disabled.
+    Opened once per process, so a forked child never shares the parent's
+    SQLite connection.
+    """
+    global _codon_store, _codon_store_pid
+    if os.getenv("LIGIFY_CACHE", "1") == "0" or not CACHE_DIR:
+        return None
+    if _codon_store is None or _codon_store_pid != os.getpid():
+        with _codon_store_lock:
+            if _codon_store is None or _codon_store_pid != os.getpid():
+                try:
+                    _codon_store = SQLiteStore(
+                        os.path.join(CACHE_DIR, "codons.sqlite"), CODON_CACHE_MAX_BYTES
+                    )
+                    _codon_store_pid = os.getpid()
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Codon cache unavailable: {e}")
+                    return None
+    return _codon_store
+
+
+def cached_codons(protein_seq: str):
+    """Codon-optimized DNA for a protein from the codon cache, or None."""
+    key = codon_key(protein_seq)
+    cached = codon_cache.get(key)
+    if cached is not None:
+        return cached
+
+    store = get_codon_store()
+    if store is not None:
+        stored = store.get(key)
+        if stored is not None:
+            sequence = stored.decode("ascii")
+            codon_cache.set(key, sequence)
+            return sequence
+    return None
+
+
+def cache_codons(protein_seq: str, sequence: str, solved: bool):
+    """Save an optimized sequence in the codon cache, unless its optimization failed."""
+    if not solved:
+        return
+    key = codon_key(protein_seq)
+    codon_cache.set(key, sequence)
+    store = get_codon_store()
+    if store is not None:
+        store.set(key, sequence.encode("ascii"))
+
 
 def codon_opt(protein_seq: str):
+    """
+    Codon-optimized DNA for a protein, served from the codon cache when it
+    has been optimized before under the same constraints.
+    """
+    cached = cached_codons(protein_seq)
+    if cached is not None:
+        return cached
+
+    # Sequences from a failed optimization are returned but never cached
+    sequence, solved = optimize_codons(protein_seq)
+    cache_codons(protein_seq, sequence, solved)
+    return sequence
+
+
+def optimize_codons(protein_seq: str):
+    """
+    Run the DnaChisel optimization. Returns the sequence and whether every
+    step succeeded.
+    """
+    solved = True
+
     # Create a random DNA seq given the protein seq. Append a stop codon.
     try:
         protein_dna_seq = reverse_translate(protein_seq + "*")
     except Exception as e:
         print("reverse_translate exception")
         print(e)
+        solved = False
 
     # DEFINE THE OPTIMIZATION PROBLEM
     try:
         problem = DnaOptimizationProblem(
             sequence=protein_dna_seq,
             constraints=[
-                AvoidPattern("BsaI_site"),
-                EnforceGCContent(mini=0.35, maxi=0.65, window=50),
+                AvoidPattern(AVOID_PATTERN),
+                EnforceGCContent(mini=GC_MIN, maxi=GC_MAX, window=GC_WINDOW),
                 EnforceTranslation(location=(0, len(protein_dna_seq))),
             ],
             objectives=[
-                CodonOptimize(species="e_coli", location=(0, len(protein_dna_seq)))
+                CodonOptimize(species=SPECIES, location=(0, len(protein_dna_seq)))
             ],
         )
     except Exception as e:
         print("DnaOptimizationProblem exception")
         print(e)
+        solved = False
 
     # SOLVE THE CONSTRAINTS, OPTIMIZE WITH RESPECT TO THE OBJECTIVE
 
@@ -40,16 +145,18 @@ def codon_opt(protein_seq: str):
     except Exception as e:
         print("resolve_constraints exception")
         print(e)
+        solved = False
     try:
         problem.optimize()
     except Exception as e:
         print("optimize exception")
         print(e)
+        solved = False
 
     # GET THE FINAL SEQUENCE (AS STRING OR ANNOTATED BIOPYTHON RECORDS)
 
     final_sequence = problem.sequence  # string
-    return final_sequence
+    return final_sequence, solved
 
 
 if __name__ == "__main__":
@@ -1,94 +1,235 @@
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
-from Bio import SeqIO
-from Bio.SeqFeature import SeqFeature, FeatureLocation
+import atexit
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+from genbank.codon_optimize import (
+    CONSTRAINT_SET,
+    cache_codons,
+    cached_codons,
+    codon_opt,
+    optimize_codons,
+)
+from genbank.plasmid_template import PLASMID_TEMPLATE
+
+# Codon optimizations are spread over this many worker processes (0 or 1 to
+# always run them serially), but only for at least PARALLEL_MIN regulators.
+PLASMID_WORKERS = int(os.getenv("LIGIFY_PLASMID_WORKERS", os.cpu_count() or 1))
+PARALLEL_MIN = 4
+# Seconds a create_plasmid call waits for its workers before optimizing the
+# rest serially
+CODON_WORKER_TIMEOUT = float(os.getenv("LIGIFY_CODON_WORKER_TIMEOUT", 120))
+
+# Result cache keys of deferred plasmid specs and built plasmids
+PLASMID_SPEC_KEY = "plasmid-spec#"
+PLASMID_KEY = "plasmid#"
+
+
+def codon_worker(connection):
+    """Worker process: answer each list of proteins with (sequence, solved) pairs."""
+    # DnaChisel's progress bars would otherwise take a multiprocessing lock,
+    # a named semaphore that outlives the worker
+    from tqdm import tqdm
+
+    tqdm.set_lock(threading.RLock())
+    while True:
+        try:
+            proteins = connection.recv()
+        except EOFError:
+            return
+        if proteins is None:
+            return
+        connection.send([optimize_codons(protein) for protein in proteins])
+
+
+class CodonWorker:
+    """
+    A long-lived worker process and the parent's end of its pipe.
+
+    Workers come from the spawn context, which works where process pools
+    don't (AWS Lambda has no /dev/shm for their semaphores) and never
+    inherits the parent's SQLite connections or held locks.
+    """
+
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=codon_worker, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        self.connection.close()
+        self.process.terminate()
+        self.process.join(1)
+
+
+# Workers are started on first use and kept for later create_plasmid calls,
+# so each pays for importing DnaChisel once
+_codon_workers = []
+_codon_workers_pid = None
+_codon_workers_lock = threading.Lock()
+
+
+def codon_workers():
+    """The live workers of this process, started up to PLASMID_WORKERS.
+    Call with _codon_workers_lock held."""
+    global _codon_workers, _codon_workers_pid
+    if _codon_workers_pid != os.getpid():
+        # Workers of the process this one was forked from aren't ours
+        _codon_workers, _codon_workers_pid = [], os.getpid()
+    for worker in [w for w in _codon_workers if not w.process.is_alive()]:
+        worker.stop()
+        _codon_workers.remove(worker)
+    context = multiprocessing.get_context("spawn")
+    try:
+        while len(_codon_workers) < PLASMID_WORKERS:
+            _codon_workers.append(CodonWorker(context))
+    except OSError as e:
+        print(f"Codon workers unavailable: {e}")
+    return list(_codon_workers)
+
+
+@atexit.register
+def stop_codon_workers():
+    """Let the workers exit cleanly, so they release what they hold."""
+    with _codon_workers_lock:
+        for worker in _codon_workers if _codon_workers_pid == os.getpid() else []:
+            try:
+                worker.connection.send(None)
+                worker.process.join(1)
+            except OSError:
+                pass
+            worker.stop()
+        _codon_workers.clear()
+
+
+def optimize_in_workers(proteins, timeout=CODON_WORKER_TIMEOUT):
+    """
+    protein -> (sequence, solved), optimized by the shared codon workers.
+
+    Proteins are left out when the workers are busy with another call, or
+    when their worker fails or misses the `timeout` deadline; that worker
+    is stopped and replaced on the next call. Callers optimize whatever is
+    missing serially.
+    """
+    if not _codon_workers_lock.acquire(blocking=False):
+        return {}
+    try:
+        optimized = {}
+        deadline = time.monotonic() + timeout
+        workers = codon_workers()
+        assigned = []
+        for index, worker in enumerate(workers):
+            chunk = proteins[index :: len(workers)]
+            if not chunk:
+                continue
+            try:
+                worker.connection.send(chunk)
+                assigned.append((worker, chunk))
+            except OSError as e:
+                print(f"Codon worker failed, optimizing serially: {e}")
+                worker.stop()
+                _codon_workers.remove(worker)
+
+        for worker, chunk in assigned:
+            try:
+                if not worker.connection.poll(max(0, deadline - time.monotonic())):
+                    raise TimeoutError(f"no answer within {timeout} s")
+                optimized.update(zip(chunk, worker.connection.recv()))
+            except (EOFError, OSError) as e:
+                print(f"Codon worker failed, optimizing serially: {e}")
+                worker.stop()
+                _codon_workers.remove(worker)
+        return optimized
+    finally:
+        _codon_workers_lock.release()
 
-from tempfile import NamedTemporaryFile
 
-from genbank.annotations import get_annotations, get_plasmid_components
-from genbank.codon_optimize import codon_opt
+def create_plasmid(regulators, chemical):
+    """
+    Attach a GenBank plasmid to every regulator.
+
+    Codon optimization is the CPU-bound part, so regulators missing from the
+    codon cache are optimized in worker processes when there are enough of
+    them. The workers' sequences are saved in this process's codon cache
+    before the GenBank files are filled in from the template.
+    """
+    specs = [plasmid_spec(regulator, chemical) for regulator in regulators]
+
+    sequences = {}
+    for spec in specs:
+        protein = spec["regulator_protein_seq"]
+        if protein not in sequences:
+            sequences[protein] = cached_codons(protein)
+    missing = [protein for protein, sequence in sequences.items() if sequence is None]
+
+    if PLASMID_WORKERS > 1 and len(missing) >= PARALLEL_MIN:
+        for protein, (sequence, solved) in optimize_in_workers(missing).items():
+            cache_codons(protein, sequence, solved)
+            sequences[protein] = sequence
+
+    for regulator, spec in zip(regulators, specs):
+        protein = spec["regulator_protein_seq"]
+        if sequences[protein] is None:
+            sequences[protein] = codon_opt(protein)
+        regulator["plasmid_sequence"] = plasmid_genbank(spec, sequences[protein])
+
+    return regulators
 
 
-def create_plasmid(regulators, chemical):
+def plasmid_spec(regulator, chemical):
+    """The create_genbank arguments of a regulator's plasmid."""
+    return {
+        "regulator_name": regulator["refseq"],
+        "ligand_name": chemical,
+        "promoter_seq": regulator["protein"]["context"]["promoter"]["regulated_seq"],
+        "regulator_protein_seq": regulator["reg_protein_seq"],
+    }
+
+
+def plasmid_id(spec) -> str:
+    """Content hash of a plasmid spec and the codon optimization settings."""
+    canonical = json.dumps(spec, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{CONSTRAINT_SET}\n{canonical}".encode()).hexdigest()[:32]
+
+
+def defer_plasmids(regulators, chemical, store):
+    """
+    Deferred alternative to create_plasmid: give every regulator a
+    `plasmid_id` and save its spec in `store` (a result cache backend), so
+    the GenBank file is only built when /ligify/plasmid asks for it.
+    """
     for regulator in regulators:
-        result = create_genbank(
-            regulator["refseq"],
-            chemical,
-            regulator["protein"]["context"]["promoter"]["regulated_seq"],
-            regulator["reg_protein_seq"],
-        )
-        regulator["plasmid_sequence"] = str(result)
+        spec = plasmid_spec(regulator, chemical)
+        regulator["plasmid_id"] = plasmid_id(spec)
+        store.set(PLASMID_SPEC_KEY + regulator["plasmid_id"], spec)
 
     return regulators
 
+
+def plasmid_genbank(spec, opt_regulator_seq):
+    """Fill the precompiled plasmid template with the promoter and regulator."""
+    return PLASMID_TEMPLATE.genbank(
+        spec["regulator_name"],
+        spec["ligand_name"],
+        spec["promoter_seq"],
+        opt_regulator_seq,
+        spec["regulator_protein_seq"],
+    )
+
+
 def create_genbank(regulator_name, ligand_name, promoter_seq, regulator_protein_seq):
     # Codon optimize the natural sequence
     opt_regulator_seq = codon_opt(regulator_protein_seq)
 
-    # Create the plasmid sequence record
-    plasmid_components = get_plasmid_components()
-    seq = (
-        plasmid_components["before_promoter"]
-        + promoter_seq
-        + plasmid_components["before_regulator"]
-        + opt_regulator_seq
-        + plasmid_components["after_regulator"]
-    )
-    plasmid_sequence = Seq(seq)
-    record = SeqRecord(
-        plasmid_sequence,
-        id=str(regulator_name),
-        name="pLigify_" + regulator_name,
-        description="This is a genetic circuit designed by Ligify to express GFP in response to the ligand "
-        + ligand_name
-        + " using the regulator "
-        + regulator_name,
-        annotations={"molecule_type": "DNA"},
+    # Fill the precompiled plasmid template with the promoter and regulator
+    return PLASMID_TEMPLATE.genbank(
+        regulator_name, ligand_name, promoter_seq, opt_regulator_seq, regulator_protein_seq
     )
 
-    # Set topology as circular
-    record.annotations["topology"] = "circular"
-
-    # Add annotations
-    annotations = get_annotations(promoter_seq, opt_regulator_seq, regulator_name, regulator_protein_seq)
-    for annotation in annotations:
-        if "translation" in annotation.keys():
-            record.features.append(\
-                SeqFeature(FeatureLocation(\
-                    start = annotation["start"], \
-                    end = annotation["end"], \
-                    strand = annotation["strand"]), \
-                    type = annotation["type"], \
-                    qualifiers={ \
-                        "ApEinfo_fwdcolor":[annotation["color"]],\
-                        "translation":[annotation["translation"]],\
-                        "label": annotation["label"]}))
-        else:
-            record.features.append(\
-                SeqFeature(FeatureLocation(\
-                    start = annotation["start"], \
-                    end = annotation["end"], \
-                    strand = annotation["strand"]), \
-                    type = annotation["type"], \
-                    qualifiers={ \
-                        "ApEinfo_fwdcolor":[annotation["color"]],\
-                        "label": annotation["label"]}))
-
-    # # Converts gbk into straight text
-    def get_gbk(record):
-        outfileloc=NamedTemporaryFile()
-        with open(outfileloc.name, "w") as handle:
-            SeqIO.write(record, handle, "genbank")
-        with open(outfileloc.name) as handle:
-            record=handle.read()
-        outfileloc.close()
-
-        return record
-
-    record = get_gbk(record)
-
-    return record
-
 
 if __name__ == "__main__":
     reg = "VprR"
@@ -0,0 +1,205 @@
+"""
+Precompiled GenBank template of the pLigify plasmid.
+
+Every plasmid shares the same backbone and feature table, and differs only
+in the promoter, the regulator and the names in the header and labels.
+`PLASMID_TEMPLATE` is compiled once at import: the feature lines of the
+backbone are formatted up front with their coordinates left as anchored
+offsets, and the ORIGIN lines covering the sequence before the promoter
+are written out. `PlasmidTemplate.genbank` then formats only the variable
+parts. The output is byte-identical to writing the equivalent Biopython
+SeqRecord with `SeqIO.write(record, handle, "genbank")`.
+"""
+
+from genbank.annotations import (
+    BACKBONE_FEATURES,
+    after_regulator,
+    anchor_offsets,
+    before_promoter,
+    before_regulator,
+)
+
+# Layout of Biopython's GenBank writer
+MAX_WIDTH = 80
+HEADER_WIDTH = 12
+QUALIFIER_INDENT = 21
+QUALIFIER_INDENT_STR = " " * QUALIFIER_INDENT
+LETTERS_PER_LINE = 60
+SEQUENCE_INDENT = 9
+DEFAULT_DATE = "01-JAN-1980"
+
+
+def single_line(tag, text):
+    return f"{tag.ljust(HEADER_WIDTH)}{text.replace(chr(10), ' ')}\n"
+
+
+def split_multi_line(text, max_len=MAX_WIDTH - HEADER_WIDTH):
+    """Word-wrap a header value; words too long for a line get one of their own."""
+    text = text.strip()
+    if len(text) <= max_len:
+        return [text]
+    lines = []
+    for word in text.split():
+        if lines and len(lines[-1]) + 1 + len(word) <= max_len:
+            lines[-1] += " " + word
+        elif not lines and len(word) >= max_len:
+            # Biopython leaves the first line empty for a word this long
+            lines.append("")
+            lines.append(word)
+        else:
+            lines.append(word)
+    return lines
+
+
+def multi_line(tag, text):
+    lines = split_multi_line(text)
+    return single_line(tag, lines[0]) + "".join(single_line("", line) for line in lines[1:])
+
+
+def qualifier(key, value):
+    """A feature qualifier, quoted and wrapped at spaces (or column 80)."""
+    line = f'{QUALIFIER_INDENT_STR}/{key}="{value.replace(chr(34), chr(34) * 2)}"'
+    out = []
+    while line.lstrip():
+        if len(line) <= MAX_WIDTH:
+            out.append(line)
+            break
+        for index in range(min(len(line) - 1, MAX_WIDTH), QUALIFIER_INDENT + 1, -1):
+            if line[index] == " ":
+                break
+        if line[index] != " ":
+            index = MAX_WIDTH
+        out.append(line[:index])
+        line = QUALIFIER_INDENT_STR + line[index:].lstrip()
+    return "".join(f"{l}\n" for l in out)
+
+
+def location(start, end, strand, length):
+    """GenBank location of a 0-based, end-exclusive range."""
+    if start == end:
+        # Zero-length range: the point between two bases
+        loc = f"{length}^1" if end == length else f"{end}^{end + 1}"
+    elif start + 1 == end:
+        loc = f"{end}"
+    else:
+        loc = f"{start + 1}..{end}"
+    return f"complement({loc})" if strand == -1 else loc
+
+
+def origin_lines(data, start=0):
+    """ORIGIN lines for lower-case `data` beginning at 0-based `start`,
+    which must fall on a line boundary."""
+    out = []
+    for i in range(0, len(data), LETTERS_PER_LINE):
+        line = data[i : i + LETTERS_PER_LINE]
+        words = " ".join(line[j : j + 10] for j in range(0, len(line), 10))
+        out.append(f"{str(start + i + 1).rjust(SEQUENCE_INDENT)} {words}\n")
+    return "".join(out)
+
+
+def locus_line(locus, length):
+    if len(locus.split()) > 1:
+        raise ValueError(f"Invalid whitespace in {locus!r} for LOCUS line")
+    if len(locus) > 16 and len(str(length)) > 11 - (len(locus) - 16):
+        name_length = f"{locus} {length}"
+    else:
+        name_length = str(length).rjust(28)
+        name_length = locus + name_length[len(locus) :]
+    return f"LOCUS       {name_length} bp    {'DNA'.ljust(7)} circular UNK {DEFAULT_DATE}\n"
+
+
+def accession_version(record_id):
+    """ACCESSION and VERSION values for a record ID, as Biopython derives them."""
+    accession = record_id
+    if record_id.count(".") == 1 and record_id[record_id.index(".") + 1 :].isdigit():
+        accession = record_id.split(".", 1)[0]
+    version = accession
+    if record_id.startswith(accession + "."):
+        try:
+            version = "%s.%i" % (accession, int(record_id.split(".", 1)[1]))
+        except ValueError:
+            pass
+    return accession, version
+
+
+class PlasmidTemplate:
+    """The invariant parts of the plasmid's GenBank file, formatted once."""
+
+    def __init__(self):
+        self.before_promoter = before_promoter
+        self.before_regulator = before_regulator
+        self.after_regulator = after_regulator
+
+        # (type column, start anchor, end anchor, strand, label, qualifier
+        # text after the location line). Labels naming the regulator are
+        # formatted per plasmid; all other qualifiers are fixed.
+        self.features = []
+        for type, label, color, start, end, strand in BACKBONE_FEATURES:
+            named = "{name}" in label
+            self.features.append((
+                f"     {type.ljust(QUALIFIER_INDENT - 5)}"[:QUALIFIER_INDENT],
+                start,
+                end,
+                strand,
+                label if named else None,
+                qualifier("ApEinfo_fwdcolor", color),
+                type == "CDS",
+                "" if named else qualifier("label", label),
+            ))
+
+        # ORIGIN lines wholly inside the sequence before the promoter
+        aligned = len(before_promoter) // LETTERS_PER_LINE * LETTERS_PER_LINE
+        self.origin_prefix = "ORIGIN\n" + origin_lines(before_promoter[:aligned].lower())
+        self.origin_aligned = aligned
+
+    def feature_table(self, regulator_name, prom_len, reg_len, translation, length):
+        anchors = anchor_offsets(prom_len, reg_len)
+        out = ["FEATURES             Location/Qualifiers\n"]
+        for column, start, end, strand, label, color, is_cds, fixed in self.features:
+            out.append(column)
+            out.append(location(anchors[start[0]] + start[1], anchors[end[0]] + end[1], strand, length))
+            out.append("\n")
+            out.append(color)
+            if is_cds:
+                out.append(qualifier("translation", translation))
+            out.append(fixed if label is None else qualifier("label", label.replace("{name}", regulator_name)))
+        return "".join(out)
+
+    def genbank(self, regulator_name, ligand_name, promoter_seq, regulator_seq, regulator_protein_seq):
+        """The plasmid's GenBank file, as `create_genbank` returns it."""
+        length = (
+            len(self.before_promoter) + len(promoter_seq) + len(self.before_regulator)
+            + len(regulator_seq) + len(self.after_regulator)
+        )
+        record_id = str(regulator_name)
+        accession, version = accession_version(record_id)
+        description = (
+            "This is a genetic circuit designed by Ligify to express GFP in response to the ligand "
+            + ligand_name
+            + " using the regulator "
+            + regulator_name
+        )
+        variable = (
+            self.before_promoter[self.origin_aligned :]
+            + promoter_seq
+            + self.before_regulator
+            + regulator_seq
+            + self.after_regulator
+        ).lower()
+        return "".join((
+            locus_line("pLigify_" + regulator_name, length),
+            multi_line("DEFINITION", description + "."),
+            single_line("ACCESSION", accession),
+            single_line("VERSION", version),
+            multi_line("KEYWORDS", "."),
+            multi_line("SOURCE", "."),
+            single_line("  ORGANISM", "."),
+            multi_line("", "."),
+            self.feature_table(regulator_name, len(promoter_seq), len(regulator_seq), regulator_protein_seq, length),
+            self.origin_prefix,
+            origin_lines(variable, self.origin_aligned),
+            "//\n",
+        ))
+
+
+PLASMID_TEMPLATE = PlasmidTemplate()
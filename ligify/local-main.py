@@ -9,6 +9,8 @@ from boto3.dynamodb.conditions import Key
 from fetch_data import fetch_data
 from genbank.create_genbank import create_genbank
 from predict.pubchem import get_inchikey, get_name
+from predict.enzymes2operons import cache_stats
+from utils import json_default
 
 def ensure_table_exists(dynamodb):
     try:
@@ -65,7 +67,7 @@ def store_in_dynamodb(table, smiles, data, data_is_error=False):
     except Exception as e:
         print(f"Error checking for existing entry: {e}")    
 
-    data_str = json.dumps(data)
+    data_str = json.dumps(data, default=json_default)
     data_size = len(data_str.encode('utf-8'))
 
     max_chunk_size = 350000
@@ -203,6 +205,7 @@ if __name__ == "__main__":
         #     json.dump(results, f, ensure_ascii=False, indent=4)
         
         print("Batch processing completed. Results saved to batch_results.json")
+        pprint(cache_stats())
         
     except Exception as e:
         print(f"Error during batch processing: {e}")
\ No newline at end of file
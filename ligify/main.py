@@ -2,9 +2,17 @@ import re
 from dotenv import load_dotenv
 import json
 
-from fetch_data import fetch_data
-from genbank.create_genbank import create_plasmid
-from predict.pubchem import get_inchikey, get_name
+from fetch_data import fetch_data, iter_data
+from genbank.create_genbank import (
+    PLASMID_KEY,
+    PLASMID_SPEC_KEY,
+    create_genbank,
+    create_plasmid,
+    defer_plasmids,
+)
+from predict.pubchem import get_chemical
+from result_cache import get_result_cache, result_key
+from utils import json_default
 
 from marshmallow import Schema, fields, ValidationError, validate
 
@@ -60,6 +68,17 @@ class InputSchema(Schema):
         )
     )
     filters = fields.Nested(FilterSchema)
+    # "deferred" returns a plasmid_id per regulator instead of the GenBank
+    # file, which /ligify/plasmid builds on request
+    plasmids = fields.String(
+        load_default="inline",
+        validate=validate.OneOf(
+            ["inline", "deferred"], error="plasmids should be inline or deferred"
+        ),
+    )
+
+
+PLASMID_ID = re.compile(r"^[0-9a-f]{32}$")
 
 
 def lambda_handler(event, context):
@@ -80,45 +99,48 @@ def lambda_handler(event, context):
     # Load environment variables
     load_dotenv()
 
-    # Parse and validate the request body
-    try:
-        body = json.loads(event.get("body", "{}"))
-    except json.JSONDecodeError:
-        return generate_response(
-            400,
-            {"message": "Invalid JSON in request body."},
-            origin=origin
-        )
+    if path.rstrip('/').endswith('/ligify/plasmid'):
+        status_code, body = get_plasmid(plasmid_request_id(event))
+        return generate_response(status_code, body, origin=origin)
 
-    input_schema = InputSchema()
-
-    try:
-        validated_input = input_schema.load(body)
-    except ValidationError as e:
-        print("Validation error:", e)
-        return generate_response(
-            400,
-            {"message": e.messages},
-            origin=origin
-        )
+    # Parse and validate the request body
+    validated_input, error = load_input(event.get("body", "{}"))
+    if error is not None:
+        return generate_response(error[0], error[1], origin=origin)
 
     # Process the request
     try:
-        chemical_name = get_name(validated_input["smiles"], "smiles")
-        InChiKey = get_inchikey(validated_input["smiles"], "smiles")
+        chemical_name, InChiKey = get_chemical(validated_input["smiles"])
         chemical = {
             "name": chemical_name,
             "smiles": validated_input["smiles"],
             "InChiKey": InChiKey,
         }
 
-        regulators, metrics = fetch_data(chemical["InChiKey"], validated_input["filters"])
-        regulators = create_plasmid(regulators, chemical_name)
+        # Deferred plasmids are resolved through the result cache, so
+        # unless every instance shares it they are always built inline
+        result_cache = get_result_cache()
+        plasmids = validated_input["plasmids"] if can_defer(result_cache) else "inline"
 
-        response_body = {
-            "metrics": metrics,
-            "regulators": regulators
-        }
+        def compute():
+            regulators, metrics = fetch_data(chemical["InChiKey"], validated_input["filters"])
+            if plasmids == "deferred":
+                regulators = defer_plasmids(regulators, chemical_name, result_cache.backend)
+            else:
+                regulators = create_plasmid(regulators, chemical_name)
+
+            return {
+                "metrics": metrics,
+                "regulators": regulators
+            }
+
+        # Identical requests (same molecule and filters) reuse an earlier result
+        if result_cache is None:
+            response_body = compute()
+        else:
+            response_body = result_cache.get_or_compute(
+                result_key(InChiKey, validated_input["filters"], plasmids), compute
+            )
 
         return generate_response(200, response_body, origin=origin)
     except Exception as e:
@@ -130,6 +152,105 @@ def lambda_handler(event, context):
         )
 
 
+def can_defer(result_cache):
+    """
+    Whether plasmids can be deferred: their specs must be kept where any
+    instance answering /ligify/plasmid will find them, not in one
+    container's memory or /tmp.
+    """
+    return result_cache is not None and result_cache.backend.shared
+
+
+def plasmid_request_id(event):
+    """The plasmid_id of a /ligify/plasmid request, from the query string or body."""
+    query = event.get("queryStringParameters") or {}
+    if query.get("id"):
+        return query["id"]
+    try:
+        body = json.loads(event.get("body") or "{}")
+    except json.JSONDecodeError:
+        return None
+    return body.get("plasmid_id") if isinstance(body, dict) else None
+
+
+def get_plasmid(plasmid_id):
+    """
+    Build, or fetch from the result cache, the GenBank file of a deferred
+    plasmid. Returns (status_code, body).
+    """
+    if not isinstance(plasmid_id, str) or not PLASMID_ID.match(plasmid_id):
+        return 400, {"message": "A valid plasmid_id is required."}
+    result_cache = get_result_cache()
+    if result_cache is None:
+        return 404, {"message": "Unknown plasmid_id."}
+
+    def build():
+        spec = result_cache.backend.get(PLASMID_SPEC_KEY + plasmid_id)
+        if spec is None:
+            raise KeyError(plasmid_id)
+        return {"plasmid_id": plasmid_id, "plasmid_sequence": create_genbank(**spec)}
+
+    try:
+        return 200, result_cache.get_or_compute(PLASMID_KEY + plasmid_id, build)
+    except KeyError:
+        return 404, {"message": "Unknown plasmid_id."}
+    except Exception as e:
+        print("Internal server error:", e)
+        return 500, {"message": "Internal Server Error"}
+
+
+def load_input(raw_body):
+    """
+    Parse and validate a /ligify request body.
+
+    Returns (validated_input, None), or (None, (status_code, body)) with the
+    error response to send.
+    """
+    try:
+        body = json.loads(raw_body)
+    except json.JSONDecodeError:
+        return None, (400, {"message": "Invalid JSON in request body."})
+
+    input_schema = InputSchema()
+
+    try:
+        return input_schema.load(body), None
+    except ValidationError as e:
+        print("Validation error:", e)
+        return None, (400, {"message": e.messages})
+
+
+def stream_ligify(validated_input):
+    """
+    Streaming variant of the /ligify pipeline, yielding NDJSON lines.
+
+    Each regulator is sent as {"type": "regulator", "regulator": ...} as
+    soon as its promoter, rank and plasmid are ready, followed by a final
+    {"type": "metrics", "metrics": ...} record. A failure part-way through
+    is reported as {"type": "error", "message": ...} since the status code
+    has already been sent.
+    """
+    try:
+        chemical_name, InChiKey = get_chemical(validated_input["smiles"])
+
+        result_cache = get_result_cache()
+        deferred = validated_input["plasmids"] == "deferred" and can_defer(result_cache)
+
+        for kind, record in iter_data(InChiKey, validated_input["filters"]):
+            if kind == "regulator" and deferred:
+                record = defer_plasmids([record], chemical_name, result_cache.backend)[0]
+            elif kind == "regulator":
+                record = create_plasmid([record], chemical_name)[0]
+            yield ndjson_line({"type": kind, kind: record})
+    except Exception as e:
+        print("Internal server error:", e)
+        yield ndjson_line({"type": "error", "message": "Internal Server Error"})
+
+
+def ndjson_line(record):
+    return (json.dumps(record, default=json_default) + "\n").encode()
+
+
 def generate_response(status_code, body, is_options=False, origin=None):
     headers = {
         "Access-Control-Allow-Origin": origin if origin else "http://localhost:3001",
@@ -147,7 +268,7 @@ def generate_response(status_code, body, is_options=False, origin=None):
         }
 
     # Ensure the body is a JSON string
-    body_str = json.dumps(body) if isinstance(body, (dict, list)) else str(body)
+    body_str = json.dumps(body, default=json_default) if isinstance(body, (dict, list)) else str(body)
 
     return {
         'statusCode': status_code,
@@ -3,11 +3,14 @@ import re
 from lxml import etree
 from typing import Dict, Any, Optional
 import io
-from concurrent.futures import ThreadPoolExecutor
-from itertools import islice
+import asyncio
+from typing import NamedTuple
 
 
-from utils import make_request
+from predict.gene_table import MINUS, PLUS, STRAND_CODES, UNKNOWN, GeneTable
+from predict.genome_store import GenomeStore
+from predict.operon_sequence import OperonSequence
+from utils import run_async
 
 # TODO:
 # Return a legit error message for the frontend if an error comes up
@@ -25,211 +28,276 @@ from utils import make_request
 #         genome = response.text.split("\n")
 #         return genome
 
-def chunk_iterator(iterable, size):
-    iterator = iter(iterable)
-    return iter(lambda: list(islice(iterator, size)), [])
-
-def process_chunk(ids_chunk):
-    results = {}
-    for id in ids_chunk:
-        results[id] = acc2MetaData(id)
-    return results
-
-def NC2genome(genome_id, operon):
-    base_url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=nuccore&api_key={os.getenv('NcbiApiKey')}"
-    startPos = operon[0]["start"]
-    stopPos = operon[-1]["stop"]
-    response = make_request("GET",         
-        base_url
+def nuccore_url(genome_id, startPos, stopPos, rettype, strand=None):
+    url = (
+        f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=nuccore&api_key={os.getenv('NcbiApiKey')}"
         + "&id="
         + str(genome_id)
         + "&seq_start="
         + str(startPos)
         + "&seq_stop="
         + str(stopPos)
-        + "&rettype=fasta"
-                 )
-    # response = requests.get(
-    #     base_url
-    #     + "&id="
-    #     + str(genome_id)
-    #     + "&seq_start="
-    #     + str(startPos)
-    #     + "&seq_stop="
-    #     + str(stopPos)
-    #     + "&rettype=fasta"
-    # )
-
-    if response.ok:
-        genome = response.text.split("\n")
-        genome = "".join(i for i in genome[0:-2] if i[0] != ">")
-
-        ### GENOME FRAGMENT ANNOTATION FUNCTION ###
-
-        ### This deals with one-sided gene overlaps (beginning or end)
-
-        ### It does NOT YET deal with double-sided overlaps (begining AND end)
-
-        out = {}
-        counter = 0
-        for index in range(0, len(operon)):
-            # reset overlap seq
-            overlap_seq = ""
-
-            # if you're not at the end...
-            if index != len(operon) - 1:
-                # if END of gene overlaps with START of next gene...
-                if operon[index + 1]["start"] < operon[index]["stop"]:
-                    # truncated gene
-                    gene_seq = genome[
-                        operon[index]["start"] - startPos : operon[index + 1]["start"]
-                        - startPos
-                    ]
-                    # overlap region
-                    overlap_seq = genome[
-                        operon[index + 1]["start"] - startPos : operon[index]["stop"]
-                        - startPos
-                        + 1
-                    ]
-
-                # if you're not at the beginning...
-                elif index != 0:
-                    # if START of gene overlaps with END of prior gene...
-                    if operon[index - 1]["stop"] > operon[index]["start"]:
-                        # truncated gene
-                        gene_seq = genome[
-                            operon[index - 1]["stop"] - startPos + 1 : operon[index][
-                                "stop"
-                            ]
-                            - startPos
-                            + 1
-                        ]
-                    else:
-                        # full gene
-                        gene_seq = genome[
-                            operon[index]["start"] - startPos : operon[index]["stop"]
-                            - startPos
-                            + 1
-                        ]
-
-                # if you're at the beginning
-                elif index == 0:
-                    # full gene
-                    gene_seq = genome[
-                        operon[index]["start"] - startPos : operon[index]["stop"]
-                        - startPos
-                        + 1
-                    ]
-
-            # if you ARE at the end...
-            elif index == len(operon) - 1:
-                # see if START of gene overlaps with END of prior gene
+        + "&rettype="
+        + rettype
+    )
+    if strand is not None:
+        url += "&strand=" + str(strand)
+    return url
+
+
+EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+
+# Accessions whose operons are assembled concurrently in acc2OperonList_async.
+# NCBI calls of every task share the token bucket in utils, so this only
+# bounds how many loci are in flight at once.
+OPERON_WORKERS = int(os.getenv("LIGIFY_OPERON_WORKERS", 8))
+
+
+def fasta_sequence(content):
+    """The sequence lines of a FASTA response joined, as bytes."""
+    if isinstance(content, str):
+        content = content.encode("ascii")
+    return b"".join(i for i in content.split(b"\n") if i and i[:1] != b">")
+
+
+async def fetch_nucleotides_async(requester, genome_id, startPos, stopPos, store):
+    """Plus-strand sequence of a genome range, served from `store` when possible."""
+    if await load_nucleotides_async(requester, genome_id, startPos, stopPos, store):
+        return store.nucleotides(genome_id, startPos, stopPos)
+
+
+async def load_nucleotides_async(requester, genome_id, startPos, stopPos, store):
+    """Make sure `store` holds a genome range. False if the fetch failed."""
+    async with store.async_lock(genome_id):
+        window = store.missing_nucleotides(genome_id, startPos, stopPos)
+        if window is not None:
+            response = await requester.request(
+                "GET", nuccore_url(genome_id, *window, "fasta")
+            )
+            if not response.is_success:
+                print(f"Status Code: {response.status_code}")
+                print(f"Reason: {response.reason_phrase}")
+                print("FATAL: Bad eFetch request")
+                return False
+            store.add_nucleotides(genome_id, window[0], fasta_sequence(response.content))
+    return True
+
+
+def NC2genome(genome_id, operon, store=None):
+    return run_async(NC2genome_async, genome_id, operon, store or GenomeStore())
+
+
+async def NC2genome_async(requester, genome_id, operon, store):
+    startPos = operon[0]["start"]
+    stopPos = operon[-1]["stop"]
+    if await load_nucleotides_async(requester, genome_id, startPos, stopPos, store):
+        return annotate_operon(store.nucleotide_view(genome_id, startPos, stopPos), operon)
+
+
+def annotate_operon(genome, operon):
+    """
+    Split the operon's sequence into gene, overlap and spacer segments.
+
+    `genome` is the plus-strand sequence from the first gene's start, as a
+    string or a bytes-like buffer. Returns an OperonSequence, which keeps
+    only segment offsets into the buffer, and whether the segments
+    reassemble into the whole sequence.
+    """
+    if isinstance(genome, str):
+        genome = genome.encode("ascii")
+    genome = memoryview(genome)
+    startPos = operon[0]["start"]
+
+    def cut(start, stop=None):
+        # Offsets of genome[start:stop], with Python slice semantics
+        start, stop, _ = slice(start, stop).indices(len(genome))
+        return start, max(start, stop)
+
+    ### GENOME FRAGMENT ANNOTATION FUNCTION ###
+
+    ### This deals with one-sided gene overlaps (beginning or end)
+
+    ### It does NOT YET deal with double-sided overlaps (begining AND end)
+
+    out = {}
+    counter = 0
+    for index in range(0, len(operon)):
+        # reset overlap seq
+        overlap_seq = None
+
+        # if you're not at the end...
+        if index != len(operon) - 1:
+            # if END of gene overlaps with START of next gene...
+            if operon[index + 1]["start"] < operon[index]["stop"]:
+                # truncated gene
+                gene_seq = cut(
+                    operon[index]["start"] - startPos,
+                    operon[index + 1]["start"] - startPos,
+                )
+                # overlap region
+                overlap_seq = cut(
+                    operon[index + 1]["start"] - startPos,
+                    operon[index]["stop"] - startPos + 1,
+                )
+
+            # if you're not at the beginning...
+            elif index != 0:
+                # if START of gene overlaps with END of prior gene...
                 if operon[index - 1]["stop"] > operon[index]["start"]:
                     # truncated gene
-                    gene_seq = genome[
-                        operon[index - 1]["stop"] - startPos + 1 : operon[index]["stop"]
-                        - startPos
-                        + 1
-                    ]
+                    gene_seq = cut(
+                        operon[index - 1]["stop"] - startPos + 1,
+                        operon[index]["stop"] - startPos + 1,
+                    )
                 else:
                     # full gene
-                    gene_seq = genome[operon[index]["start"] - startPos :]
+                    gene_seq = cut(
+                        operon[index]["start"] - startPos,
+                        operon[index]["stop"] - startPos + 1,
+                    )
 
-            # Append the gene sequence
-            if str(operon[index]["direction"]) == "+":
-                out["gene" + str(counter) + "fwd"] = gene_seq
-            else:
-                out["gene" + str(counter)] = gene_seq
+            # if you're at the beginning
+            elif index == 0:
+                # full gene
+                gene_seq = cut(
+                    operon[index]["start"] - startPos,
+                    operon[index]["stop"] - startPos + 1,
+                )
 
-            # Append the overlap sequence
-            if len(overlap_seq) > 0:
-                out["overlap" + str(counter)] = overlap_seq
+        # if you ARE at the end...
+        elif index == len(operon) - 1:
+            # see if START of gene overlaps with END of prior gene
+            if operon[index - 1]["stop"] > operon[index]["start"]:
+                # truncated gene
+                gene_seq = cut(
+                    operon[index - 1]["stop"] - startPos + 1,
+                    operon[index]["stop"] - startPos + 1,
+                )
+            else:
+                # full gene
+                gene_seq = cut(operon[index]["start"] - startPos)
 
-            # Append the spacer
-            try:
-                spacer_seq = genome[
-                    operon[index]["stop"] - startPos + 1 : operon[index + 1]["start"]
-                    - startPos
-                ]
-            except Exception:
-                spacer_seq = genome[operon[index]["stop"] - startPos + 1 : len(genome)]
-            if len(spacer_seq) != 0:
-                out["spacer" + str(counter)] = spacer_seq
+        # Append the gene sequence
+        if str(operon[index]["direction"]) == "+":
+            out["gene" + str(counter) + "fwd"] = gene_seq
+        else:
+            out["gene" + str(counter)] = gene_seq
 
-            counter += 1
+        # Append the overlap sequence
+        if overlap_seq is not None and overlap_seq[1] > overlap_seq[0]:
+            out["overlap" + str(counter)] = overlap_seq
 
-        reconstruct = "".join(i for i in out.values())
-        if reconstruct == genome:
-            genome_reassembly_match = True
+        # Append the spacer
+        if index + 1 < len(operon):
+            spacer_seq = cut(
+                operon[index]["stop"] - startPos + 1,
+                operon[index + 1]["start"] - startPos,
+            )
         else:
-            genome_reassembly_match = False
+            spacer_seq = cut(operon[index]["stop"] - startPos + 1, len(genome))
+        if spacer_seq[1] > spacer_seq[0]:
+            out["spacer" + str(counter)] = spacer_seq
 
-        return out, genome_reassembly_match
+        counter += 1
 
+    sequence = OperonSequence(genome, out)
+    return sequence, sequence.reassembles()
 
-def getGenes(genome_id, startPos, stopPos):
-    base_url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=nuccore&api_key={os.getenv('NcbiApiKey')}"
 
-    try:
-        response = make_request(
-            "GET",
-            base_url
-            + "&id=" + str(genome_id)
-            + "&seq_start=" + str(startPos - 10000)
-            + "&seq_stop=" + str(stopPos + 10000)
-            + "&rettype=fasta_cds_aa"
-        )
-        genome = response.text.split("\n")
-    except Exception:
-        try:
-            response = make_request(
-                "GET",
-                base_url
-                + "&id=" + str(genome_id)
-                + "&seq_start=" + str(startPos - 5000)
-                + "&seq_stop=" + str(stopPos + 5000)
-                + "&rettype=fasta_cds_aa"
-            )
-            genome = response.text.split("\n")
-        except Exception:
+# Windows to try around the enzyme, as (upstream, downstream) bp.
+# Narrower windows are only used if fetching a wider one fails.
+GENE_WINDOWS = [(10000, 10000), (5000, 5000), (0, 5000), (5000, 0)]
+
+
+class CdsRecord(NamedTuple):
+    """
+    One CDS header of a fasta_cds_aa response, parsed once.
+
+    `positions` holds every coordinate of the location (two for a plain
+    range, more for a join), and `fields` the (key, value) pairs of
+    `fasta2MetaData` in header order, so `metadata()` rebuilds the exact
+    dictionary the operon code has always worked with.
+    """
+
+    start: int
+    stop: int
+    direction: Optional[str]
+    accession: str
+    alias: Optional[str]
+    description: Optional[str]
+    positions: tuple
+    fields: tuple
+
+    def metadata(self):
+        return dict(self.fields)
+
+
+def cds_record(header):
+    metaData = fasta2MetaData(header)
+    location = next((i for i in header.split(" [") if i[:9] == "location="), "")
+    return CdsRecord(
+        metaData.get("start", 0),
+        metaData.get("stop", 0),
+        metaData.get("direction"),
+        metaData["accession"],
+        metaData.get("alias"),
+        metaData.get("description"),
+        tuple(int(i) for i in re.findall(r"\d+", location)),
+        tuple(metaData.items()),
+    )
+
+
+def iter_cds_records(lines):
+    """
+    Yield a CdsRecord for every header of a fasta_cds_aa stream.
+
+    `lines` can be any iterable of str or bytes lines, such as
+    `response.iter_lines()`; protein sequences are skipped unread.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode()
+        if len(line) != 0 and line[0] == ">":
+            yield cds_record(line.rstrip("\r\n"))
+
+
+def getGenes(genome_id, startPos, stopPos, store=None):
+    return run_async(getGenes_async, genome_id, startPos, stopPos, store or GenomeStore())
+
+
+async def getGenes_async(requester, genome_id, startPos, stopPos, store):
+    async with store.async_lock(genome_id):
+        for upstream, downstream in GENE_WINDOWS:
+            windowStart, windowStop = startPos - upstream, stopPos + downstream
             try:
-                response = make_request(
-                    "GET",
-                    base_url
-                    + "&id=" + str(genome_id)
-                    + "&seq_start=" + str(startPos)
-                    + "&seq_stop=" + str(stopPos + 5000)
-                    + "&rettype=fasta_cds_aa"
-                )
-                genome = response.text.split("\n")
-            except Exception:
-                try:
-                    response = make_request(
-                        "GET",
-                        base_url
-                        + "&id=" + str(genome_id)
-                        + "&seq_start=" + str(startPos - 5000)
-                        + "&seq_stop=" + str(stopPos)
-                        + "&rettype=fasta_cds_aa"
+                for start, stop in store.missing_cds(genome_id, windowStart, windowStop):
+                    response = await requester.request(
+                        "GET", nuccore_url(genome_id, start, stop, "fasta_cds_aa")
                     )
-                    genome = response.text.split("\n")
-                except Exception:
-                    print("error fetching the genome fragment")
-                    return None, None
-
-    re1 = re.compile(str(startPos))
-    re2 = re.compile(str(stopPos))
-    geneIndex = 0
+                    if response.is_success:
+                        store.add_cds(
+                            genome_id, start, stop, iter_cds_records(response.iter_lines())
+                        )
+                break
+            except Exception:
+                continue
+        else:
+            print("error fetching the genome fragment")
+            return None, None
+
+    return find_genes(store.cds(genome_id, windowStart, windowStop), startPos, stopPos)
+
+
+def find_genes(genes, startPos, stopPos):
+    """
+    Locate the CDS at startPos..stopPos among `genes` (CdsRecords in genome
+    order). Both positions must be coordinates of the CDS location, so
+    e.g. 1234 never matches 11234.
+    """
     regIndex = None
-    genes = []
-    for i in genome:
-        if len(i) != 0:
-            if i[0] == ">":
-                if re1.search(i):
-                    if re2.search(i):
-                        regIndex = geneIndex
-                geneIndex += 1
-                genes.append(i)
+    for geneIndex, gene in enumerate(genes):
+        if startPos in gene.positions and stopPos in gene.positions:
+            regIndex = geneIndex
     if regIndex is None:
         print("regulator not found in genome")
         return None, None
@@ -280,85 +348,80 @@ def getOperon(allGenes, index, seq_start, strand):
         - if query gene direction converges with regulator, exclude it.
     """
 
-    def getGene(geneStrand, direction, nextGene, geneList, index):
-        while geneStrand == nextGene["direction"]:
-            if direction == "+":
-                nextIndex = index + 1
-            elif direction == "-":
-                nextIndex = index - 1
-
-            try:
-                nextGene = fasta2MetaData(allGenes[nextIndex])
-
-                if (
-                    abs(seq_start - nextGene["start"]) > 8000
-                ):  # added this. break if too far away
-                    break
-
-                elif (
-                    geneStrand == "-"
-                    and nextGene["direction"] == "+"
-                    and direction == "+"
-                ):
-                    geneList.append(nextGene)
-                elif (
-                    geneStrand == "+"
-                    and nextGene["direction"] == "-"
-                    and direction == "-"
-                ):
-                    geneList.append(nextGene)
-                elif geneStrand == nextGene["direction"]:
-                    geneList.append(nextGene)
-                index = nextIndex
-            except Exception:
+    table = allGenes if isinstance(allGenes, GeneTable) else GeneTable(allGenes)
+    n = len(table)
+    strands, starts = table.strand, table.start
+
+    def getGene(geneStrand, step, nextStrand, geneList, index):
+        # Walk away from the regulator while genes stay on geneStrand. Indices
+        # behave like list indices (negative ones wrap); a gene without a
+        # location ends the walk.
+        while geneStrand == nextStrand:
+            nextIndex = index + step
+            if not -n <= nextIndex < n:
+                break
+            nextStrand = strands[nextIndex]
+            if nextStrand == UNKNOWN:
                 break
 
+            if abs(seq_start - starts[nextIndex]) > 8000:  # added this. break if too far away
+                break
+            elif geneStrand == MINUS and nextStrand == PLUS and step == 1:
+                geneList.append(nextIndex % n)
+            elif geneStrand == PLUS and nextStrand == MINUS and step == -1:
+                geneList.append(nextIndex % n)
+            elif geneStrand == nextStrand:
+                geneList.append(nextIndex % n)
+            index = nextIndex
+
+    strand = STRAND_CODES[strand]
     geneStrand = strand
 
     # attempt to get downstream genes, if there are any genes downstream
-    try:
-        indexDOWN = index - 1
-        downGene = fasta2MetaData(allGenes[indexDOWN])
-        # if seq_start > downGene['start']:
-        if strand == "+" and downGene["direction"] == "-":
-            geneStrand = downGene["direction"]
+    indexDOWN = index - 1
+    geneArray = []
+    if -n <= indexDOWN < n and strands[indexDOWN] != UNKNOWN:
+        downStrand = strands[indexDOWN]
+        if strand == PLUS and downStrand == MINUS:
+            geneStrand = downStrand
 
-        downgenes = [downGene]
-        getGene(geneStrand, "-", downGene, downgenes, indexDOWN)
+        downgenes = [indexDOWN % n]
+        getGene(geneStrand, -1, downStrand, downgenes, indexDOWN)
 
         geneArray = list(reversed(downgenes))
-    except Exception:
-        geneArray = []
 
-    geneArray.append(fasta2MetaData(allGenes[index]))
+    geneArray.append(index)
     regulatorIndex = len(geneArray) - 1
 
     geneStrand = strand
 
     # attempt to get upstream genes, if there are any genes upstream
-    try:
-        indexUP = index + 1
-        upGene = fasta2MetaData(allGenes[indexUP])
-        # if seq_start > upGene['start']:
-        if strand == "-" and upGene["direction"] == "+":
-            geneStrand = upGene["direction"]
+    indexUP = index + 1
+    if indexUP < n:
+        upStrand = strands[indexUP]
+        if upStrand == UNKNOWN:
+            # A gene without a location is still taken as the neighbour when
+            # the walk would not need its strand
+            if strand == PLUS:
+                geneArray.append(indexUP)
+        else:
+            if strand == MINUS and upStrand == PLUS:
+                geneStrand = upStrand
 
-        geneArray.append(upGene)
+            geneArray.append(indexUP)
 
-        getGene(geneStrand, "+", upGene, geneArray, indexUP)
-    except Exception:
-        return geneArray, regulatorIndex
+            getGene(geneStrand, 1, upStrand, geneArray, indexUP)
 
-    return geneArray, regulatorIndex
+    return [table.metadata(i) for i in geneArray], regulatorIndex
 
 
-def predict_promoter(operon, regIndex, genome_id):
+def promoter_region(operon, regIndex):
     if operon[regIndex]["direction"] == "+":
         queryGenes = list(reversed(operon[0:regIndex]))
         index = regIndex
         if len(queryGenes) == 0:
             # print("WARNING: Tiny operon with too few genes. This entry will be omitted.")
-            return
+            return None
         for i in queryGenes:
             if i["direction"] == "-":
                 startPos = i["stop"]
@@ -387,7 +450,7 @@ def predict_promoter(operon, regIndex, genome_id):
         index = regIndex
         if len(queryGenes) == 0:
             # print("WARNING: Tiny operon with too few genes. This entry will be omitted.")
-            return
+            return None
         for i in queryGenes:
             if i["direction"] == "+":
                 stopPos = i["start"]
@@ -412,113 +475,114 @@ def predict_promoter(operon, regIndex, genome_id):
                     else:
                         index += 1
 
-    URL = (
-        "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=nuccore&id="
-        + str(genome_id)
-        + "&seq_start="
-        + str(startPos)
-        + "&seq_stop="
-        + str(stopPos)
-        + "&strand=1&rettype=fasta"
-        + f"&api_key={os.getenv('NcbiApiKey')}"
-    )
-    response = make_request("GET", URL)
-    # response = requests.get(URL)
-
-    if response.ok:
-        intergenic = response.text
-        output = ""
-        for i in intergenic.split("\n")[1:]:
-            output += i
-        if len(output) <= 1000:
-            return {"regulated_seq": output[1:-1], "reg_type": regType}
-        else:
-            # TODO: This is a potential failure mode!!!
-            # print('WARNING: Intergenic region is over 800bp')
-            return None
+    return startPos, stopPos, regType
+
+
+def predict_promoter(operon, regIndex, genome_id, store=None):
+    return run_async(predict_promoter_async, operon, regIndex, genome_id, store or GenomeStore())
+
+
+async def predict_promoter_async(requester, operon, regIndex, genome_id, store):
+    region = promoter_region(operon, regIndex)
+    if region is None:
+        return None
+    startPos, stopPos, regType = region
+
+    intergenic = await fetch_nucleotides_async(requester, genome_id, startPos, stopPos, store)
+    if intergenic is None:
+        return None
+    return promoter_from_seq(intergenic, regType)
+
+
+def promoter_from_seq(output, regType):
+    if len(output) <= 1000:
+        return {"regulated_seq": output[1:-1], "reg_type": regType}
     else:
-        print(f"Status Code: {response.status_code}")
-        print(f"Reason: {response.reason}")
-        print(f"Response Text: {response.text}")
-        print(f"Response Headers: {response.headers}")
-        print("FATAL: Bad eFetch request")
+        # TODO: This is a potential failure mode!!!
+        # print('WARNING: Intergenic region is over 800bp')
         return None
 
         # 800bp cutoff for an inter-operon region.
         # A region too long makes analysis fuzzy and less accurate.
 
 
-def acc2MetaDataList(access_ids: Dict[str, Any]) -> Dict[str, Any]:
+def ipg_url(access_ids) -> str:
     base_url = (
         f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=protein&rettype=ipg&api_key={os.getenv('NcbiApiKey')}"
     )
-    
-    # Pre-initialize results dictionary
+    return base_url + '&' + '&'.join(f"id={id}" for id in access_ids)
+
+
+def parse_ipg_reports(content: bytes, results: Dict[str, Any]) -> set:
+    """
+    Fill `results` with the first CDS of every IPGReport in a batch response.
+
+    Returns the set of product accessions that were present in the response.
+    """
+    # Set up iterative parser
+    context = etree.iterparse(
+        io.BytesIO(content),
+        events=('end',),
+        tag='{*}IPGReport',  # Handle potential namespaces
+        recover=True  # Continue parsing even if there are errors
+    )
+
+    # Track processed IDs for fallback handling
+    processed_ids = set()
+
+    # Process XML stream
+    for _, elem in context:
+        try:
+            product_acc = elem.get('product_acc')
+            if not product_acc:
+                continue
+
+            processed_ids.add(product_acc)
+
+            # Use XPath for efficient element location
+            cds = elem.xpath('.//CDS[1]')  # Get first CDS element
+            if cds:
+                cds = cds[0]
+                results[product_acc] = {
+                    'accver': cds.get('accver'),
+                    'start': cds.get('start'),
+                    'stop': cds.get('stop'),
+                    'strand': cds.get('strand')
+                }
+
+        except Exception as e:
+            print(f"Error processing element: {e}")
+            continue
+        finally:
+            # Clear element and its parents to free memory
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    return processed_ids
+
+
+def acc2MetaDataList(access_ids: Dict[str, Any]) -> Dict[str, Any]:
+    return run_async(acc2MetaDataList_async, access_ids)
+
+
+async def acc2MetaDataList_async(requester, access_ids: Dict[str, Any]) -> Dict[str, Any]:
     results = {id: None for id in access_ids}
-    
-    # Build URL
-    url = base_url + '&' + '&'.join(f"id={id}" for id in access_ids)
 
-    response = make_request("GET", url)
+    response = await requester.request("GET", ipg_url(access_ids))
     if response.status_code != 200:
-        print(f"non-200 HTTP response. eFetch failed: {response.status_code} - {response.reason}")
+        print(f"non-200 HTTP response. eFetch failed: {response.status_code} - {response.reason_phrase}")
         return results
 
     try:
-        # Set up iterative parser
-        context = etree.iterparse(
-            io.BytesIO(response.content),
-            events=('end',),
-            tag='{*}IPGReport',  # Handle potential namespaces
-            recover=True  # Continue parsing even if there are errors
-        )
-
-        # Track processed IDs for fallback handling
-        processed_ids = set()
+        processed_ids = parse_ipg_reports(response.content, results)
 
-        # Process XML stream
-        for _, elem in context:
-            try:
-                product_acc = elem.get('product_acc')
-                if not product_acc:
-                    continue
-
-                processed_ids.add(product_acc)
-                
-                # Use XPath for efficient element location
-                cds = elem.xpath('.//CDS[1]')  # Get first CDS element
-                if cds:
-                    cds = cds[0]
-                    results[product_acc] = {
-                        'accver': cds.get('accver'),
-                        'start': cds.get('start'),
-                        'stop': cds.get('stop'),
-                        'strand': cds.get('strand')
-                    }
-
-            except Exception as e:
-                print(f"Error processing element: {e}")
-                continue
-            finally:
-                # Clear element and its parents to free memory
-                elem.clear()
-                while elem.getprevious() is not None:
-                    del elem.getparent()[0]
-
-        # Handle unprocessed IDs using parallel processing
-        unprocessed_ids = set(access_ids.keys()) - processed_ids
-        if unprocessed_ids:
-            # Process unprocessed IDs in chunks
-            chunk_size = 50  # Adjust based on your needs
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                futures = []
-                for chunk in chunk_iterator(unprocessed_ids, chunk_size):
-                    futures.append(executor.submit(process_chunk, chunk))
-                
-                # Collect results
-                for future in futures:
-                    chunk_results = future.result()
-                    results.update(chunk_results)
+        # Fall back to one request per missing ID, all in flight at once
+        unprocessed_ids = [id for id in access_ids if id not in processed_ids]
+        fallback = await asyncio.gather(
+            *(acc2MetaData_async(requester, id) for id in unprocessed_ids)
+        )
+        results.update(zip(unprocessed_ids, fallback))
 
     except etree.ParseError as e:
         print(f"XML parsing error: {e}")
@@ -528,7 +592,55 @@ def acc2MetaDataList(access_ids: Dict[str, Any]) -> Dict[str, Any]:
     return results
 
 
+def parse_ipg_cds(content: bytes) -> Optional[Dict[str, str]]:
+    """
+    Extract the first CDS location from a single-accession IPG report.
+
+    Args:
+        content: Raw XML returned by eFetch with rettype=ipg
+
+    Returns:
+        Dictionary containing protein metadata or None if incomplete
+    """
+    # Create parser with optimized settings
+    parser = etree.XMLParser(
+        remove_blank_text=True,
+        remove_comments=True,
+        remove_pis=True,
+        huge_tree=True,
+        collect_ids=False,
+        recover=True
+    )
+
+    # Parse XML directly from response content
+    tree = etree.fromstring(content, parser=parser)
+
+    # Use XPath to efficiently find the first CDS element
+    cds = tree.xpath('//CDS[1]')
+    if not cds:
+        return None
+
+    cds = cds[0]
+
+    # Extract metadata
+    protein_dict = {
+        "accver": cds.get("accver"),
+        "start": cds.get("start"),
+        "stop": cds.get("stop"),
+        "strand": cds.get("strand")
+    }
+
+    # Validate required fields
+    if all(protein_dict.values()):
+        return protein_dict
+    return None
+
+
 def acc2MetaData(access_id: str) -> Optional[Dict[str, str]]:
+    return run_async(acc2MetaData_async, access_id)
+
+
+async def acc2MetaData_async(requester, access_id: str) -> Optional[Dict[str, str]]:
     """
     Fetch and parse metadata for a single protein accession ID.
     
@@ -538,46 +650,13 @@ def acc2MetaData(access_id: str) -> Optional[Dict[str, str]]:
     Returns:
         Dictionary containing protein metadata or None if not found/error
     """
-    url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=protein&id={access_id}&rettype=ipg&api_key={os.getenv('NcbiApiKey')}"
-    
     try:
-        result = make_request("GET", url)
+        result = await requester.request("GET", ipg_url([access_id]))
         if result.status_code != 200:
-            print(f"Request failed: {result.status_code} - {result.reason}")
+            print(f"Request failed: {result.status_code} - {result.reason_phrase}")
             return None
 
-        # Create parser with optimized settings
-        parser = etree.XMLParser(
-            remove_blank_text=True,
-            remove_comments=True,
-            remove_pis=True,
-            huge_tree=True,
-            collect_ids=False,
-            recover=True
-        )
-
-        # Parse XML directly from response content
-        tree = etree.fromstring(result.content, parser=parser)
-
-        # Use XPath to efficiently find the first CDS element
-        cds = tree.xpath('//CDS[1]')
-        if not cds:
-            return None
-
-        cds = cds[0]
-        
-        # Extract metadata
-        protein_dict = {
-            "accver": cds.get("accver"),
-            "start": cds.get("start"),
-            "stop": cds.get("stop"),
-            "strand": cds.get("strand")
-        }
-
-        # Validate required fields
-        if all(protein_dict.values()):
-            return protein_dict
-        return None
+        return parse_ipg_cds(result.content)
 
     except etree.ParseError as e:
         print(f"XML parsing error for {access_id}: {e}")
@@ -585,90 +664,142 @@ def acc2MetaData(access_id: str) -> Optional[Dict[str, str]]:
     except Exception as e:
         print(f"Unexpected error processing {access_id}: {e}")
         return None
-    finally:
-        # Ensure proper cleanup
-        try:
-            del tree
-        except:
-            pass
 
 
-def acc2OperonList(operon_list_entries):
-    metaData = acc2MetaDataList(operon_list_entries)
-    operon_dict = {}
+def assemble_operon(metaData, store=None):
+    return run_async(assemble_operon_async, metaData, store or GenomeStore())
 
-    for key, value in metaData.items():
-        if value is not None:
-            genes, index = getGenes(
-                value["accver"], int(value["start"]), int(value["stop"])
-            )
 
-            if index is not None:
-                enzyme = fasta2MetaData(genes[index])
+async def assemble_operon_async(requester, metaData, store):
+    """
+    Predict the operon and promoter around one enzyme.
 
-                operon, regIndex = getOperon(
-                    genes, index, enzyme["start"], enzyme["direction"]
-                )
-                operon_sequence, reassembly_match = NC2genome(value["accver"], operon)
-                promoter = predict_promoter(operon, regIndex, value["accver"])
-
-                data = {
-                    "operon": operon,
-                    "enzyme_index": regIndex,
-                    "enzyme_direction": enzyme["direction"],
-                    "operon_seq": operon_sequence,
-                    "promoter": promoter,
-                    "reassembly_match": reassembly_match,
-                    "genome": value["accver"],
-                }
+    Returns the genome context dictionary, or "EMPTY" when the enzyme could
+    not be located. Pass the same `store` for every enzyme of a query so
+    genome fragments are fetched once per locus.
+    """
+    located = await locate_operon_async(requester, metaData, store)
+    if located == "EMPTY":
+        return "EMPTY"
+    return await finish_operon_async(requester, located, store)
 
-                # OLD
-                # data = {"operon": operon, "enzyme_index": regIndex, "genome": metaData["accver"] }
 
-                operon_dict[key] = data
-            else:
-                operon_dict[key] = "EMPTY"
-        else:
-            operon_dict[key] = "EMPTY"
+async def locate_operon_async(requester, metaData, store):
+    """Find the genes of the operon around an enzyme, without any sequence."""
+    if metaData is None:
+        return "EMPTY"
 
-    return operon_dict
+    genes, index = await getGenes_async(
+        requester, metaData["accver"], int(metaData["start"]), int(metaData["stop"]), store
+    )
+    return located_operon(metaData, genes, index)
 
 
-def acc2operon(accession):
-    metaData = acc2MetaData(accession)
+def located_operon(metaData, genes, index):
+    if index is None:
+        return "EMPTY"
+
+    enzyme = genes[index].metadata()
+
+    operon, regIndex = getOperon(
+        GeneTable(genes), index, enzyme["start"], enzyme["direction"]
+    )
+    return {"metaData": metaData, "enzyme": enzyme, "operon": operon, "regIndex": regIndex}
+
 
-    if metaData != "EMPTY":
-        genes, index = getGenes(
-            metaData["accver"], int(metaData["start"]), int(metaData["stop"])
+async def finish_operon_async(requester, located, store):
+    """Attach the operon sequence and promoter to a located operon."""
+    accver = located["metaData"]["accver"]
+    operon, regIndex = located["operon"], located["regIndex"]
+    operon_sequence, reassembly_match = await NC2genome_async(
+        requester, accver, operon, store
+    )
+    promoter = await predict_promoter_async(requester, operon, regIndex, accver, store)
+
+    return operon_context(located["metaData"], located["enzyme"], operon, regIndex, operon_sequence, reassembly_match, promoter)
+
+
+def operon_context(metaData, enzyme, operon, regIndex, operon_sequence, reassembly_match, promoter):
+    # OLD
+    # data = {"operon": operon, "enzyme_index": regIndex, "genome": metaData["accver"] }
+    return {
+        "operon": operon,
+        "enzyme_index": regIndex,
+        "enzyme_direction": enzyme["direction"],
+        "operon_seq": operon_sequence,
+        "promoter": promoter,
+        "reassembly_match": reassembly_match,
+        "genome": metaData["accver"],
+    }
+
+
+def acc2OperonList(operon_list_entries):
+    return run_async(acc2OperonList_async, operon_list_entries)
+
+
+async def acc2OperonList_async(requester, operon_list_entries, max_workers=OPERON_WORKERS):
+    """
+    Assemble the operon of every accession.
+
+    Each accession is an independent task, and at most `max_workers` of them
+    run at once. Results come back in the order of the metadata lookup
+    regardless of which task finishes first.
+    """
+    metaData = await acc2MetaDataList_async(requester, operon_list_entries)
+    store = GenomeStore()
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def bounded(coro):
+        async with semaphore:
+            return await coro
+
+    # Locate every operon first, so each nucleotide fetch covers the whole
+    # CDS window of its locus and neighbouring operons share it. There is no
+    # cross-accession bulk fetch: eFetch applies one seq_start/seq_stop to
+    # every ID of a call, so sub-ranges of different genomes can't share one.
+    keys = list(metaData.keys())
+    located = await asyncio.gather(
+        *(bounded(locate_operon_async(requester, metaData[key], store)) for key in keys)
+    )
+    operons = await asyncio.gather(
+        *(
+            bounded(finish_operon_async(requester, value, store))
+            for value in located
+            if value != "EMPTY"
         )
+    )
 
-        if index is not None:
-            enzyme = fasta2MetaData(genes[index])
+    operons = iter(operons)
+    return {
+        key: "EMPTY" if value == "EMPTY" else next(operons)
+        for key, value in zip(keys, located)
+    }
 
-            operon, regIndex = getOperon(
-                genes, index, enzyme["start"], enzyme["direction"]
-            )
-            operon_sequence, reassembly_match = NC2genome(metaData["accver"], operon)
-            promoter = predict_promoter(operon, regIndex, metaData["accver"])
-
-            data = {
-                "operon": operon,
-                "enzyme_index": regIndex,
-                "enzyme_direction": enzyme["direction"],
-                "operon_seq": operon_sequence,
-                "promoter": promoter,
-                "reassembly_match": reassembly_match,
-                "genome": metaData["accver"],
-            }
-
-            # OLD
-            # data = {"operon": operon, "enzyme_index": regIndex, "genome": metaData["accver"] }
-
-            return data
-        else:
+
+async def acc2OperonTasks_async(requester, operon_list_entries, max_workers=OPERON_WORKERS):
+    """
+    Streaming alternative to `acc2OperonList_async`: accession -> a task
+    that locates and finishes that accession's operon on its own, so
+    callers can use each operon as soon as it is ready. At most
+    `max_workers` of the stages run at once.
+    """
+    metaData = await acc2MetaDataList_async(requester, operon_list_entries)
+    store = GenomeStore()
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def assemble(value):
+        async with semaphore:
+            located = await locate_operon_async(requester, value, store)
+        if located == "EMPTY":
             return "EMPTY"
-    else:
-        return "EMPTY"
+        async with semaphore:
+            return await finish_operon_async(requester, located, store)
+
+    return {key: asyncio.ensure_future(assemble(value)) for key, value in metaData.items()}
+
+
+def acc2operon(accession):
+    return assemble_operon(acc2MetaData(accession))
 
 
 if __name__ == "__main__":
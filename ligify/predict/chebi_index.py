@@ -0,0 +1,156 @@
+"""
+Offline ChEBI ID -> (name, SMILES, InChIKey) index.
+
+Candidate ligands are ChEBI IDs taken from UniProt reaction data, and the
+compounds behind them rarely change, so they are resolved from a SQLite file
+compiled from the ChEBI SDF dump at image build time instead of PubChem.
+Build it from the `ligify` directory with
+
+    python -m predict.chebi_index https://ftp.ebi.ac.uk/pub/databases/chebi/SDF/ChEBI_complete.sdf.gz data/chebi.sqlite
+
+(a local .sdf or .sdf.gz path works too). When the file is missing, every
+lookup is a miss and callers fall back to PubChem.
+"""
+
+import gzip
+import io
+import os
+import sqlite3
+import sys
+import threading
+import urllib.request
+
+CHEBI_INDEX_PATH = os.getenv(
+    "LIGIFY_CHEBI_INDEX",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "chebi.sqlite"),
+)
+
+# SDF data field names, lower-cased without spaces or underscores, across
+# ChEBI release formats
+SDF_FIELDS = {
+    "chebiid": "id",
+    "chebiname": "name",
+    "name": "name",
+    "smiles": "smiles",
+    "inchikey": "inchikey",
+}
+
+
+def chebi_number(chebi_id):
+    """15377 for "CHEBI:15377" or "15377", None if it isn't a ChEBI ID."""
+    number = str(chebi_id).upper().removeprefix("CHEBI:")
+    return int(number) if number.isdigit() else None
+
+
+class ChebiIndex:
+    """
+    Read-only view of the index. The file is opened immutable and memory
+    mapped, with one connection per thread.
+    """
+
+    def __init__(self, path=CHEBI_INDEX_PATH):
+        self.path = path
+        self.available = os.path.exists(path)
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True)
+            conn.execute("PRAGMA mmap_size = 268435456")
+            self.local.conn = conn
+        return conn
+
+    def get(self, chebi_id):
+        """{"name", "smiles", "inchikey"} for a ChEBI ID, or None on a miss."""
+        number = chebi_number(chebi_id)
+        if not self.available or number is None:
+            return None
+        try:
+            row = self._connection().execute(
+                "SELECT name, smiles, inchikey FROM chebi WHERE id = ?", (number,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"ChEBI index unavailable: {e}")
+            self.available = False
+            return None
+        if row is None:
+            return None
+        return {"name": row[0], "smiles": row[1], "inchikey": row[2]}
+
+
+_chebi_index = None
+
+
+def get_chebi_index() -> ChebiIndex:
+    global _chebi_index
+    if _chebi_index is None:
+        _chebi_index = ChebiIndex()
+    return _chebi_index
+
+
+def iter_sdf(lines):
+    """Yield the data fields of each SDF record as a dict, in a single pass."""
+    record = {}
+    field = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line == "$$$$":
+            yield record
+            record = {}
+            field = None
+        elif line.startswith(">") and "<" in line:
+            name = line[line.index("<") + 1 : line.rindex(">")]
+            field = SDF_FIELDS.get(name.lower().replace(" ", "").replace("_", ""))
+        elif field is not None:
+            if line:
+                # Multi-line values (long names) are joined
+                record[field] = record[field] + line if field in record else line
+            else:
+                field = None
+
+
+def open_sdf(source):
+    """Text lines of a local or remote .sdf / .sdf.gz file, streamed."""
+    if source.startswith(("http://", "https://", "ftp://")):
+        raw = urllib.request.urlopen(source)
+    else:
+        raw = open(source, "rb")
+    if source.endswith(".gz"):
+        raw = gzip.GzipFile(fileobj=raw)
+    return io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+
+
+def build_index(source, path):
+    """Compile the index at `path` from a ChEBI SDF dump. Returns the row count."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    conn = sqlite3.connect(tmp)
+    conn.execute(
+        "CREATE TABLE chebi (id INTEGER PRIMARY KEY, name TEXT, smiles TEXT, inchikey TEXT)"
+    )
+    count = 0
+    with open_sdf(source) as lines:
+        rows = (
+            (chebi_number(r["id"]), r.get("name"), r["smiles"], r.get("inchikey"))
+            for r in iter_sdf(lines)
+            # Entries without a structure are left to PubChem
+            if "id" in r and "smiles" in r and chebi_number(r["id"]) is not None
+        )
+        for row in rows:
+            conn.execute("INSERT OR REPLACE INTO chebi VALUES (?, ?, ?, ?)", row)
+            count += 1
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    os.replace(tmp, path)
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m predict.chebi_index <ChEBI SDF path or URL> <output.sqlite>")
+    print(f"Indexed {build_index(sys.argv[1], sys.argv[2])} ChEBI entries")
@@ -1,112 +1,410 @@
-import requests
+import asyncio
 import json
+import os
+import re
+
+from predict.rhea_index import get_rhea_index
+from predict.uniprot_sparql import (
+    SPARQL_HEADERS,
+    SPARQL_URL,
+    parse_bindings,
+    proteins_query,
+)
+from utils import run_async
 
 
 # TODO:
 # Get Rhea IDs and equations from PubChem.
-# Use Uniprot's SPARQL API (https://sparql.uniprot.org/) to speed up data acquisition
 
 
-# May want to get this info from Pubchem rather than Rhea, to avoid converting to the InChiKey
-def fetch_reactions(InChiKey: str, max_reactions: int):
-    # Get rhea ids from chemical
-    url = "https://www.rhea-db.org/rhea?"
-    parameter = {
+RHEA_URL = "https://www.rhea-db.org/rhea?"
+UNIPROT_SEARCH_URL = "https://rest.uniprot.org/uniprotkb/search"
+
+# Only request the parts of each UniProt entry that parse_protein reads:
+# organism + lineage, proteinDescription, references (DOIs),
+# uniProtKBCrossReferences (RefSeq/EMBL) and primaryAccession.
+UNIPROT_FIELDS = "accession,organism_name,lineage,protein_name,lit_doi_id,xref_refseq,xref_embl"
+
+# Batched searches also need the catalytic activity comments to tell which
+# reaction each entry belongs to.
+UNIPROT_BATCH_FIELDS = UNIPROT_FIELDS + ",cc_catalytic_activity"
+UNIPROT_PAGE_SIZE = 500
+RHEA_IDS_PER_QUERY = 50
+# Pages fetched for one batch of reactions before those still short of
+# proteins_per_reaction hits are searched one by one instead
+MAX_BATCH_PAGES = 4
+
+# "rhea" queries rhea-db.org and UniProt's Rhea search; "local" reads
+# reactions and their UniProt accessions from the Rhea index built by
+# predict/rhea_index.py, and only fetches the entries from UniProt.
+REACTION_BACKEND = os.getenv("LIGIFY_REACTION_BACKEND", "rhea")
+UNIPROT_ACCESSIONS_URL = "https://rest.uniprot.org/uniprotkb/accessions"
+ACCESSIONS_PER_QUERY = 500
+
+# "search" uses UniProt's REST search; "sparql" fetches the proteins of all
+# reactions with one query to UniProt's SPARQL endpoint.
+GENE_BACKEND = os.getenv("LIGIFY_GENE_BACKEND", "search")
+
+
+def reactions_params(InChiKey: str):
+    return {
         "query": "InChiKey:" + str(InChiKey),
         "columns": "rhea-id",
         "format": "json",
     }
-    response = requests.get(url, params=parameter)
 
-    if response.ok:
-        data = json.loads(response.text)["results"]
 
-        # Not all Rhea IDs have EC numbers associated with them (strangely)
-        output = {}
-        output["rxn_data"] = [
-            {"rhea_id": i["id"], "equation": i["equation"]} for i in data
-        ][0:max_reactions]
+def parse_reactions(text: str, max_reactions: int):
+    data = json.loads(text)["results"]
+
+    # Not all Rhea IDs have EC numbers associated with them (strangely)
+    output = {}
+    output["rxn_data"] = [
+        {"rhea_id": i["id"], "equation": i["equation"]} for i in data
+    ][0:max_reactions]
 
-        return output
+    return output
+
+
+def fetch_reactions(InChiKey: str, max_reactions: int):
+    return run_async(fetch_reactions_async, InChiKey, max_reactions)
+
+
+# May want to get this info from Pubchem rather than Rhea, to avoid converting to the InChiKey
+async def fetch_reactions_async(requester, InChiKey: str, max_reactions: int):
+    if REACTION_BACKEND == "local":
+        return get_rhea_index().reactions(InChiKey, max_reactions)
+
+    # Get rhea ids from chemical
+    response = await requester.request(
+        "GET", RHEA_URL, params=reactions_params(InChiKey)
+    )
+
+    if response.is_success:
+        return parse_reactions(response.text, max_reactions)
     else:
         raise Exception(f"Unable to fetch reactions for {InChiKey}")
 
 
-def fetch_genes(rhea_id, reviewed_bool, proteins_per_reaction):
+def genes_url(rhea_id, reviewed_bool, proteins_per_reaction):
     if reviewed_bool:
-        url = f"https://rest.uniprot.org/uniprotkb/search?format=json&size={proteins_per_reaction}&query=reviewed:true+AND+rhea:"
+        url = f"{UNIPROT_SEARCH_URL}?format=json&fields={UNIPROT_FIELDS}&size={proteins_per_reaction}&query=reviewed:true+AND+rhea:"
     else:
-        url = f"https://rest.uniprot.org/uniprotkb/search?format=json&size={proteins_per_reaction}&query=reviewed:false+AND+rhea:"
+        url = f"{UNIPROT_SEARCH_URL}?format=json&fields={UNIPROT_FIELDS}&size={proteins_per_reaction}&query=reviewed:false+AND+rhea:"
 
-    # Loop through all RHEA reactions associated with the input chemical.
+    return url + str(rhea_id)
 
-    response = requests.get(url + str(rhea_id))
-    
-    if response.ok:
-        data = json.loads(response.text)["results"]
 
-        proteins = []
+def fetch_genes(rhea_id, reviewed_bool, proteins_per_reaction):
+    return run_async(fetch_genes_async, rhea_id, reviewed_bool, proteins_per_reaction)
 
-        for entry in data:
-            if entry["organism"]["lineage"][0] == "Bacteria":
-                # Get reference DOIs
-                try:
-                    description = entry["proteinDescription"]["recommendedName"][
-                        "fullName"
-                    ]["value"]
-                    dois = []
-                    for j in entry["references"]:
-                        if "citationCrossReferences" in j["citation"]:
-                            for k in j["citation"]["citationCrossReferences"]:
-                                if k["database"] == "DOI":
-                                    dois.append(k["id"])
-                except Exception:
-                    description = None
-                    dois = []
 
-                # Get RefSeq ID
-                # The "NCBI_ID" is needed to get the genome context in the next step. Prefer to use RefSeq, but can use EMBL.
-                try:
-                    ncbi_id = [
-                        e["id"]
-                        for e in entry["uniProtKBCrossReferences"]
-                        if e["database"] == "RefSeq"
-                    ][0]
-                except Exception:
-                    try:
-                        ncbi_id = [
-                            e["properties"]
-                            for e in entry["uniProtKBCrossReferences"]
-                            if e["database"] == "EMBL"
-                        ][0]
-                        ncbi_id = [
-                            e["value"] for e in ncbi_id if e["key"] == "ProteinId"
-                        ][0]
-                    except Exception:
-                        ncbi_id = None
-                        print("no ncbi id retrived")
-
-                # Get Uniprot ID and Organism
-                uniprotID = entry["primaryAccession"]
-                organism = entry["organism"]["lineage"]
-
-                # Format protein data into a dictionary
-                protein = {
-                    "organism": organism,
-                    "enzyme": {
-                        "description": description,
-                        "uniprot_id": uniprotID,
-                        "dois": dois,
-                        "ncbi_id": ncbi_id,
-                    },
-                }
-                proteins.append(protein)
-
-        return proteins
+async def fetch_genes_async(requester, rhea_id, reviewed_bool, proteins_per_reaction):
+    if REACTION_BACKEND == "local" or GENE_BACKEND == "sparql":
+        proteins = await fetch_genes_batch_async(
+            requester, [rhea_id], reviewed_bool, proteins_per_reaction
+        )
+        return proteins[rhea_id]
+
+    # Loop through all RHEA reactions associated with the input chemical.
+    response = await requester.request(
+        "GET", genes_url(rhea_id, reviewed_bool, proteins_per_reaction)
+    )
+
+    if response.is_success:
+        return parse_genes(response.text)
     else:
         raise Exception(f"Unable to fetch genes for {rhea_id}")
 
 
+def parse_genes(text: str):
+    data = json.loads(text)["results"]
+
+    proteins = []
+    for entry in data:
+        protein = parse_protein(entry)
+        if protein is not None:
+            proteins.append(protein)
+
+    return proteins
+
+
+def parse_protein(entry):
+    # Only bacterial enzymes have a genome context Ligify can use
+    if entry["organism"]["lineage"][0] != "Bacteria":
+        return None
+
+    # Get reference DOIs
+    try:
+        description = entry["proteinDescription"]["recommendedName"][
+            "fullName"
+        ]["value"]
+        dois = []
+        for j in entry["references"]:
+            if "citationCrossReferences" in j["citation"]:
+                for k in j["citation"]["citationCrossReferences"]:
+                    if k["database"] == "DOI":
+                        dois.append(k["id"])
+    except Exception:
+        description = None
+        dois = []
+
+    # Get RefSeq ID
+    # The "NCBI_ID" is needed to get the genome context in the next step. Prefer to use RefSeq, but can use EMBL.
+    try:
+        ncbi_id = [
+            e["id"]
+            for e in entry["uniProtKBCrossReferences"]
+            if e["database"] == "RefSeq"
+        ][0]
+    except Exception:
+        try:
+            ncbi_id = [
+                e["properties"]
+                for e in entry["uniProtKBCrossReferences"]
+                if e["database"] == "EMBL"
+            ][0]
+            ncbi_id = [
+                e["value"] for e in ncbi_id if e["key"] == "ProteinId"
+            ][0]
+        except Exception:
+            ncbi_id = None
+            print("no ncbi id retrived")
+
+    # Get Uniprot ID and Organism
+    uniprotID = entry["primaryAccession"]
+    organism = entry["organism"]["lineage"]
+
+    # Format protein data into a dictionary
+    protein = {
+        "organism": organism,
+        "enzyme": {
+            "description": description,
+            "uniprot_id": uniprotID,
+            "dois": dois,
+            "ncbi_id": ncbi_id,
+        },
+    }
+    return protein
+
+
+def rhea_master_id(rhea_id) -> int:
+    # Rhea numbers each reaction as a block of four IDs (master, left-to-right,
+    # right-to-left, bidirectional) starting at a multiple of 4.
+    number = int(re.sub(r"\D", "", str(rhea_id)))
+    return number - number % 4
+
+
+def entry_rhea_ids(entry):
+    """Master Rhea IDs of every catalytic activity annotated on an entry."""
+    ids = set()
+    for comment in entry.get("comments", []):
+        if comment.get("commentType") != "CATALYTIC ACTIVITY":
+            continue
+        refs = list(comment.get("reaction", {}).get("reactionCrossReferences", []))
+        for physiological in comment.get("physiologicalReactions", []):
+            if "reactionCrossReference" in physiological:
+                refs.append(physiological["reactionCrossReference"])
+        for ref in refs:
+            if ref.get("database") == "Rhea" and ref.get("id", "").startswith("RHEA:"):
+                ids.add(rhea_master_id(ref["id"]))
+    return ids
+
+
+class ReactionProteins:
+    """
+    Routes entries from a batched UniProt search back to their reactions.
+
+    Each reaction keeps at most `proteins_per_reaction` hits, counted the same
+    way as `fetch_genes` (the first N search hits, of which only bacterial
+    ones are kept), so both modes return the same kind of result. Entries
+    already seen are skipped, so a search can be restarted with fewer
+    reactions.
+    """
+
+    def __init__(self, rhea_ids, proteins_per_reaction):
+        self.proteins_per_reaction = proteins_per_reaction
+        self.masters = {rhea_id: rhea_master_id(rhea_id) for rhea_id in rhea_ids}
+        self.hits = {master: 0 for master in self.masters.values()}
+        self.proteins = {master: [] for master in self.masters.values()}
+        self.seen = set()
+
+    def add(self, entries):
+        for entry in entries:
+            accession = entry.get("primaryAccession")
+            if accession in self.seen:
+                continue
+            self.seen.add(accession)
+            masters = [
+                m for m in entry_rhea_ids(entry)
+                if m in self.hits and self.hits[m] < self.proteins_per_reaction
+            ]
+            if not masters:
+                continue
+            protein = parse_protein(entry)
+            for m in masters:
+                self.hits[m] += 1
+                if protein is not None:
+                    self.proteins[m].append(protein)
+
+    def pending(self, rhea_ids):
+        """The reactions among `rhea_ids` still short of `proteins_per_reaction` hits."""
+        return [
+            rhea_id for rhea_id in rhea_ids
+            if self.hits[self.masters[rhea_id]] < self.proteins_per_reaction
+        ]
+
+    def replace(self, rhea_id, proteins):
+        """Take a reaction's proteins from its own search instead."""
+        master = self.masters[rhea_id]
+        self.hits[master] = self.proteins_per_reaction
+        self.proteins[master] = list(proteins)
+
+    def result(self):
+        return {
+            rhea_id: list(self.proteins[master])
+            for rhea_id, master in self.masters.items()
+        }
+
+
+def batch_params(rhea_ids, reviewed_bool):
+    terms = " OR ".join("rhea:" + str(i) for i in rhea_ids)
+    return {
+        "format": "json",
+        "fields": UNIPROT_BATCH_FIELDS,
+        "size": UNIPROT_PAGE_SIZE,
+        "query": f"reviewed:{str(bool(reviewed_bool)).lower()} AND ({terms})",
+    }
+
+
+def fetch_genes_batch(rhea_ids, reviewed_bool, proteins_per_reaction):
+    return run_async(fetch_genes_batch_async, rhea_ids, reviewed_bool, proteins_per_reaction)
+
+
+async def fetch_genes_batch_async(requester, rhea_ids, reviewed_bool, proteins_per_reaction):
+    """
+    Fetch the proteins of many Rhea reactions with OR'd UniProt searches.
+
+    Follows UniProt's cursor pagination until every reaction has
+    `proteins_per_reaction` hits or the results run out. Once a reaction has
+    all its hits the search starts over without it, and after
+    `MAX_BATCH_PAGES` pages the reactions still short are searched one by one
+    with `fetch_genes_async`, so a reaction with few entries never drags the
+    whole OR'd result set through pagination.
+
+    Returns a dictionary of rhea_id to the same protein list as `fetch_genes`.
+    """
+    rhea_ids = list(rhea_ids)
+    if GENE_BACKEND == "sparql":
+        response = await requester.request(
+            "POST",
+            SPARQL_URL,
+            data=sparql_params(rhea_ids, reviewed_bool, proteins_per_reaction),
+            headers=SPARQL_HEADERS,
+        )
+        if not response.is_success:
+            raise Exception(f"Unable to fetch genes for {', '.join(map(str, rhea_ids))}")
+        return parse_bindings(response.json(), rhea_ids, parse_protein)
+
+    if REACTION_BACKEND == "local":
+        accessions = indexed_accessions(rhea_ids, reviewed_bool, proteins_per_reaction)
+        entries = await fetch_entries_async(
+            requester, (a for ids in accessions.values() for a in ids)
+        )
+        return proteins_by_reaction(accessions, entries)
+
+    collector = ReactionProteins(rhea_ids, proteins_per_reaction)
+
+    short = []
+    for start in range(0, len(rhea_ids), RHEA_IDS_PER_QUERY):
+        pending = collector.pending(rhea_ids[start : start + RHEA_IDS_PER_QUERY])
+        url, params = UNIPROT_SEARCH_URL, batch_params(pending, reviewed_bool)
+        pages = 0
+        while pending and url:
+            if pages == MAX_BATCH_PAGES:
+                short += pending
+                break
+            response = await requester.request("GET", url, params=params)
+            if not response.is_success:
+                raise Exception(f"Unable to fetch genes for {', '.join(map(str, pending))}")
+            collector.add(json.loads(response.text)["results"])
+            pages += 1
+            remaining = collector.pending(pending)
+            if len(remaining) < len(pending):
+                # Start over without the reactions that have all their hits
+                pending = remaining
+                url, params = UNIPROT_SEARCH_URL, batch_params(pending, reviewed_bool)
+            else:
+                # The next link already carries the query and the cursor
+                url, params = response.links.get("next", {}).get("url"), None
+
+    proteins = await asyncio.gather(
+        *(
+            fetch_genes_async(requester, rhea_id, reviewed_bool, proteins_per_reaction)
+            for rhea_id in short
+        )
+    )
+    for rhea_id, found in zip(short, proteins):
+        collector.replace(rhea_id, found)
+
+    return collector.result()
+
+
+def sparql_params(rhea_ids, reviewed_bool, proteins_per_reaction):
+    return {"query": proteins_query(rhea_ids, reviewed_bool, proteins_per_reaction)}
+
+
+def indexed_accessions(rhea_ids, reviewed_bool, proteins_per_reaction):
+    """rhea_id -> the first `proteins_per_reaction` accessions in the Rhea index."""
+    index = get_rhea_index()
+    return {
+        rhea_id: index.accessions(rhea_id, reviewed_bool, proteins_per_reaction)
+        for rhea_id in rhea_ids
+    }
+
+
+def accession_chunks(accessions):
+    unique = list(dict.fromkeys(accessions))
+    for start in range(0, len(unique), ACCESSIONS_PER_QUERY):
+        yield unique[start : start + ACCESSIONS_PER_QUERY]
+
+
+async def fetch_entries_async(requester, accessions):
+    """accession -> UniProt REST entry, fetched in batches by accession."""
+    entries = {}
+    for chunk in accession_chunks(accessions):
+        url, params = UNIPROT_ACCESSIONS_URL, accessions_params(chunk)
+        while url:
+            response = await requester.request("GET", url, params=params)
+            if not response.is_success:
+                raise Exception(f"Unable to fetch UniProt entries {', '.join(chunk)}")
+            entries.update(index_entries(response.text))
+            url, params = response.links.get("next", {}).get("url"), None
+    return entries
+
+
+def accessions_params(accessions):
+    return {
+        "format": "json",
+        "fields": UNIPROT_FIELDS,
+        "size": ACCESSIONS_PER_QUERY,
+        "accessions": ",".join(accessions),
+    }
+
+
+def index_entries(text: str):
+    return {entry["primaryAccession"]: entry for entry in json.loads(text)["results"]}
+
+
+def proteins_by_reaction(accessions, entries):
+    """Parse each reaction's entries in index order, as `fetch_genes` would."""
+    result = {}
+    for rhea_id, ids in accessions.items():
+        proteins = [parse_protein(entries[a]) for a in ids if a in entries]
+        result[rhea_id] = [p for p in proteins if p is not None]
+    return result
+
+
 def filter_genes(output, lineage_filter_name):
     rxns = output["rxn_data"]
     # filter out empties
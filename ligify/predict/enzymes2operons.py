@@ -1,24 +1,33 @@
-import json
+import asyncio
 import os
 import re
+import threading
 import time
-import requests
-from functools import lru_cache
 
-from utils import make_request  # Assuming make_request uses a persistent session and rate limiting
+from predict.chebi_index import get_chebi_index
+from predict.pubchem import get_properties_async
+from utils import bounded_cache, make_request, run_async  # Persistent session, rate limiting and response cache
+
+# Memory budgets for the per-process caches below. Batch runs over many
+# chemicals keep hitting the same operon genes, so these stay warm without
+# growing past a fixed size.
+UNIPROT_CACHE_BYTES = int(os.getenv("LIGIFY_UNIPROT_CACHE_BYTES", 16 * 1024 * 1024))
+FASTA_CACHE_BYTES = int(os.getenv("LIGIFY_FASTA_CACHE_BYTES", 16 * 1024 * 1024))
+
+NO_REG_DATA = {
+    "annotation": "No data available",
+    "id": "No data available",
+    "references": "No data available",
+    "length": "No data available",
+}
 
-# Create a global session for all external requests
-session = requests.Session()
-session.headers.update({"User-Agent": "my-bioinfo-app/1.0"})
 
-@lru_cache(maxsize=None)
 def fetch_uniprot_json(query_url: str):
-    # A cached fetch function for Uniprot responses
-    resp = session.get(query_url)
+    resp = make_request("GET", query_url)
     resp.raise_for_status()
     return resp.json()
 
-@lru_cache(maxsize=None)
+@bounded_cache(FASTA_CACHE_BYTES)
 def fetch_protein_fasta(accession: str):
     URL = (
         "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi/?db=protein&id="
@@ -31,13 +40,29 @@ def fetch_protein_fasta(accession: str):
     seq = "".join(line for line in resp.text.split("\n")[1:])
     return seq
 
-def protein2chemicals(accession: str):
+@bounded_cache(UNIPROT_CACHE_BYTES)
+def fetch_uniprot_summary(accession: str):
+    """
+    Fetch a UniProt entry and keep only the fields Ligify reads from it.
+
+    The full JSON document is dropped once `protein2chemicals` and
+    `fetch_uniprot_reg_data` data have been extracted, so only the summary is
+    held in memory.
+    """
     url = "https://rest.uniprot.org/uniprotkb/search?query=" + accession + "&format=json"
+    protein = fetch_uniprot_json(url)
+    return {
+        "chemicals": extract_chemicals(protein),
+        "regulator": extract_reg_data(protein),
+    }
+
+def protein2chemicals(accession: str):
     try:
-        protein = fetch_uniprot_json(url)
+        return fetch_uniprot_summary(accession)["chemicals"]
     except Exception:
         return None
 
+def extract_chemicals(protein):
     if len(protein.get("results", [])) > 0:
         protein_comments = protein["results"][0].get("comments", [])
         protein_data = {}
@@ -75,11 +100,15 @@ def protein2chemicals(accession: str):
         return protein_data
     return None
 
-@lru_cache(maxsize=None)
 def fetch_uniprot_reg_data(accession: str):
-    url = "https://rest.uniprot.org/uniprotkb/search?query=" + accession + "&format=json"
     try:
-        data = fetch_uniprot_json(url)["results"][0]
+        return fetch_uniprot_summary(accession)["regulator"]
+    except Exception:
+        return dict(NO_REG_DATA)
+
+def extract_reg_data(protein):
+    try:
+        data = protein["results"][0]
         dois = []
         for j in data.get("references", []):
             doi = None
@@ -100,29 +129,140 @@ def fetch_uniprot_reg_data(accession: str):
             "length": data["sequence"]["length"] if data.get("sequence") else "No data available",
         }
     except Exception:
-        regulator = {
-            "annotation": "No data available",
-            "id": "No data available",
-            "references": "No data available",
-            "length": "No data available",
-        }
+        regulator = dict(NO_REG_DATA)
 
     return regulator
 
-def pull_regulators(protein, rxn):
-    regulator_pattern = re.compile(r"regulator|repressor|activator")
+def cache_stats():
+    """Hit/miss/eviction counters of the in-memory caches."""
+    return {
+        "uniprot": fetch_uniprot_summary.cache.stats(),
+        "fasta": fetch_protein_fasta.cache.stats(),
+    }
+
+# Blacklisted ligands
+NOT_LIGAND_IDS = {
+    "CHEBI:15378",    # H(+)
+    "CHEBI:15377",    # H2O
+    "CHEBI:16474",    # NADPH
+    "CHEBI:16908",    # NADH
+    "CHEBI:57945",    # NADH(-2)
+    "CHEBI:57540",    # NAD(-1)
+    "CHEBI:18009",    # NADP(+)
+    "CHEBI:15846",    # NAD(+)
+    "CHEBI:58349",    # NADP
+    "CHEBI:57783",    # NADPH(-4)
+}
+NOT_LIGANDS = {"H2O", "+", "-", "=", "A", "AH2", "H(+)", "NADPH", "NADH", "NADP(+)", "NAD(+)", "2", "H(+)in", "H(+)out"}
+
+REGULATOR_PATTERN = re.compile(r"regulator|repressor|activator")
+
+LIGAND_PROPERTIES = ("IsomericSMILES", "IUPACName")
+
+
+def ligand(properties):
+    if properties is not None:
+        return {"name": properties.get("IUPACName"), "smiles": properties["IsomericSMILES"]}
+
+def indexed_ligand(chebi_id):
+    """Name and SMILES from the bundled ChEBI index, or None on a miss."""
+    entry = get_chebi_index().get(chebi_id)
+    if entry is not None:
+        return {"name": entry["name"], "smiles": entry["smiles"]}
+
+# function to get name and smiles
+def get_smiles_and_name(input):
+    return run_async(get_smiles_and_name_async, input)
+
+async def get_smiles_and_name_async(requester, input):
+    return indexed_ligand(input) or ligand(
+        await get_properties_async(requester, input, "name", LIGAND_PROPERTIES)
+    )
 
-    reg_data = []
+
+class LigandMemo:
+    """
+    Request-scoped ChEBI ID -> {"name", "smiles"} memo.
+
+    Operons of the same request share most of their ligands, so each ChEBI ID
+    is looked up on PubChem once per request. `fetch_ligands_async` can fill
+    it for every operon up front; anything still missing is fetched by
+    `resolve`.
+    """
+
+    def __init__(self):
+        self.ligands = {}
+        self.lock = threading.Lock()
+
+    def missing(self, chebi_ids):
+        with self.lock:
+            return [i for i in dict.fromkeys(chebi_ids) if i not in self.ligands]
+
+    def update(self, ligands):
+        with self.lock:
+            self.ligands.update(ligands)
+
+    def resolve(self, chebi_ids):
+        """Name and SMILES for each ID, in order; None where PubChem has none."""
+        if self.missing(chebi_ids):
+            run_async(fetch_ligands_async, chebi_ids, self)
+        with self.lock:
+            return [self.ligands[i] for i in chebi_ids]
+
+
+async def fetch_ligands_async(requester, chebi_ids, memo):
+    """Look up every ChEBI ID the memo does not hold yet in one concurrent batch."""
+    missing = memo.missing(chebi_ids)
+    ligands = await asyncio.gather(
+        *(get_smiles_and_name_async(requester, i) for i in missing)
+    )
+    memo.update(zip(missing, ligands))
+
+
+def has_regulator(operon):
+    return any(
+        "description" in gene and REGULATOR_PATTERN.search(gene["description"])
+        for gene in operon
+    )
+
+def operon_ligands(operon):
+    """
+    Ligands associated with an operon through its genes' UniProt entries:
+    the ChEBI IDs of their catalyzed reactions and the words of the reaction
+    names. Shared by every regulator in the operon.
+    """
+    ligand_ids = []
     ligand_names = []
+    for gene in operon:
+        protein_data = protein2chemicals(gene["accession"])
+        if isinstance(protein_data, dict):
+            if "ligands" in protein_data.keys():
+                ligand_ids += protein_data["ligands"]
+            if "catalysis" in protein_data.keys():
+                ligand_names += protein_data["catalysis"].split(" ")
+
+    return {
+        "ligand_ids": [i for i in dict.fromkeys(ligand_ids) if i not in NOT_LIGAND_IDS],
+        "alt_ligands": [i for i in dict.fromkeys(ligand_names) if i not in NOT_LIGANDS],
+    }
+
+def pull_regulators(protein, rxn, ligand_memo=None):
+    reg_data = []
 
-    # Cache or store operon calls if same operon is processed multiple times
     if protein.get("context", "EMPTY") != "EMPTY":
         operon = protein["context"]["operon"]
-        # Pre-fetch all sequences and data for operon genes if possible
-        # This reduces repeated calls in a loop
+        if not has_regulator(operon):
+            return reg_data
+
+        # Ligands are a property of the operon, so they are gathered once
+        # and shared by all of its regulators
+        if ligand_memo is None:
+            ligand_memo = LigandMemo()
+        ligands = operon_ligands(operon)
+        candidate_ligands = ligand_memo.resolve(ligands["ligand_ids"])
 
         for gene in operon:
-            if "description" in gene and regulator_pattern.search(gene["description"]):
+            if "description" in gene and REGULATOR_PATTERN.search(gene["description"]):
                 entry = {
                     "refseq": gene["accession"],
                     "annotation": gene["description"],
@@ -132,93 +272,12 @@ def pull_regulators(protein, rxn):
                 }
 
                 # Fetch possible alternative inducer molecules associated with the operon
-                ligand_ids = []
-                for gene in operon:
-                    protein_data = protein2chemicals(gene["accession"])
-                    if isinstance(protein_data, dict):
-                        if "ligands" in protein_data.keys():
-                            for l in protein_data['ligands']:
-                                ligand_ids.append(l)
-                unique_ligand_ids = list(set(ligand_ids))
-                # Blacklisted ligands
-                not_ligand_ids = [
-                    "CHEBI:15378",    # H(+)
-                    "CHEBI:15377",    # H2O
-                    "CHEBI:16474",    # NADPH
-                    "CHEBI:16908",    # NADH
-                    "CHEBI:57945",    # NADH(-2)
-                    "CHEBI:57540",    # NAD(-1)
-                    "CHEBI:18009",    # NADP(+)
-                    "CHEBI:15846",    # NAD(+)
-                    "CHEBI:58349",    # NADP
-                    "CHEBI:57783"     # NADPH(-4)
-                ]
-                unique_ligand_ids = [
-                    i for i in unique_ligand_ids if i not in not_ligand_ids
-                ]
-
-                # function to get name and smiles
-                def get_smiles_and_name(input):
-                    URL = (
-                        "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/name/"
-                        + str(input)
-                        + "/property/IsomericSMILES,IUPACName/JSON"
-                    )
-                    response = requests.get(URL)
-                    if response.ok:
-                        data = json.loads(response.text)
-                        name = data["PropertyTable"]["Properties"][0]["IUPACName"]
-                        smiles = data["PropertyTable"]["Properties"][0]["IsomericSMILES"]
-
-                        return {"name":name, "smiles":smiles}
-
-                ligands = []
-                for i in unique_ligand_ids:
-                    ligands.append(get_smiles_and_name(i))
-
-
-                entry["candidate_ligands"] = ligands
-                
-                for gene in operon:
-                    protein_data = protein2chemicals(gene["accession"])
-                    if isinstance(protein_data, dict):
-                        if "catalysis" in protein_data.keys():
-                            ligand_names += protein_data["catalysis"].split(" ")
-                unique_ligands = list(set(ligand_names))
-                # Blacklisted ligands
-                not_ligands = [
-                    "H2O",
-                    "+",
-                    "-",
-                    "=",
-                    "A",
-                    "AH2",
-                    "H(+)",
-                    "NADPH",
-                    "NADH",
-                    "NADP(+)",
-                    "NAD(+)",
-                    "2",
-                    "H(+)in",
-                    "H(+)out",
-                ]
-                unique_ligands = [
-                    i for i in unique_ligands if i not in not_ligands
-                ]
-
-                # NCBI seq (cached)
-                entry["reg_protein_seq"] = fetch_protein_fasta(gene["accession"])
+                entry["candidate_ligands"] = list(candidate_ligands)
 
-                # Protein2chemicals (cached)
-                # Try to gather info for all genes first, then process?
-                protein_data = protein2chemicals(gene["accession"])
-                if isinstance(protein_data, dict) and "catalysis" in protein_data:
-                    ligand_names += protein_data["catalysis"].split(" ")
+                # NCBI seq of the regulator (cached)
+                entry["reg_protein_seq"] = fetch_protein_fasta(gene["accession"])
 
-                # Filter ligands
-                not_ligands = {"H2O", "+", "-", "=", "A", "AH2", "H(+)", "NADPH", "NADH", "NADP(+)", "NAD(+)", "2", "H(+)in", "H(+)out"}
-                unique_ligands = [i for i in set(ligand_names) if i not in not_ligands]
-                entry["alt_ligands"] = unique_ligands
+                entry["alt_ligands"] = list(ligands["alt_ligands"])
 
                 reg_data.append(entry)
 
@@ -226,22 +285,4 @@ def pull_regulators(protein, rxn):
 
 
 if __name__ == "__main__":
-    
-
-    # function to get name and smiles
-    def get_smiles_and_name(input):
-        URL = (
-            "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/name/"
-            + str(input)
-            + "/property/IsomericSMILES,IUPACName/JSON"
-        )
-        response = requests.get(URL)
-        if response.ok:
-            data = json.loads(response.text)
-            name = data["PropertyTable"]["Properties"][0]["IUPACName"]
-            smiles = data["PropertyTable"]["Properties"][0]["IsomericSMILES"]
-
-            return {"name":name, "smiles":smiles}
-
-
     print(get_smiles_and_name("CHEBI:15378"))
@@ -0,0 +1,32 @@
+from array import array
+
+# Strand codes of the `strand` column; 0 marks a CDS without a location
+PLUS, MINUS, UNKNOWN = 1, -1, 0
+STRAND_CODES = {"+": PLUS, "-": MINUS}
+
+
+class GeneTable:
+    """
+    Columnar view of the CDSs of a genome window, in genome order.
+
+    Built once from a list of `accID2operon.CdsRecord`s, whose headers are
+    parsed when the window is fetched. Start, stop and strand are compact
+    `array` columns (they also expose the buffer protocol, so
+    `numpy.frombuffer` reads them without copying): `getOperon` walks
+    strand and start by index arithmetic, and `genome_operons` reads all
+    three. Only the genes returned get a dictionary, copied from their
+    parsed header fields.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.start = array("q", (r.start for r in records))
+        self.stop = array("q", (r.stop for r in records))
+        self.strand = array("b", (STRAND_CODES.get(r.direction, UNKNOWN) for r in records))
+
+    def __len__(self):
+        return len(self.records)
+
+    def metadata(self, index):
+        """The `fasta2MetaData` dictionary of a gene, as a new dict."""
+        return self.records[index].metadata()
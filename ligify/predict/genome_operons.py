@@ -0,0 +1,256 @@
+"""
+Whole-genome operon and promoter prediction.
+
+`getOperon` and `promoter_region` work around one enzyme at a time. For
+batch precomputation, `GenomeOperons` takes the CDS table of a whole genome
+and computes the operon boundaries and candidate promoter region of every
+gene at once with numpy: strand runs, the 8000 bp walk limit, intergenic
+gaps over 100 bp and the 1000 bp promoter cutoff. Looking up an enzyme is
+then a dictionary hit and a few array reads.
+
+The rules are those of `getOperon` and `promoter_region`, and give the same
+operons and regions for every gene whose neighbours fall inside the window
+`getGenes` would fetch around it. Genes without a location are left out of
+the table, and the walk stops at the ends of the sequence instead of
+wrapping around.
+"""
+
+import os
+
+import numpy as np
+
+from predict.accID2operon import (
+    EFETCH_URL,
+    iter_cds_records,
+    promoter_from_seq,
+)
+from predict.gene_table import MINUS, PLUS, GeneTable
+from utils import run_async
+
+# Genes further than this from the enzyme's start end the operon walk
+OPERON_SPAN = 8000
+# Intergenic gaps longer than this are a promoter of their own (regType 2)
+INTERGENIC_GAP = 100
+# Longer promoter regions are rejected, as in `promoter_from_seq`
+PROMOTER_CUTOFF = 1000
+
+
+class GenomeOperons:
+    """
+    Operon boundaries and promoter regions of every gene of a genome.
+
+    Built from the `CdsRecord`s of a whole genome, in any order. For gene
+    `i` (its index in `table`) the operon is `table[lo[i] : hi[i] + 1]`,
+    with the gene at `i - lo[i]`, and `region_start[i]`, `region_stop[i]`
+    and `reg_type[i]` give its promoter region (`reg_type` 0 when there is
+    none). `candidate[i]` is set for regions within the 1000 bp cutoff.
+    """
+
+    def __init__(self, records):
+        records = sorted(
+            (r for r in records if r.direction in ("+", "-")),
+            key=lambda r: (r.start, r.stop),
+        )
+        self.table = GeneTable(records)
+        self.by_accession = {}
+        self.by_location = {}
+        for i, record in enumerate(records):
+            self.by_accession.setdefault(record.accession, i)
+            self.by_location[(record.start, record.stop)] = i
+
+        strand = np.frombuffer(self.table.strand, dtype=np.int8)
+        start = np.frombuffer(self.table.start, dtype=np.int64)
+        stop = np.frombuffer(self.table.stop, dtype=np.int64)
+        self.lo, self.hi = operon_bounds(strand, start)
+        self.region_start, self.region_stop, self.reg_type = promoter_regions(
+            strand, start, stop, self.lo, self.hi
+        )
+        length = np.maximum(self.region_stop - self.region_start + 1, 0)
+        self.candidate = (self.reg_type > 0) & (length <= PROMOTER_CUTOFF)
+
+    def __len__(self):
+        return len(self.table)
+
+    def index(self, accession=None, start=None, stop=None):
+        """The table index of a gene, by accession or by location, or None."""
+        if accession is not None:
+            return self.by_accession.get(accession)
+        return self.by_location.get((int(start), int(stop)))
+
+    def operon(self, i):
+        """The operon around gene `i`, as `getOperon` returns it."""
+        lo, hi = int(self.lo[i]), int(self.hi[i])
+        return [self.table.metadata(j) for j in range(lo, hi + 1)], i - lo
+
+    def promoter_region(self, i):
+        """(startPos, stopPos, regType) as `promoter_region` returns it, or None."""
+        if not self.reg_type[i]:
+            return None
+        return int(self.region_start[i]), int(self.region_stop[i]), int(self.reg_type[i])
+
+    def promoter(self, i, sequence):
+        """
+        The promoter of gene `i` as `predict_promoter` returns it, cut from
+        `sequence`, the genome's nucleotides starting at position 1.
+        """
+        region = self.promoter_region(i)
+        if region is None:
+            return None
+        startPos, stopPos, regType = region
+        return promoter_from_seq(sequence[startPos - 1 : stopPos], regType)
+
+    def located(self, metaData):
+        """
+        The operon around an enzyme in the shape `locate_operon_async`
+        returns, so it can go through `finish_operon_async`. "EMPTY" if the
+        enzyme isn't here.
+        """
+        if metaData is None:
+            return "EMPTY"
+        i = self.index(start=metaData["start"], stop=metaData["stop"])
+        if i is None:
+            return "EMPTY"
+        operon, regIndex = self.operon(i)
+        return {
+            "metaData": metaData,
+            "enzyme": self.table.metadata(i),
+            "operon": operon,
+            "regIndex": regIndex,
+        }
+
+
+def runs(strand):
+    """First and last index of the same-strand run each gene belongs to."""
+    n = len(strand)
+    change = np.flatnonzero(strand[1:] != strand[:-1]) + 1
+    run_starts = np.concatenate(([0], change))
+    run_stops = np.concatenate((change - 1, [n - 1]))
+    run = np.cumsum(np.concatenate(([0], strand[1:] != strand[:-1])))
+    return run_starts[run], run_stops[run]
+
+
+def operon_bounds(strand, start):
+    """
+    First and last operon gene of every gene, following `getOperon`.
+
+    Downstream, the neighbour is always taken; the walk then continues over
+    the neighbour's strand run while genes are within 8000 bp, and takes one
+    divergent gene past the run when the operon reads on the plus strand.
+    Upstream mirrors this for the minus strand.
+    """
+    n = len(strand)
+    index = np.arange(n)
+    lo, hi = index.copy(), index.copy()
+    if n < 2:
+        return lo, hi
+    strand = strand.astype(np.int64)
+    run_start, run_stop = runs(strand)
+    # Nearest genes within OPERON_SPAN of each gene's start, on either side
+    near = np.searchsorted(start, start - OPERON_SPAN, side="left")
+    far = np.searchsorted(start, start + OPERON_SPAN, side="right") - 1
+
+    # Downstream, for genes 1..n-1
+    i = index[1:]
+    prev = strand[:-1]
+    walk = np.where((strand[1:] == MINUS) | (prev == MINUS), MINUS, PLUS)
+    first = run_start[:-1]
+    edge = first - 1
+    within = near[1:] > first
+    lo[1:] = np.where(
+        prev != walk,
+        i - 1,
+        np.where(
+            within,
+            np.minimum(i - 1, near[1:]),
+            np.where((edge >= near[1:]) & (walk == PLUS), edge, first),
+        ),
+    )
+
+    # Upstream, for genes 0..n-2
+    i = index[:-1]
+    following = strand[1:]
+    walk = np.where((strand[:-1] == PLUS) | (following == PLUS), PLUS, MINUS)
+    last = run_stop[1:]
+    edge = last + 1
+    within = far[:-1] < last
+    hi[:-1] = np.where(
+        following != walk,
+        i + 1,
+        np.where(
+            within,
+            np.maximum(i + 1, far[:-1]),
+            np.where((edge <= far[:-1]) & (walk == MINUS), edge, last),
+        ),
+    )
+    return lo, hi
+
+
+def promoter_regions(strand, start, stop, lo, hi):
+    """
+    The promoter region of every gene within its operon, following
+    `promoter_region`: the gap to the nearest divergent gene on the
+    regulator's upstream side (regType 1), or the gap to the regulator's
+    neighbour when that is over 100 bp (regType 2).
+    """
+    n = len(strand)
+    index = np.arange(n)
+    region_start = np.zeros(n, dtype=np.int64)
+    region_stop = np.zeros(n, dtype=np.int64)
+    reg_type = np.zeros(n, dtype=np.int8)
+    if n < 2:
+        return region_start, region_stop, reg_type
+    strand = strand.astype(np.int64)
+
+    # Last minus gene at or before, and first plus gene at or after, each index
+    last_minus = np.maximum.accumulate(np.where(strand == MINUS, index, -1))
+    next_plus = np.minimum.accumulate(np.where(strand == PLUS, index, n)[::-1])[::-1]
+
+    # Plus genes look at the genes before them
+    i = index[1:]
+    divergent = strand[:-1] == MINUS
+    gap = start[1:] - stop[:-1] > INTERGENIC_GAP
+    k = np.concatenate(([-1], last_minus[:-2]))
+    found = k >= lo[1:]
+    adjacent = divergent | gap
+    plus = (strand[1:] == PLUS) & (lo[1:] < i) & (adjacent | found)
+    k = np.maximum(k, 0)
+    region_start[1:] = np.where(plus, np.where(adjacent, stop[:-1], stop[k]), 0)
+    region_stop[1:] = np.where(plus, np.where(adjacent, start[1:], start[k + 1]), 0)
+    reg_type[1:] = np.where(plus, np.where(divergent | ~gap, 1, 2), 0)
+
+    # Minus genes look at the genes after them
+    i = index[:-1]
+    divergent = strand[1:] == PLUS
+    gap = start[1:] - stop[:-1] > INTERGENIC_GAP
+    k = np.concatenate((next_plus[2:], [n]))
+    found = k <= hi[:-1]
+    adjacent = divergent | gap
+    minus = (strand[:-1] == MINUS) & (hi[:-1] > i) & (adjacent | found)
+    k = np.minimum(k, n - 1)
+    region_start[:-1] = np.where(minus, np.where(adjacent, stop[:-1], stop[k - 1]), region_start[:-1])
+    region_stop[:-1] = np.where(minus, np.where(adjacent, start[1:], start[k]), region_stop[:-1])
+    reg_type[:-1] = np.where(minus, np.where(divergent | ~gap, 1, 2), reg_type[:-1])
+    return region_start, region_stop, reg_type
+
+
+def genome_cds_params(genome_id):
+    return {
+        "db": "nuccore",
+        "id": genome_id,
+        "rettype": "fasta_cds_aa",
+        "retmode": "text",
+        "api_key": os.getenv("NcbiApiKey"),
+    }
+
+
+def fetch_genome_operons(genome_id):
+    return run_async(fetch_genome_operons_async, genome_id)
+
+
+async def fetch_genome_operons_async(requester, genome_id):
+    """GenomeOperons for a whole genome, from one fasta_cds_aa eFetch."""
+    response = await requester.request("GET", EFETCH_URL, params=genome_cds_params(genome_id))
+    if not response.is_success:
+        print(f"eFetch failed: {response.status_code} - {response.reason_phrase}")
+        return None
+    return GenomeOperons(list(iter_cds_records(response.iter_lines())))
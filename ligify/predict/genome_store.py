@@ -0,0 +1,141 @@
+import asyncio
+from collections import defaultdict
+
+# How far a follow-up CDS fetch reaches back into an already stored window,
+# so genes straddling the edge of the stored window are returned whole.
+CDS_FLANK_OVERLAP = 5000
+
+# Nucleotide fetches are widened to the surrounding CDS window, but never by
+# more than this on either side.
+NUCLEOTIDE_FLANK = 10000
+
+
+def merge_intervals(intervals, gap=1):
+    """Merge (start, stop) ranges that overlap or are at most `gap` bp apart."""
+    merged = []
+    for start, stop in sorted(intervals):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+class GenomeStore:
+    """
+    Request-scoped store of the genome fragments fetched from nuccore.
+
+    For each genome (accver) it keeps the CDS windows fetched by `getGenes`
+    and the nucleotide windows used by `NC2genome` and `predict_promoter`.
+    Requests that fall inside data already held are answered by slicing it,
+    so enzymes on the same contig, the operon sequence and the promoter all
+    share one CDS and one nucleotide fetch per locus.
+
+    The store does no I/O itself: callers ask what is missing, fetch it, and
+    add it, holding `async_lock(accver)` around the three steps so one locus
+    is never fetched twice. A store belongs to one event loop at a time.
+    """
+
+    def __init__(self):
+        # accver -> list of (start, stop) ranges covered by CDS fetches
+        self.cds_ranges = defaultdict(list)
+        # accver -> {CdsRecord: None}, kept in insertion order
+        self.cds_records = defaultdict(dict)
+        # accver -> list of (start, stop, sequence), 1-based inclusive, with
+        # the sequence held as ASCII bytes so it can be sliced without copies
+        self.nucleotide_windows = defaultdict(list)
+        self.async_locks = defaultdict(asyncio.Lock)
+
+    def async_lock(self, accver) -> asyncio.Lock:
+        return self.async_locks[accver]
+
+    # CDS windows
+
+    def missing_cds(self, accver, start, stop):
+        """Ranges that must be fetched before `cds(accver, start, stop)`."""
+        start = max(start, 1)
+        missing = []
+        cursor = start
+        for covered_start, covered_stop in merge_intervals(self.cds_ranges[accver]):
+            if covered_stop < cursor:
+                continue
+            if covered_start > stop:
+                break
+            if covered_start > cursor:
+                missing.append((cursor, covered_start - 1))
+            cursor = max(cursor, covered_stop + 1)
+        if cursor <= stop:
+            missing.append((cursor, stop))
+
+        # Reach into the neighbouring stored data to pick up boundary genes
+        return [
+            (
+                max(start, a - CDS_FLANK_OVERLAP) if a > start else a,
+                min(stop, b + CDS_FLANK_OVERLAP) if b < stop else b,
+            )
+            for a, b in missing
+        ]
+
+    def add_cds(self, accver, start, stop, records):
+        """Store the CDS records (see accID2operon.CdsRecord) of a range."""
+        # Read a streamed response to the end before marking the range covered
+        records = list(records)
+        self.cds_ranges[accver].append((max(start, 1), stop))
+        for record in records:
+            self.cds_records[accver][record] = None
+
+    def cds(self, accver, start, stop):
+        """Records of the stored CDSs overlapping a range, in genome order."""
+        records = [
+            r for r in self.cds_records[accver] if r.stop >= start and r.start <= stop
+        ]
+        records.sort(key=lambda r: (r.start, r.stop))
+        return records
+
+    def cds_range(self, accver, position):
+        """The merged CDS range containing a position, if any."""
+        for start, stop in merge_intervals(self.cds_ranges[accver]):
+            if start <= position <= stop:
+                return start, stop
+        return None
+
+    # Nucleotide windows
+
+    def missing_nucleotides(self, accver, start, stop):
+        """
+        The window to fetch before `nucleotides(accver, start, stop)`, or None
+        if it is already stored. Widened to the CDS window of the locus so
+        every later slice around the same enzyme is served from it.
+        """
+        if self._nucleotide_window(accver, start, stop) is not None:
+            return None
+        window_start, window_stop = max(start, 1), stop
+        locus = self.cds_range(accver, start) or self.cds_range(accver, stop)
+        if locus is not None:
+            window_start = min(window_start, max(locus[0], start - NUCLEOTIDE_FLANK))
+            window_stop = max(window_stop, min(locus[1], stop + NUCLEOTIDE_FLANK))
+        return window_start, window_stop
+
+    def add_nucleotides(self, accver, start, sequence):
+        if isinstance(sequence, str):
+            sequence = sequence.encode("ascii")
+        self.nucleotide_windows[accver].append((start, start + len(sequence) - 1, sequence))
+
+    def nucleotides(self, accver, start, stop):
+        """Plus-strand sequence from `start` to `stop` inclusive, or None."""
+        view = self.nucleotide_view(accver, start, stop)
+        return None if view is None else str(view, "ascii")
+
+    def nucleotide_view(self, accver, start, stop):
+        """Like `nucleotides`, as a memoryview into the stored window."""
+        window = self._nucleotide_window(accver, start, stop)
+        if window is None:
+            return None
+        window_start, _, sequence = window
+        return memoryview(sequence)[start - window_start : stop - window_start + 1]
+
+    def _nucleotide_window(self, accver, start, stop):
+        for window in self.nucleotide_windows[accver]:
+            if window[0] <= start and stop <= window[1]:
+                return window
+        return None
@@ -0,0 +1,255 @@
+"""
+KEGG as a secondary enzyme source.
+
+Walks KEGG compound -> EC numbers -> genes -> NCBI protein IDs, the route
+TFBMiner uses, and returns reactions in the same structure as
+`chemical2enzymes.fetch_reactions` with their proteins already attached, so
+they can be merged into `reactions["rxn_data"]`. Entries are fetched with
+batched `rest.kegg.jp/get` calls and go through the response cache.
+
+KEGG only classifies organisms into its own categories, so each gene's NCBI
+lineage is read from the UniProt entry its DBLINKS point to. Genes without
+one are left out, as `filter_genes` could not place them.
+"""
+
+import asyncio
+import re
+
+from predict.chemical2enzymes import fetch_entries_async
+from predict.pubchem import PUG_REST_URL
+from utils import run_async
+
+KEGG_URL = "https://rest.kegg.jp"
+# KEGG's get operation accepts at most 10 entries per call
+KEGG_IDS_PER_GET = 10
+
+KEGG_COMPOUND_ID = re.compile(r"^C\d{5}$")
+
+
+def synonyms_url(InChiKey: str):
+    return f"{PUG_REST_URL}/inchikey/{InChiKey}/synonyms/JSON"
+
+
+def parse_compound_ids(response):
+    """KEGG compound IDs (C00511, ...) listed among a PubChem compound's synonyms."""
+    if not response.is_success:
+        return []
+    ids = []
+    for info in response.json().get("InformationList", {}).get("Information", []):
+        ids += [s for s in info.get("Synonym", []) if KEGG_COMPOUND_ID.match(s)]
+    return list(dict.fromkeys(ids))
+
+
+def get_urls(ids):
+    """`get` URLs covering `ids`, at most KEGG_IDS_PER_GET per call."""
+    ids = list(dict.fromkeys(ids))
+    return [
+        f"{KEGG_URL}/get/{'+'.join(ids[start : start + KEGG_IDS_PER_GET])}"
+        for start in range(0, len(ids), KEGG_IDS_PER_GET)
+    ]
+
+
+def parse_flat(text: str):
+    """
+    Parse KEGG flat-file entries in one pass.
+
+    Returns a list of entries, each a dict of section name to the list of its
+    value lines (columns 13 onwards, continuation lines included).
+    """
+    entries = []
+    entry = {}
+    section = None
+    for line in text.splitlines():
+        if line.startswith("///"):
+            if entry:
+                entries.append(entry)
+            entry = {}
+            section = None
+            continue
+        name = line[:12].strip()
+        if name and not line.startswith(" "):
+            section = name
+            entry.setdefault(section, [])
+        if section is not None:
+            entry[section].append(line[12:].strip())
+    if entry:
+        entries.append(entry)
+    return entries
+
+
+def enzyme_ids(compounds):
+    """EC numbers listed in the ENZYME section of compound entries."""
+    return [
+        f"ec:{ec}"
+        for compound in compounds
+        for line in compound.get("ENZYME", [])
+        for ec in line.split()
+    ]
+
+
+def enzyme_genes(enzyme, organisms, limit):
+    """
+    Up to `limit` bacterial gene IDs (eco:b0001) from an enzyme's GENES
+    section, taking the first gene of each organism.
+    """
+    genes = []
+    for line in enzyme.get("GENES", []):
+        code, _, ids = line.partition(":")
+        code = code.strip().lower()
+        if code not in organisms or not ids.split():
+            continue
+        genes.append(f"{code}:{ids.split()[0].split('(')[0]}")
+        if len(genes) >= limit:
+            break
+    return genes
+
+
+def enzyme_reaction(enzyme):
+    ec = enzyme["ENTRY"][0].split()[1] if "ENTRY" in enzyme else ""
+    names = enzyme.get("REACTION") or enzyme.get("NAME") or [""]
+    return {
+        "rhea_id": None,
+        "kegg_id": f"ec:{ec}",
+        "equation": " ".join(names).rstrip(";"),
+    }
+
+
+def parse_organisms(text: str):
+    """KEGG organism codes of bacteria."""
+    organisms = set()
+    for line in text.splitlines():
+        fields = line.split("\t")
+        if len(fields) >= 4 and "Bacteria" in fields[3].split(";"):
+            organisms.add(fields[1])
+    return organisms
+
+
+def gene_links(gene):
+    """Database -> IDs, from a gene entry's DBLINKS section."""
+    links = {}
+    for line in gene.get("DBLINKS", []):
+        database, _, ids = line.partition(":")
+        links[database.strip()] = ids.split()
+    return links
+
+
+def uniprot_accession(gene):
+    return (gene_links(gene).get("UniProt") or [None])[0]
+
+
+def gene_protein(gene, lineages):
+    """
+    A KEGG gene entry as the protein dictionary `fetch_genes` returns, with
+    the lineage of its UniProt entry (`lineages` maps accession -> lineage).
+    """
+    links = gene_links(gene)
+    uniprot_id = (links.get("UniProt") or [None])[0]
+
+    description = None
+    if gene.get("DEFINITION"):
+        description = re.sub(r"^\(\w+\)\s*", "", gene["DEFINITION"][0])
+    elif gene.get("ORTHOLOGY"):
+        description = re.sub(r"^K\d+\s+", "", gene["ORTHOLOGY"][0])
+
+    return {
+        "organism": lineages.get(uniprot_id, []),
+        "enzyme": {
+            "description": description,
+            "uniprot_id": uniprot_id,
+            "dois": [],
+            "ncbi_id": (links.get("NCBI-ProteinID") or [None])[0],
+        },
+    }
+
+
+def gene_id(gene):
+    code = gene.get("ORGANISM", [""])[0].split()[0] if gene.get("ORGANISM") else ""
+    entry = gene.get("ENTRY", [""])[0].split()
+    return f"{code}:{entry[0]}" if code and entry else None
+
+
+def entry_lineages(entries):
+    """accession -> lineage of the bacterial UniProt entries, as parse_protein reads it."""
+    return {
+        accession: entry["organism"]["lineage"]
+        for accession, entry in entries.items()
+        if entry.get("organism", {}).get("lineage", [None])[0] == "Bacteria"
+    }
+
+
+def assemble_reactions(enzymes, genes_by_enzyme, genes, lineages):
+    proteins = {gene_id(g): gene_protein(g, lineages) for g in genes}
+    reactions = []
+    for enzyme in enzymes:
+        rxn = enzyme_reaction(enzyme)
+        rxn["proteins"] = [
+            proteins[g]
+            for g in genes_by_enzyme.get(rxn["kegg_id"], [])
+            if g in proteins
+            and proteins[g]["enzyme"]["ncbi_id"] is not None
+            and proteins[g]["organism"]
+        ]
+        if rxn["proteins"]:
+            reactions.append(rxn)
+    return reactions
+
+
+def fetch_kegg_reactions(InChiKey, max_reactions, proteins_per_reaction):
+    return run_async(fetch_kegg_reactions_async, InChiKey, max_reactions, proteins_per_reaction)
+
+
+async def fetch_kegg_reactions_async(requester, InChiKey, max_reactions, proteins_per_reaction):
+    """KEGG reactions (one per EC number) with their proteins attached."""
+
+    async def get_all(urls):
+        responses = await asyncio.gather(
+            *(requester.request("GET", url) for url in urls)
+        )
+        return "".join(r.text for r in responses if r.is_success)
+
+    compound_ids = parse_compound_ids(
+        await requester.request("GET", synonyms_url(InChiKey))
+    )
+    if not compound_ids:
+        return []
+    compounds = parse_flat(await get_all(get_urls(f"cpd:{i}" for i in compound_ids)))
+    ec_ids = enzyme_ids(compounds)[:max_reactions]
+    if not ec_ids:
+        return []
+
+    organism_text, enzyme_text = await asyncio.gather(
+        get_all([f"{KEGG_URL}/list/organism"]), get_all(get_urls(ec_ids))
+    )
+    organisms = parse_organisms(organism_text)
+    enzymes = parse_flat(enzyme_text)
+    genes_by_enzyme = {
+        enzyme_reaction(e)["kegg_id"]: enzyme_genes(e, organisms, proteins_per_reaction)
+        for e in enzymes
+    }
+    gene_ids = [g for ids in genes_by_enzyme.values() for g in ids]
+    genes = parse_flat(await get_all(get_urls(gene_ids)))
+    entries = await fetch_entries_async(
+        requester, filter(None, (uniprot_accession(g) for g in genes))
+    )
+    return assemble_reactions(enzymes, genes_by_enzyme, genes, entry_lineages(entries))
+
+
+def merge_reactions(reactions, kegg_reactions):
+    """
+    Append KEGG reactions to `reactions["rxn_data"]`, dropping proteins whose
+    NCBI ID a Rhea reaction already brought in.
+    """
+    seen = {
+        protein["enzyme"]["ncbi_id"]
+        for rxn in reactions["rxn_data"]
+        for protein in rxn.get("proteins", [])
+    }
+    for rxn in kegg_reactions:
+        proteins = []
+        for protein in rxn["proteins"]:
+            if protein["enzyme"]["ncbi_id"] not in seen:
+                seen.add(protein["enzyme"]["ncbi_id"])
+                proteins.append(protein)
+        if proteins:
+            reactions["rxn_data"].append(dict(rxn, proteins=proteins))
+    return reactions
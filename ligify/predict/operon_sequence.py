@@ -0,0 +1,65 @@
+from collections.abc import Mapping
+
+
+class OperonSequence(Mapping):
+    """
+    The annotated sequence of an operon (gene, overlap and spacer segments,
+    in order), stored as offsets into one shared nucleotide buffer.
+
+    It reads like the dictionary `annotate_operon` used to build: each
+    segment is decoded to a string only when it is looked up, and
+    `utils.json_default` serializes the whole mapping. Copies and pickles
+    become plain dictionaries.
+    """
+
+    __slots__ = ("buffer", "segments")
+
+    def __init__(self, buffer, segments):
+        # buffer: memoryview of ASCII nucleotides; segments: name -> (start, stop)
+        self.buffer = buffer
+        self.segments = segments
+
+    def __getitem__(self, name):
+        start, stop = self.segments[name]
+        return str(self.buffer[start:stop], "ascii")
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __repr__(self):
+        return f"OperonSequence({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return dict, (self.to_dict(),)
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def reassembles(self):
+        """
+        Whether the segments joined in order give back the whole buffer.
+
+        Contiguous offsets from start to end are enough; otherwise segments
+        are compared in place, without joining them.
+        """
+        position = 0
+        for start, stop in self.segments.values():
+            if stop > start:
+                if start != position:
+                    break
+                position = stop
+        else:
+            return position == len(self.buffer)
+
+        if sum(stop - start for start, stop in self.segments.values()) != len(self.buffer):
+            return False
+        position = 0
+        for start, stop in self.segments.values():
+            length = stop - start
+            if self.buffer[start:stop] != self.buffer[position : position + length]:
+                return False
+            position += length
+        return True
@@ -1,4 +1,4 @@
-import requests
+from utils import make_request, run_async
 
 
 def get_inchikey(input, prop):
@@ -9,7 +9,7 @@ def get_inchikey(input, prop):
             + "/property/InChiKey/TXT"
         )
 
-        response = requests.get(URL)
+        response = make_request("GET", URL)
         if response.ok:
             # get the first entry
             out = response.text.split("\n")[0]
@@ -24,7 +24,7 @@ def get_inchikey(input, prop):
             + "/property/InChiKey/TXT"
         )
 
-        response = requests.get(URL)
+        response = make_request("GET", URL)
         if response.ok:
             # get the first entry
             out = response.text.split("\n")[0]
@@ -39,7 +39,7 @@ def get_smiles(input):
         + str(input)
         + "/property/CanonicalSMILES/TXT"
     )
-    response = requests.get(URL)
+    response = make_request("GET", URL)
     if response.ok:
         # get the first entry
         out = response.text.split("\n")[0]
@@ -54,7 +54,7 @@ def get_name(input, prop):
             + str(input)
             + "/property/IUPACname/TXT"
         )
-        response = requests.get(URL)
+        response = make_request("GET", URL)
         if response.ok:
             # get the first entry
             out = response.text.split("\n")[0]
@@ -68,7 +68,7 @@ def get_name(input, prop):
             + str(input)
             + "/property/IUPACname/TXT"
         )
-        response = requests.get(URL)
+        response = make_request("GET", URL)
         if response.ok:
             # get the first entry
             out = response.text.split("\n")[0]
@@ -77,8 +77,59 @@ def get_name(input, prop):
             raise Exception(f"Unable to get name for {input} of type {prop}")
 
 
+PUG_REST_URL = "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound"
+PROPERTIES = ("IUPACName", "InChIKey", "IsomericSMILES")
+
+
+def properties_request(input, prop, properties=PROPERTIES):
+    """
+    URL and form data resolving one identifier to several properties in a
+    single PUG-REST POST. The identifier goes in the body, so SMILES need no
+    escaping.
+    """
+    url = f"{PUG_REST_URL}/{prop}/property/{','.join(properties)}/JSON"
+    return url, {prop: str(input)}
+
+
+def parse_properties(response):
+    """The first compound's properties, or None if PubChem has no match."""
+    if not response.is_success:
+        return None
+    compounds = response.json()["PropertyTable"]["Properties"]
+    if not compounds:
+        return None
+    compound = compounds[0]
+    # Newer PubChem responses label IsomericSMILES as "SMILES"
+    if "IsomericSMILES" not in compound and "SMILES" in compound:
+        compound["IsomericSMILES"] = compound["SMILES"]
+    return compound
+
+
+def get_properties(input, prop, properties=PROPERTIES):
+    return run_async(get_properties_async, input, prop, properties)
+
+
+async def get_properties_async(requester, input, prop, properties=PROPERTIES):
+    """
+    Resolve an identifier of type `prop` ("smiles", "name", "inchikey", ...)
+    to `properties` with one request, e.g.
+
+        {"CID": 7311, "IUPACName": "...", "InChIKey": "...", "IsomericSMILES": "..."}
+    """
+    url, data = properties_request(input, prop, properties)
+    return parse_properties(await requester.request("POST", url, data=data))
+
+
+def get_chemical(smiles):
+    """Name and InChIKey of a SMILES in one round trip, as lambda_handler needs them."""
+    compound = get_properties(smiles, "smiles", ("IUPACName", "InChIKey"))
+    if compound is None or "InChIKey" not in compound:
+        raise Exception(f"Unable to resolve {smiles} of type smiles")
+    return compound.get("IUPACName", ""), compound["InChIKey"]
+
+
 def check_url(url):
-    response = requests.get(url)
+    response = make_request("GET", url)
     if response.ok:
         return True
     else:
@@ -0,0 +1,208 @@
+"""
+Local Rhea index: InChIKey -> reactions, equations and reaction -> UniProt.
+
+An alternative to querying rhea-db.org (and UniProt's Rhea search) for every
+ligand. Built from the Rhea dumps, from the `ligify` directory:
+
+    python -m predict.rhea_index data/rhea.sqlite \
+        --reactions rhea-reactions.tsv \
+        --sprot https://ftp.expasy.org/databases/rhea/tsv/rhea2uniprot_sprot.tsv \
+        --trembl https://ftp.expasy.org/databases/rhea/tsv/rhea2uniprot_trembl.tsv.gz
+
+`--reactions` is a Rhea search export with the "rhea-id", "equation" and
+"chebi-id" columns (an "inchikey" column is used directly if present).
+ChEBI IDs are mapped to InChIKeys through the ChEBI index (see
+predict/chebi_index.py), so build that first. Select the index with
+LIGIFY_REACTION_BACKEND=local.
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import os
+import re
+import sqlite3
+import threading
+import urllib.request
+
+from predict.chebi_index import CHEBI_INDEX_PATH, ChebiIndex
+
+RHEA_INDEX_PATH = os.getenv(
+    "LIGIFY_RHEA_INDEX",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "rhea.sqlite"),
+)
+
+SCHEMA = """
+CREATE TABLE reaction (rhea_id INTEGER PRIMARY KEY, equation TEXT);
+CREATE TABLE compound (inchikey TEXT, rhea_id INTEGER);
+CREATE TABLE uniprot (
+    rhea_id INTEGER, reviewed INTEGER, accession TEXT,
+    PRIMARY KEY (rhea_id, reviewed, accession)
+) WITHOUT ROWID;
+"""
+
+INDEXES = """
+CREATE INDEX compound_inchikey ON compound (inchikey, rhea_id);
+"""
+
+
+def rhea_number(rhea_id) -> int:
+    return int(re.sub(r"\D", "", str(rhea_id)))
+
+
+class RheaIndex:
+    """Read-only view of the index, one connection per thread."""
+
+    def __init__(self, path=RHEA_INDEX_PATH):
+        self.path = path
+        self.local = threading.local()
+        if not os.path.exists(path):
+            raise Exception(f"Rhea index not found at {path}")
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True)
+            conn.execute("PRAGMA mmap_size = 268435456")
+            self.local.conn = conn
+        return conn
+
+    def reactions(self, InChiKey: str, max_reactions: int):
+        """Same structure as `chemical2enzymes.fetch_reactions`."""
+        rows = self._connection().execute(
+            "SELECT r.rhea_id, r.equation FROM compound c"
+            " JOIN reaction r ON r.rhea_id = c.rhea_id"
+            " WHERE c.inchikey = ? GROUP BY r.rhea_id ORDER BY r.rhea_id LIMIT ?",
+            (str(InChiKey), max_reactions),
+        ).fetchall()
+        return {
+            "rxn_data": [
+                {"rhea_id": f"RHEA:{rhea_id}", "equation": equation}
+                for rhea_id, equation in rows
+            ]
+        }
+
+    def accessions(self, rhea_id, reviewed_bool, limit):
+        """Up to `limit` UniProt accessions annotated with a reaction."""
+        rows = self._connection().execute(
+            "SELECT accession FROM uniprot WHERE rhea_id = ? AND reviewed = ?"
+            " ORDER BY accession LIMIT ?",
+            (rhea_number(rhea_id), int(bool(reviewed_bool)), limit),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+
+_rhea_index = None
+_rhea_index_lock = threading.Lock()
+
+
+def get_rhea_index() -> RheaIndex:
+    global _rhea_index
+    if _rhea_index is None:
+        with _rhea_index_lock:
+            if _rhea_index is None:
+                _rhea_index = RheaIndex()
+    return _rhea_index
+
+
+def open_tsv(source):
+    """Rows of a local or remote, optionally gzipped, TSV file as dicts."""
+    if source.startswith(("http://", "https://", "ftp://")):
+        raw = urllib.request.urlopen(source)
+    else:
+        raw = open(source, "rb")
+    if source.endswith(".gz"):
+        raw = gzip.GzipFile(fileobj=raw)
+    lines = io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+    reader = csv.reader(lines, delimiter="\t")
+    header = [h.strip().lower() for h in next(reader)]
+    return lines, (dict(zip(header, row)) for row in reader)
+
+
+def column(row, *names):
+    """The first matching column of a row, by exact or partial header name."""
+    for name in names:
+        if name in row:
+            return row[name]
+    for name in names:
+        for key, value in row.items():
+            if name in key:
+                return value
+    return None
+
+
+def ingest_reactions(conn, source, chebi):
+    lines, rows = open_tsv(source)
+    with lines:
+        for row in rows:
+            rhea_id = column(row, "reaction identifier", "rhea-id", "rhea")
+            if not rhea_id:
+                continue
+            rhea_id = rhea_number(rhea_id)
+            conn.execute(
+                "INSERT OR REPLACE INTO reaction VALUES (?, ?)",
+                (rhea_id, column(row, "equation")),
+            )
+
+            inchikeys = set(filter(None, (column(row, "inchikey") or "").split(";")))
+            for chebi_id in (column(row, "chebi identifier", "chebi-id", "chebi") or "").split(";"):
+                entry = chebi.get(chebi_id.strip())
+                if entry is not None and entry["inchikey"]:
+                    inchikeys.add(entry["inchikey"])
+            conn.executemany(
+                "INSERT INTO compound VALUES (?, ?)",
+                ((inchikey.strip(), rhea_id) for inchikey in inchikeys),
+            )
+
+
+def ingest_uniprot(conn, source, reviewed):
+    # rhea2uniprot columns: RHEA_ID, DIRECTION, MASTER_ID, ID. Each
+    # direction of a reaction is listed, so keep one row per protein.
+    lines, rows = open_tsv(source)
+    with lines:
+        conn.executemany(
+            "INSERT OR IGNORE INTO uniprot VALUES (?, ?, ?)",
+            (
+                (int(row["master_id"]), int(reviewed), row["id"])
+                for row in rows
+                if row.get("master_id") and row.get("id")
+            ),
+        )
+
+
+def build_index(path, reactions, sprot=None, trembl=None, chebi_path=CHEBI_INDEX_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    conn = sqlite3.connect(tmp)
+    conn.executescript(SCHEMA)
+    ingest_reactions(conn, reactions, ChebiIndex(chebi_path))
+    if sprot:
+        ingest_uniprot(conn, sprot, reviewed=True)
+    if trembl:
+        ingest_uniprot(conn, trembl, reviewed=False)
+    conn.executescript(INDEXES)
+    conn.commit()
+    counts = {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("reaction", "compound", "uniprot")
+    }
+    conn.execute("VACUUM")
+    conn.close()
+    os.replace(tmp, path)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local Rhea index")
+    parser.add_argument("output")
+    parser.add_argument("--reactions", required=True, help="Rhea export with rhea-id, equation and chebi-id columns")
+    parser.add_argument("--sprot", help="rhea2uniprot_sprot.tsv (reviewed proteins)")
+    parser.add_argument("--trembl", help="rhea2uniprot_trembl.tsv.gz (unreviewed proteins)")
+    parser.add_argument("--chebi-index", default=CHEBI_INDEX_PATH)
+    args = parser.parse_args()
+
+    print(build_index(args.output, args.reactions, args.sprot, args.trembl, args.chebi_index))
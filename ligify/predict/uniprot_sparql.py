@@ -0,0 +1,143 @@
+"""
+UniProt SPARQL backend for `chemical2enzymes.fetch_genes`.
+
+Fetches the bacterial UniProt entries of many Rhea reactions in one query,
+with lineage, RefSeq/EMBL protein IDs and DOIs, and rebuilds each one in the
+shape of a UniProt REST entry so `parse_protein` turns it into the same
+protein dictionary as the REST search. Select it with
+LIGIFY_GENE_BACKEND=sparql.
+"""
+
+import re
+
+SPARQL_URL = "https://sparql.uniprot.org/sparql"
+SPARQL_HEADERS = {"Accept": "application/sparql-results+json"}
+
+# Ranks kept in the lineage, in the order the REST API lists them. The top
+# rank is called Superkingdom in older taxonomy releases and Domain in newer.
+# REST lineages also list unranked clades (such as "Terrabacteria group")
+# where the taxonomy has them. Those can't be placed from ranks, so for such
+# organisms the positions `filter_genes` reads differ between the backends.
+TOP_RANKS = ["Superkingdom", "Domain"]
+LINEAGE_RANKS = ["Kingdom", "Phylum", "Class", "Order", "Family", "Genus"]
+
+PREFIXES = """PREFIX up: <http://purl.uniprot.org/core/>
+PREFIX rh: <http://rdf.rhea-db.org/>
+PREFIX taxon: <http://purl.uniprot.org/taxonomy/>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+"""
+
+# One sub-select per reaction so each is capped at proteins_per_reaction
+PROTEINS_QUERY = """{{
+    SELECT ?rhea ?protein WHERE {{
+      VALUES ?rhea {{ rh:{rhea} }}
+      ?protein up:reviewed {reviewed} ;
+               up:annotation/up:catalyticActivity/up:catalyzedReaction ?rhea ;
+               up:organism/rdfs:subClassOf taxon:2 .
+    }}
+    ORDER BY ?protein
+    LIMIT {limit}
+  }}"""
+
+DETAILS_QUERY = """SELECT ?rhea ?protein ?fullName
+  (GROUP_CONCAT(DISTINCT CONCAT(STRAFTER(STR(?rank), STR(up:)), "=", ?taxonName); separator="|") AS ?lineage)
+  (GROUP_CONCAT(DISTINCT STR(?xref); separator="|") AS ?xrefs)
+  (GROUP_CONCAT(DISTINCT STR(?doi); separator="|") AS ?dois)
+WHERE {{
+  {proteins}
+  ?protein up:organism ?organism .
+  OPTIONAL {{
+    ?organism rdfs:subClassOf ?ancestor .
+    ?ancestor up:rank ?rank ; up:scientificName ?taxonName .
+  }}
+  OPTIONAL {{ ?protein up:recommendedName/up:fullName ?fullName . }}
+  OPTIONAL {{
+    ?protein rdfs:seeAlso ?xref .
+    ?xref up:database ?db .
+    VALUES ?db {{ <http://purl.uniprot.org/database/RefSeq> <http://purl.uniprot.org/database/EMBL> }}
+  }}
+  OPTIONAL {{
+    ?protein up:citation/skos:exactMatch ?doi .
+    FILTER(STRSTARTS(STR(?doi), "http://dx.doi.org/"))
+  }}
+}}
+GROUP BY ?rhea ?protein ?fullName"""
+
+
+def rhea_number(rhea_id) -> int:
+    return int(re.sub(r"\D", "", str(rhea_id)))
+
+
+def proteins_query(rhea_ids, reviewed_bool, proteins_per_reaction) -> str:
+    proteins = "\n  UNION\n  ".join(
+        PROTEINS_QUERY.format(
+            rhea=rhea_number(rhea_id),
+            reviewed=str(bool(reviewed_bool)).lower(),
+            limit=int(proteins_per_reaction),
+        )
+        for rhea_id in dict.fromkeys(rhea_ids)
+    )
+    return PREFIXES + DETAILS_QUERY.format(proteins=proteins)
+
+
+def _local_name(iri: str) -> str:
+    return iri.rstrip("/").rsplit("/", 1)[-1]
+
+
+def binding_entry(binding):
+    """A SPARQL result row as the parts of a UniProt REST entry parse_protein reads."""
+    value = lambda name: binding[name]["value"] if name in binding else ""
+
+    ranks = dict(
+        item.split("=", 1) for item in value("lineage").split("|") if "=" in item
+    )
+    lineage = [ranks[rank] for rank in TOP_RANKS if rank in ranks][:1]
+    lineage += [ranks[rank] for rank in LINEAGE_RANKS if rank in ranks]
+
+    cross_references = []
+    for xref in filter(None, value("xrefs").split("|")):
+        if "/refseq/" in xref:
+            cross_references.append({"database": "RefSeq", "id": _local_name(xref)})
+        else:
+            cross_references.append({
+                "database": "EMBL",
+                "properties": [{"key": "ProteinId", "value": _local_name(xref)}],
+            })
+    # parse_protein takes the first RefSeq, as ordered on the REST entry
+    cross_references.sort(key=lambda x: (x["database"], x.get("id", "")))
+
+    entry = {
+        "primaryAccession": _local_name(value("protein")),
+        "organism": {"lineage": lineage},
+        "references": [
+            {"citation": {"citationCrossReferences": [
+                {"database": "DOI", "id": doi.removeprefix("http://dx.doi.org/")}
+            ]}}
+            for doi in sorted(filter(None, value("dois").split("|")))
+        ],
+        "uniProtKBCrossReferences": cross_references,
+    }
+    if value("fullName"):
+        entry["proteinDescription"] = {
+            "recommendedName": {"fullName": {"value": value("fullName")}}
+        }
+    return rhea_number(_local_name(value("rhea"))), entry
+
+
+def parse_bindings(data, rhea_ids, parse_protein):
+    """rhea_id -> protein list, from a SPARQL JSON result."""
+    by_number = {}
+    for binding in data["results"]["bindings"]:
+        number, entry = binding_entry(binding)
+        by_number.setdefault(number, []).append(entry)
+
+    result = {}
+    for rhea_id in rhea_ids:
+        entries = sorted(
+            by_number.get(rhea_number(rhea_id), []),
+            key=lambda e: e["primaryAccession"],
+        )
+        proteins = [parse_protein(e) for e in entries if e["organism"]["lineage"]]
+        result[rhea_id] = [p for p in proteins if p is not None]
+    return result
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from utils import DAY, BoundedCache, json_default
+
+# Where finished /ligify responses are kept: "memory", "file", "dynamodb" or "none"
+RESULT_CACHE_BACKEND = os.getenv("LIGIFY_RESULT_CACHE", "memory")
+RESULT_CACHE_BYTES = int(os.getenv("LIGIFY_RESULT_CACHE_BYTES", 64 * 1024 * 1024))
+RESULT_CACHE_DIR = os.getenv("LIGIFY_RESULT_CACHE_DIR", "/tmp/ligify-results")
+# Set when RESULT_CACHE_DIR is a volume every instance mounts (such as EFS)
+RESULT_CACHE_SHARED = os.getenv("LIGIFY_RESULT_CACHE_SHARED", "0") == "1"
+RESULT_CACHE_TABLE = os.getenv("LIGIFY_RESULT_CACHE_TABLE", "LigifyResults")
+# Seconds a result stays fresh, so it picks up changes to the upstream
+# databases; the shortest response cache TTL. 0 keeps results forever.
+RESULT_CACHE_TTL = float(os.getenv("LIGIFY_RESULT_CACHE_TTL", 7 * DAY)) or None
+
+# Same limit local-main.store_in_dynamodb uses, well under the 400 KB item cap
+MAX_CHUNK_SIZE = 350000
+
+
+def result_key(InChiKey: str, filters: dict, plasmids: str = "inline") -> str:
+    """
+    Cache key for one pipeline run: the InChIKey plus a digest of the
+    validated filters, serialized with sorted keys so equivalent payloads
+    share an entry. Responses with deferred plasmids are kept apart.
+    """
+    canonical = json.dumps(filters, sort_keys=True, separators=(",", ":"))
+    digest = hashlib.sha256(canonical.encode()).hexdigest()[:16]
+    key = f"{InChiKey}#{digest}"
+    return key if plasmids == "inline" else f"{key}#{plasmids}"
+
+
+class MemoryBackend:
+    # Only this process sees the entries
+    shared = False
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, ttl=RESULT_CACHE_TTL):
+        # Entries are (expiry, value, size of its JSON)
+        self.cache = BoundedCache(max_bytes, sizeof=lambda entry: entry[2])
+        self.ttl = ttl
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+            return None
+        return entry[1]
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        # Keep a plain-JSON copy, so the cache holds exactly what it measures
+        # and not, say, OperonSequences with views into whole genome windows
+        text = json.dumps(value, default=json_default)
+        self.cache.set(key, (expires, json.loads(text), len(text)))
+
+
+class FileBackend:
+    """
+    One JSON file per result, for /tmp or a mounted volume. Files older than
+    `ttl` seconds are stale. `shared` tells whether every instance reads the
+    same directory.
+    """
+
+    def __init__(self, directory=RESULT_CACHE_DIR, ttl=RESULT_CACHE_TTL, shared=RESULT_CACHE_SHARED):
+        self.directory = directory
+        self.ttl = ttl
+        self.shared = shared
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(
+            self.directory, hashlib.sha256(key.encode()).hexdigest() + ".json"
+        )
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        # Write then rename so readers never see a partial file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(value, f, default=json_default)
+        os.replace(tmp, path)
+
+
+class DynamoDBBackend:
+    """
+    Stores results in the chunked layout of local-main.store_in_dynamodb:
+    a hash key plus a numeric `chunk_index` range key. Small results are a
+    single item holding the data; larger ones are split into string chunks
+    of the serialized JSON.
+
+    Every chunk also records `chunk_count`, so chunks left over from a longer
+    earlier result are never joined in, and `expires_at`, the epoch second
+    after which the result is stale. Enable DynamoDB TTL on `expires_at` to
+    have the table drop expired results.
+    """
+
+    shared = True
+
+    def __init__(self, table, key_attribute="ResultKey", ttl=RESULT_CACHE_TTL):
+        self.table = table
+        self.key_attribute = key_attribute
+        self.ttl = ttl
+
+    def _items(self, key, **kwargs):
+        from boto3.dynamodb.conditions import Key
+
+        items = []
+        kwargs["KeyConditionExpression"] = Key(self.key_attribute).eq(key)
+        while True:
+            page = self.table.query(**kwargs)
+            items += page["Items"]
+            if "LastEvaluatedKey" not in page:
+                break
+            kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+        return items
+
+    def get(self, key):
+        items = self._items(key)
+        if not items:
+            return None
+        items.sort(key=lambda item: int(item["chunk_index"]))
+        if "expires_at" in items[0] and items[0]["expires_at"] < time.time():
+            return None
+        # Items written by store_in_dynamodb have no chunk_count
+        count = int(items[0].get("chunk_count", len(items)))
+        items = items[:count]
+        if [int(item["chunk_index"]) for item in items] != list(range(count)):
+            # A result being rewritten
+            return None
+        if len(items) == 1 and not isinstance(items[0]["data"], str):
+            # DynamoDB hands numbers back as Decimal
+            return json.loads(json.dumps(items[0]["data"], default=_decimal))
+        return json.loads("".join(item["data"] for item in items))
+
+    def set(self, key, value):
+        data_str = json.dumps(value, default=json_default)
+        chunks = [
+            data_str[start : start + MAX_CHUNK_SIZE]
+            for start in range(0, len(data_str), MAX_CHUNK_SIZE)
+        ]
+        existing = self._items(key, ProjectionExpression="chunk_index")
+        expires = int(time.time() + self.ttl) if self.ttl else None
+        with self.table.batch_writer() as batch:
+            for i, chunk in enumerate(chunks):
+                item = {
+                    self.key_attribute: key,
+                    "chunk_index": i,
+                    "chunk_count": len(chunks),
+                    "data": chunk,
+                }
+                if expires is not None:
+                    item["expires_at"] = expires
+                batch.put_item(Item=item)
+            # Chunks of a longer earlier result
+            for item in existing:
+                if int(item["chunk_index"]) >= len(chunks):
+                    batch.delete_item(
+                        Key={self.key_attribute: key, "chunk_index": item["chunk_index"]}
+                    )
+
+
+def _decimal(value):
+    return int(value) if value == int(value) else float(value)
+
+
+class ResultCache:
+    """
+    Result cache with single-flight de-duplication.
+
+    Concurrent calls for the same key share one computation: the first
+    caller computes, the others wait for its result. Failures are passed to
+    every waiter and are not cached.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        try:
+            cached = self.backend.get(key)
+        except Exception as e:
+            print(f"Result cache read failed: {e}")
+            cached = None
+        if cached is not None:
+            return cached
+
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = compute()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            try:
+                self.backend.set(key, result)
+            except Exception as e:
+                print(f"Result cache write failed: {e}")
+            return result
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the process-wide result cache, or None if it is disabled."""
+    global _result_cache
+    if RESULT_CACHE_BACKEND == "none":
+        return None
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                if RESULT_CACHE_BACKEND == "file":
+                    backend = FileBackend()
+                elif RESULT_CACHE_BACKEND == "dynamodb":
+                    # Only needed for this backend
+                    import boto3
+
+                    backend = DynamoDBBackend(
+                        boto3.resource("dynamodb").Table(RESULT_CACHE_TABLE)
+                    )
+                else:
+                    backend = MemoryBackend()
+                _result_cache = ResultCache(backend)
+    return _result_cache
@@ -0,0 +1,99 @@
+"""
+Local HTTP server for the streaming /ligify mode.
+
+The Python Lambda runtime cannot stream a response body, so this serves
+`main.stream_ligify` over chunked transfer encoding for development:
+
+    python stream_server.py --port 3002
+
+    curl -N -X POST localhost:3002/ligify/stream -d @payload.json
+
+It answers with one JSON object per line (application/x-ndjson): a
+"regulator" record for each regulator as soon as it is ready, then a final
+"metrics" record. Deferred plasmids are served from /ligify/plasmid?id=...
+as with the Lambda handler. The same server can back a streaming Lambda
+function URL behind the Lambda Web Adapter.
+"""
+
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from dotenv import load_dotenv
+
+from main import generate_response, get_plasmid, load_input, stream_ligify
+
+
+class LigifyStreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_OPTIONS(self):
+        self.send_headers(200, content_length=0)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not url.path.rstrip("/").endswith("/ligify/plasmid"):
+            return self.send_json(403, "Forbidden")
+        self.send_json(*get_plasmid(parse_qs(url.query).get("id", [None])[0]))
+
+    def do_POST(self):
+        if "/ligify" not in self.path:
+            return self.send_json(403, "Forbidden")
+
+        length = int(self.headers.get("Content-Length", 0))
+        raw_body = self.rfile.read(length).decode() if length else "{}"
+
+        if urlsplit(self.path).path.rstrip("/").endswith("/ligify/plasmid"):
+            try:
+                plasmid_id = json.loads(raw_body).get("plasmid_id")
+            except (ValueError, AttributeError):
+                plasmid_id = None
+            return self.send_json(*get_plasmid(plasmid_id))
+
+        validated_input, error = load_input(raw_body)
+        if error is not None:
+            return self.send_json(*error)
+
+        self.send_headers(200, content_type="application/x-ndjson", chunked=True)
+        try:
+            for line in stream_ligify(validated_input):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away; closing the generator stops the pipeline
+            self.close_connection = True
+
+    def send_json(self, status_code, body):
+        response = generate_response(status_code, body, origin=self.headers.get("Origin"))
+        payload = response["body"].encode()
+        self.send_headers(status_code, content_length=len(payload))
+        self.wfile.write(payload)
+
+    def send_headers(
+        self, status_code, content_type="application/json", content_length=None, chunked=False
+    ):
+        self.send_response(status_code)
+        cors = generate_response(status_code, "", origin=self.headers.get("Origin"))
+        for name, value in cors["headers"].items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.send_header("Cache-Control", "no-cache")
+        else:
+            self.send_header("Content-Length", str(content_length))
+        self.end_headers()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve /ligify as NDJSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3002)
+    args = parser.parse_args()
+
+    load_dotenv()
+    server = ThreadingHTTPServer((args.host, args.port), LigifyStreamHandler)
+    print(f"Streaming /ligify on http://{args.host}:{args.port}")
+    server.serve_forever()
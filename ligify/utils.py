@@ -1,7 +1,21 @@
-from collections import defaultdict, deque
+import asyncio
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import Mapping
+from email.utils import parsedate_to_datetime
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import ssl
 import threading
 import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import certifi
+import httpx
 import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import parse_header_links
 
 class APITracker:
     def __init__(self):
@@ -40,14 +54,593 @@ session.headers.update({
     # Include any other headers you may need globally
 })
 
-# Desired rate limit: 9 requests/second means ~0.111s between requests.
-# We'll pick 0.12s to be safe. Adjust if needed.
-RATE_LIMIT_INTERVAL = 0.12
+# NCBI E-utilities allow 10 requests/second with an API key and 3 without.
+# https://support.nlm.nih.gov/knowledgebase/article/KA-05318/en-us
+NCBI_RATE_WITH_KEY = 10
+NCBI_RATE_WITHOUT_KEY = 3
+NCBI_HOSTS = ("eutils.ncbi.nlm.nih.gov",)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second up to `capacity`, so
+    callers can burst up to `capacity` requests before being throttled to
+    the sustained rate. The default capacity of 1 never lets more than
+    `rate` requests through in any one-second window, which is how NCBI
+    counts. Every thread that shares the bucket shares the budget.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def _take(self) -> float:
+        # Consume a token and return 0, or return how long to wait for one
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Like `acquire`, but yields to the event loop while waiting."""
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+_ncbi_limiter = None
+_ncbi_limiter_lock = threading.Lock()
+
+
+def get_ncbi_limiter() -> TokenBucket:
+    """
+    Return the process-wide NCBI limiter.
+
+    It is created on first use rather than at import so that `NcbiApiKey`
+    loaded by `load_dotenv()` in the handler is taken into account.
+    """
+    global _ncbi_limiter
+    if _ncbi_limiter is None:
+        with _ncbi_limiter_lock:
+            if _ncbi_limiter is None:
+                rate = (
+                    NCBI_RATE_WITH_KEY
+                    if os.getenv("NcbiApiKey")
+                    else NCBI_RATE_WITHOUT_KEY
+                )
+                _ncbi_limiter = TokenBucket(rate)
+    return _ncbi_limiter
+
+
+def is_ncbi_url(url: str) -> bool:
+    return urlsplit(url).hostname in NCBI_HOSTS
+
+
+# Other hosts with a published rate limit, in requests per second.
+# PubChem allows 5 requests/second:
+# https://pubchem.ncbi.nlm.nih.gov/docs/programmatic-access#section=Request-Volume-Limitations
+HOST_RATES = {
+    "pubchem.ncbi.nlm.nih.gov": 5,
+}
+
+_host_limiters = {}
+_host_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(url: str):
+    """The process-wide token bucket for a URL's host, or None if it has no limit."""
+    if is_ncbi_url(url):
+        return get_ncbi_limiter()
+    host = urlsplit(url).hostname
+    if host not in HOST_RATES:
+        return None
+    with _host_limiters_lock:
+        if host not in _host_limiters:
+            _host_limiters[host] = TokenBucket(HOST_RATES[host])
+        return _host_limiters[host]
+
+
+# Responses that mean "slow down": retried with exponential backoff, or after
+# the delay the server asks for in Retry-After.
+RETRY_STATUSES = (429, 503)
+MAX_RETRIES = int(os.getenv("LIGIFY_MAX_RETRIES", 4))
+RETRY_BACKOFF = 0.5
+MAX_RETRY_DELAY = 60
+
+
+def retry_delay(response, attempt: int) -> float:
+    """Seconds to wait before retry number `attempt` (from 0) of a throttled request."""
+    value = response.headers.get("retry-after")
+    if value:
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0), MAX_RETRY_DELAY)
+    return min(RETRY_BACKOFF * 2**attempt, MAX_RETRY_DELAY)
+
+
+def json_default(value):
+    """
+    `default` hook for json.dumps. Mappings that build their values lazily,
+    such as the OperonSequence in each operon's "operon_seq", serialize as
+    plain objects.
+    """
+    if isinstance(value, Mapping):
+        return dict(value.items())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def approx_size(value) -> int:
+    """Rough number of bytes a cached value holds."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return len(json.dumps(value, default=json_default))
+
+
+_MISSING = object()
+
+
+class BoundedCache:
+    """
+    Thread-safe in-memory LRU cache bounded by the total size of its values.
+
+    Sizes are estimated with `sizeof` when a value is stored. Counts hits,
+    misses and evictions so long batch runs can check how well it works.
+    """
+
+    def __init__(self, max_bytes: int, sizeof=approx_size):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def bounded_cache(max_bytes: int, sizeof=approx_size):
+    """
+    Memoize a function of hashable positional arguments in a `BoundedCache`.
+
+    Exceptions are not cached. The cache is exposed as `func.cache`.
+    """
+
+    def decorator(func):
+        cache = BoundedCache(max_bytes, sizeof)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            value = cache.get(args, _MISSING)
+            if value is _MISSING:
+                value = func(*args)
+                cache.set(args, value)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+# Persistent response cache. Lives in /tmp by default so it survives warm
+# Lambda invocations; point LIGIFY_CACHE_DIR at a mounted volume to keep it
+# across cold starts. Set LIGIFY_CACHE=0 to disable.
+CACHE_DIR = os.getenv("LIGIFY_CACHE_DIR", "/tmp/ligify-cache")
+CACHE_MAX_BYTES = int(os.getenv("LIGIFY_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+DAY = 24 * 60 * 60
+# How long a response stays fresh, per host. Hosts not listed are never cached.
+CACHE_TTL = {
+    "pubchem.ncbi.nlm.nih.gov": 30 * DAY,
+    "www.rhea-db.org": 7 * DAY,
+    "rest.uniprot.org": 7 * DAY,
+    "sparql.uniprot.org": 7 * DAY,
+    "eutils.ncbi.nlm.nih.gov": 30 * DAY,
+    "rest.kegg.jp": 30 * DAY,
+}
+
+# Query parameters that do not change the response
+IGNORED_PARAMS = {"api_key"}
+
+
+def normalize_url(url: str, params=None) -> str:
+    """
+    Canonical form of a request URL: lower-case scheme and host, `params`
+    merged into the query string, query pairs sorted and `api_key` removed.
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        items = params.items() if isinstance(params, dict) else params
+        query += [(k, str(v)) for k, v in items if v is not None]
+    query = sorted((k, v) for k, v in query if k not in IGNORED_PARAMS)
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            parts.path,
+            urlencode(query),
+            "",
+        )
+    )
+
+
+class SQLiteStore:
+    """
+    Key/value store in a SQLite file with per-entry TTL and LRU eviction.
+
+    Entries are evicted least-recently-used first once the stored values
+    exceed `max_bytes` in total. Safe to share between threads.
+    """
+
+    def __init__(self, path: str, max_bytes: int, table: str = "entries"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.table = table
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires REAL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)"
+        )
+        self.total_bytes = self.conn.execute(
+            f"SELECT COALESCE(SUM(size), 0) FROM {table}"
+        ).fetchone()[0]
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT value, size, expires FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, size, expires = row
+            if expires is not None and expires < now:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.total_bytes -= size
+                return None
+            self.conn.execute(
+                f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key)
+            )
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        with self.lock:
+            old = self.conn.execute(
+                f"SELECT size FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, expires, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, expires, now),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                f"SELECT key, size FROM {self.table} ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for key, size in rows:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    return
+
+
+class CachedResponse:
+    """
+    A stored 200 response, exposing the parts of the `requests` and `httpx`
+    response APIs that the pipeline reads.
+    """
+
+    status_code = 200
+    ok = True
+    is_success = True
+    reason = "OK"
+    reason_phrase = "OK"
+
+    def __init__(self, url, headers, content: bytes):
+        self.url = url
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    @property
+    def links(self):
+        links = {}
+        for link in parse_header_links(self.headers.get("link", "")):
+            links[link.get("rel") or link.get("url")] = link
+        return links
+
+    def iter_lines(self, decode_unicode=False):
+        for line in self.content.splitlines():
+            yield line.decode("utf-8", errors="replace") if decode_unicode else line
+
+    def raise_for_status(self):
+        pass
+
+
+# Response headers worth keeping; `link` carries UniProt's pagination cursor.
+CACHED_HEADERS = ("content-type", "link")
+
+
+class ResponseCache:
+    """
+    Persistent cache of successful API responses, keyed by a SHA-256 of the
+    method, normalized URL and request body.
+    """
+
+    def __init__(self, store: SQLiteStore, ttl=None):
+        self.store = store
+        self.ttl = ttl if ttl is not None else CACHE_TTL
+
+    def key(self, method, url, params=None, data=None):
+        body = data if isinstance(data, bytes) else str(data or "").encode()
+        digest = hashlib.sha256()
+        digest.update(method.upper().encode() + b" " + normalize_url(url, params).encode())
+        digest.update(b"\n" + body)
+        return digest.hexdigest()
+
+    def cacheable(self, method, url):
+        return method.upper() in ("GET", "POST") and urlsplit(url).hostname in self.ttl
+
+    def get(self, key):
+        value = self.store.get(key)
+        if value is None:
+            return None
+        meta, _, content = value.partition(b"\n")
+        meta = json.loads(meta)
+        return CachedResponse(meta["url"], meta["headers"], content)
+
+    def set(self, key, url, response):
+        headers = {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+        meta = json.dumps({"url": str(response.url), "headers": headers}).encode()
+        self.store.set(
+            key, meta + b"\n" + response.content, self.ttl[urlsplit(url).hostname]
+        )
+
+
+_response_cache = None
+_response_cache_pid = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the process-wide response cache, or None if it is disabled.
+    Opened once per process, so a forked child never shares the parent's
+    SQLite connection.
+    """
+    global _response_cache, _response_cache_pid
+    if os.getenv("LIGIFY_CACHE", "1") == "0" or not CACHE_DIR:
+        return None
+    if _response_cache is None or _response_cache_pid != os.getpid():
+        with _response_cache_lock:
+            if _response_cache is None or _response_cache_pid != os.getpid():
+                try:
+                    store = SQLiteStore(
+                        os.path.join(CACHE_DIR, "responses.sqlite"), CACHE_MAX_BYTES
+                    )
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Response cache unavailable: {e}")
+                    return None
+                _response_cache = ResponseCache(store)
+                _response_cache_pid = os.getpid()
+    return _response_cache
+
 
 def make_request(method, url, **kwargs):
-    # Perform the request using the persistent session
-    resp = session.request(method, url, **kwargs)
+    # Streamed responses bypass the cache, which would read them whole
+    cache = None if kwargs.get("stream") else get_response_cache()
+    key = None
+    if cache is not None and cache.cacheable(method, url):
+        key = cache.key(method, url, kwargs.get("params"), kwargs.get("data"))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    for attempt in range(MAX_RETRIES + 1):
+        # Rate-limited hosts share one token bucket across every thread in the process
+        limiter = get_rate_limiter(url)
+        if limiter is not None:
+            limiter.acquire()
+
+        # Perform the request using the persistent session
+        resp = session.request(method, url, **kwargs)
+        if resp.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            break
+        resp.close()
+        time.sleep(retry_delay(resp, attempt))
+
+    if key is not None and resp.status_code == 200:
+        cache.set(key, url, resp)
+
+    return resp
+
+
+# Maximum number of in-flight requests per host for the async pipeline.
+HOST_CONCURRENCY = {
+    "eutils.ncbi.nlm.nih.gov": 10,
+    "rest.uniprot.org": 8,
+    "sparql.uniprot.org": 2,
+    "www.rhea-db.org": 4,
+    "pubchem.ncbi.nlm.nih.gov": 5,
+    "rest.kegg.jp": 3,
+}
+DEFAULT_HOST_CONCURRENCY = 4
+
+
+@functools.lru_cache(maxsize=None)
+def ssl_context():
+    """
+    One SSL context for every AsyncRequester. Loading the CA bundle is most of
+    the cost of creating a client, and sync wrappers create one per call.
+    """
+    return ssl.create_default_context(cafile=certifi.where())
+
+
+class AsyncRequester:
+    """
+    Async counterpart of `make_request`.
+
+    Wraps one `httpx.AsyncClient` and caps the number of concurrent requests
+    per host. NCBI and PubChem calls also draw from the same token buckets as
+    the synchronous code, so threads and coroutines never exceed the limit
+    together. Use as an async context manager so the client is closed.
+    """
+
+    def __init__(self, host_concurrency=None, timeout=60):
+        self.host_concurrency = dict(HOST_CONCURRENCY)
+        if host_concurrency:
+            self.host_concurrency.update(host_concurrency)
+        self.semaphores = {}
+        self.client = httpx.AsyncClient(
+            headers=dict(session.headers),
+            timeout=timeout,
+            follow_redirects=True,
+            verify=ssl_context(),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+
+    def _semaphore(self, host):
+        if host not in self.semaphores:
+            limit = self.host_concurrency.get(host, DEFAULT_HOST_CONCURRENCY)
+            self.semaphores[host] = asyncio.Semaphore(limit)
+        return self.semaphores[host]
+
+    async def request(self, method, url, **kwargs):
+        cache = get_response_cache()
+        key = None
+        if cache is not None and cache.cacheable(method, url):
+            key = cache.key(method, url, kwargs.get("params"), kwargs.get("data"))
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
+        for attempt in range(MAX_RETRIES + 1):
+            async with self._semaphore(urlsplit(url).hostname):
+                limiter = get_rate_limiter(url)
+                if limiter is not None:
+                    await limiter.acquire_async()
+                resp = await self.client.request(method, url, **kwargs)
+            if resp.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                break
+            await asyncio.sleep(retry_delay(resp, attempt))
+
+        if key is not None and resp.status_code == 200:
+            cache.set(key, url, resp)
+
+        return resp
+
+
+def run_async(func, *args, **kwargs):
+    """
+    Run an async fetcher, `func(requester, *args, **kwargs)`, to completion
+    with its own AsyncRequester.
+
+    The synchronous entry points of the pipeline are thin wrappers around
+    their async implementation, so the two can't drift apart. Must not be
+    called from a running event loop; worker threads are fine.
+    """
 
-    time.sleep(RATE_LIMIT_INTERVAL)
+    async def main():
+        async with AsyncRequester() as requester:
+            return await func(requester, *args, **kwargs)
 
-    return resp
\ No newline at end of file
+    return asyncio.run(main())
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The service imports its modules from ligify/ (as `predict.*`, `utils`, ...)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "ligify"))
+
+# Keep tests off the shared response and codon caches
+os.environ.setdefault("LIGIFY_CACHE", "0")
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+from Bio import SeqIO
+
+from genbank import create_genbank
+
+GOLDEN = os.path.join(os.path.dirname(create_genbank.__file__), "pLigifyVprR.gb")
+
+
+@pytest.fixture
+def golden():
+    with open(GOLDEN) as handle:
+        text = handle.read()
+    record = SeqIO.read(GOLDEN, "genbank")
+    features = {f.qualifiers["label"][0]: f for f in record.features}
+    # The promoter is inserted as given and annotated on the reverse strand
+    promoter = features["VprR_promoter"].location
+    return {
+        "text": text,
+        "promoter_seq": str(record.seq[promoter.start : promoter.end]),
+        "regulator_seq": str(features["VprR"].extract(record.seq)),
+        "regulator_protein_seq": features["VprR protein"].qualifiers["translation"][0],
+    }
+
+
+def test_vprr_plasmid_matches_golden_file(golden, monkeypatch):
+    # Codon optimization is randomized; reuse the regulator DNA of the file
+    monkeypatch.setattr(create_genbank, "codon_opt", lambda protein: golden["regulator_seq"])
+
+    result = create_genbank.create_genbank(
+        "VprR", "4-ethylphenol", golden["promoter_seq"], golden["regulator_protein_seq"]
+    )
+
+    # The file was written with a placeholder record ID; create_genbank uses
+    # the regulator name for it
+    expected = golden["text"].replace("ACCESSION   123456789\n", "ACCESSION   VprR\n")
+    expected = expected.replace("VERSION     123456789\n", "VERSION     VprR\n")
+    assert result == expected
@@ -0,0 +1,106 @@
+"""
+The SPARQL backend against the REST search, on hand-written fixtures.
+
+`data/uniprot_sparql_genes.json` and `data/uniprot_search_genes.json` are
+not captured from sparql.uniprot.org or rest.uniprot.org. They are written
+in the shape of those endpoints' responses for the same three entries, so
+these tests cover how each backend maps its response to protein dicts, not
+what the live endpoints return.
+"""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+from conftest import DATA_DIR
+from predict import chemical2enzymes
+from predict.uniprot_sparql import proteins_query
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.is_success = True
+        self.links = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeRequester:
+    """Answers every request with one fixture response body."""
+
+    def __init__(self, path):
+        with open(os.path.join(DATA_DIR, path)) as handle:
+            self.text = handle.read()
+        self.calls = []
+
+    async def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return FakeResponse(self.text)
+
+
+@pytest.fixture
+def sparql_backend(monkeypatch):
+    monkeypatch.setattr(chemical2enzymes, "GENE_BACKEND", "sparql")
+
+
+def test_sparql_proteins_match_rest_search(sparql_backend):
+    requester = FakeRequester("uniprot_sparql_genes.json")
+    proteins = asyncio.run(
+        chemical2enzymes.fetch_genes_batch_async(requester, ["RHEA:25290", "RHEA:10000"], True, 10)
+    )
+
+    # One query for both reactions
+    assert len(requester.calls) == 1
+    method, url, kwargs = requester.calls[0]
+    assert (method, url) == ("POST", chemical2enzymes.SPARQL_URL)
+
+    rest = chemical2enzymes.parse_genes(FakeRequester("uniprot_search_genes.json").text)
+    by_accession = lambda found: sorted(found, key=lambda p: p["enzyme"]["uniprot_id"])
+    assert by_accession(proteins["RHEA:25290"]) == by_accession(rest)
+    assert proteins["RHEA:10000"] == []
+
+
+def test_sparql_protein_shape(sparql_backend):
+    requester = FakeRequester("uniprot_sparql_genes.json")
+    proteins = asyncio.run(chemical2enzymes.fetch_genes_async(requester, "RHEA:25290", True, 10))
+
+    assert proteins == [
+        {
+            "organism": [
+                "Bacteria", "Pseudomonadati", "Pseudomonadota", "Gammaproteobacteria",
+                "Enterobacterales", "Enterobacteriaceae", "Escherichia",
+            ],
+            "enzyme": {
+                "description": "Aldehyde-alcohol dehydrogenase",
+                "uniprot_id": "P0A9Q7",
+                "dois": ["10.1016/0378-1119(89)90174-5", "10.1093/dnares/3.6.363"],
+                "ncbi_id": "NP_415757.1",
+            },
+        },
+        {
+            "organism": [
+                "Bacteria", "Pseudomonadati", "Pseudomonadota", "Gammaproteobacteria",
+                "Pseudomonadales", "Pseudomonadaceae", "Pseudomonas",
+            ],
+            "enzyme": {
+                "description": None,
+                "uniprot_id": "Q9I4V0",
+                "dois": [],
+                "ncbi_id": "AAG05122.1",
+            },
+        },
+    ]
+
+
+def test_proteins_query():
+    query = proteins_query(["RHEA:25290", "RHEA:25290", "10000"], False, 7)
+
+    assert query.count("SELECT ?rhea ?protein WHERE") == 2
+    assert "VALUES ?rhea { rh:25290 }" in query
+    assert "VALUES ?rhea { rh:10000 }" in query
+    assert "up:reviewed false" in query
+    assert query.count("LIMIT 7") == 2